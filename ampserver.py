@@ -4,46 +4,96 @@ from twisted.internet import reactor
 # python imports
 import time
 import random
+import itertools
+from collections import deque
+
+# numpy imports
+import numpy
 
 # defender imports
 import serverfactory
 import events
 import mapgrid
+import mapartifact
+import movement
+import flowfield
+import stats
 
 
 class ProgramClock():
     '''
-    sends events to the event manager to update all event listeners
-    uses python time.time() to get the delta time.
-    The delta time (change in time since the last current time) is
-    sent to the TickEvent. Different parts of the program use delta
-    time to determine how far ahead it needs to step
-    (this is used especially in the game physics)
+    sends events to the event manager to update all event listeners.
+    The game is stepped at a fixed rate so it plays the same no matter
+    how busy the server is. Real time (from python time.time()) goes
+    into an accumulator, and every 1 / FPS seconds of it becomes one
+    TickEvent with the same delta time and the next tick number.
+
+    If the server falls behind, one run only catches up
+    max_catch_up_steps ticks and the rest of the time is dropped,
+    so the game slows down instead of falling further behind.
+    Ticks that take longer than tick_budget seconds are recorded
     '''
     def __init__(self, eventManager):
         self.eventManager = eventManager
-        self.eventManager.add_listener(self)
+        self.eventManager.add_listener(self, ['Program Quit Event'])
             
         self.initial_time = time.time()
         self.current_time = self.initial_time
         self.FPS = 60.0
+        self.step_time = 1.0 / self.FPS # the delta time of every tick
 
-        self.running = True
+        self.accumulator = 0.0 # real time that hasn't been stepped yet
+        self.tick_number = 0
+        self.max_catch_up_steps = 5
+        self.dropped_time = 0.0 # real time we gave up on catching up to
 
+        self.tick_budget = self.step_time # seconds one tick may take
+        self.budget_overruns = 0
+        self.recent_overruns = deque(maxlen=100) # (tick number, seconds the tick took)
+        self.longest_tick_time = 0.0
 
-    def run(self):
-        if self.running == True:
-            reactor.callLater((1.0 / self.FPS), self.run)
-        else:
-            pass
+        self.running = True
 
+    def run(self):
         self.last_time = self.current_time
         self.current_time = time.time()
-        self.delta_time = self.current_time - self.last_time # get delta time
+        self.accumulator += self.current_time - self.last_time
+
+        steps = 0
+        while self.accumulator >= self.step_time and steps < self.max_catch_up_steps:
+            self.accumulator -= self.step_time
+            steps += 1
+            self._step()
 
-        event = events.TickEvent(self.delta_time)
+        if self.accumulator >= self.step_time:
+            # too far behind to catch up, keep only the part of a tick we're into
+            remaining_time = self.accumulator % self.step_time
+            self.dropped_time += self.accumulator - remaining_time
+            self.accumulator = remaining_time
+
+        if self.running == True:
+            # wake up when the next tick is due
+            reactor.callLater(max(self.step_time - self.accumulator, 0.0), self.run)
+
+    def _step(self):
+        self.tick_number += 1
+        tick_start_time = time.time()
+
+        event = events.TickEvent(self.step_time, self.tick_number)
         self.eventManager.post(event)
 
+        tick_time = time.time() - tick_start_time
+        self.longest_tick_time = max(self.longest_tick_time, tick_time)
+        if self.eventManager.stats:
+            self.eventManager.stats.record_phase_time('tick', tick_time)
+        if tick_time > self.tick_budget:
+            self.budget_overruns += 1
+            self.recent_overruns.append((self.tick_number, tick_time))
+
+    def get_simulation_time(self):
+        '''how much game time has been stepped'''
+        return self.tick_number * self.step_time
+
     def _stop(self):
         self.running = False
 
@@ -82,6 +132,10 @@ class ProgramClock():
 ##                self.created_enemies += 1
 ##                self._create_enemy()
 
+# object ids are small so they pack into a few bytes,
+# and are never reused the way id() can be
+object_ids = itertools.count(1)
+
 class ServerStateObject():
     def __init__(self):
         self.object_name = ''
@@ -91,10 +145,17 @@ class ServerStateObject():
         self.state = None
         self.grid_position = None
         self.previous_grid_position = None
+        self.spatialHash = None
+        self.changed_objects = None # the server view's set of objects that changed this tick
         
-        self.sent_full_dead_state = False # we only need to let the client know we're dead once
         self.sent_changed_dead_state = False # we only need to let the client know we're dead once
 
+    def set_changed(self):
+        '''puts us in the changed objects so we are sent in the next changed state'''
+        self.state_changed = True
+        if self.changed_objects is not None:
+            self.changed_objects.add(self)
+
     def state_has_changed(self):
         if self.state_changed:
             self.state_changed = False
@@ -104,7 +165,7 @@ class ServerStateObject():
 
     def set_id(self):
         '''sets the id for this object'''
-        self.id = id(self)
+        self.id = next(object_ids)
 
     def get_id(self):
         return self.id
@@ -112,6 +173,22 @@ class ServerStateObject():
     def set_grid_position(self):
         self.previous_grid_position = self.grid_position
         self.grid_position = mapgrid.convert_position_to_grid_position(self.position, self.tile_size)
+        if self.spatialHash:
+            # only changes buckets when we moved into a new grid cell
+            self.spatialHash.move(self.id, self.get_pixel_position())
+
+    def add_to_spatial_hash(self, spatialHash):
+        '''call after set_id, the spatial hash keeps track of us by id'''
+        self.spatialHash = spatialHash
+        self.spatialHash.insert(self.id, self.get_pixel_position())
+
+    def remove_from_spatial_hash(self):
+        if self.spatialHash:
+            self.spatialHash.remove(self.id)
+            self.spatialHash = None
+
+    def get_pixel_position(self):
+        return self.position
 
     def _get_object_state(self):
         '''packages our state into a dict'''
@@ -122,21 +199,26 @@ class ServerStateObject():
                         'object_state': self.state}
         return object_state
 
+    def get_despawned_state(self):
+        '''tells a client we went out of its view'''
+        object_state = {'object_type': self.object_type,
+                        'object_id': self.id,
+                        'object_position': [0.0, 0.0],
+                        'object_velocity': [0.0, 0.0],
+                        'object_state': 'despawned'}
+        return object_state
+
     def package_state(self, request_type):
         '''package our state so we can easily send it to the clients
 
         request type can be either 'full' or 'changed'
-        we only want to send our state one time to each of the
-        requests, if we are dead and we send it one time to each
-        of those requests then we can determine that the clients know
-        we are dead, so we can change our state to pending removal
+        full states are only made when someone asks for one, so only
+        the changed state counts: once it told every client we are dead
+        we can change our state to pending removal on the next update
         '''
         if request_type == 'full':
             if self.id:
                 object_state = self._get_object_state()
-                if self.state == 'dead':
-                    # we can now request removal from the game because we told the clients we are dead
-                    self.sent_full_dead_state = True
             else:
                 raise RuntimeError(str(self) + ' has no id')
 
@@ -151,9 +233,6 @@ class ServerStateObject():
         else:
             raise RuntimeError(str(request_type))
 
-        if self.sent_full_dead_state == True and self.sent_changed_dead_state == True:
-            self.state = 'pending removal'
-
         return object_state
         
     def update(self, delta_time):
@@ -163,11 +242,12 @@ class CharacterState(ServerStateObject):
     '''
     Represents a character object in the game state
     '''
-    def __init__(self, client_id, client_number, collisionGrid, tile_size):
+    def __init__(self, client_id, client_number, collisionGrid, spatialHash, changed_objects, tile_size):
         ServerStateObject.__init__(self)
 
         self.client_id = client_id
         self.collisionGrid = collisionGrid
+        self.changed_objects = changed_objects
         self.tile_size = tile_size
         
         self.state = 'alive'
@@ -176,175 +256,25 @@ class CharacterState(ServerStateObject):
         self.ai_grid_strength = 0.1
         
         self.life = 100
-        self.movement_speed = 3
+        self.movement_speed = movement.CHARACTER_MOVEMENT_SPEED
         self.position = [0, 0]
         self.velocity = [0.0,0.0]
         
         self.position_has_changed = True
-        self.state_changed = True
+        self.set_changed()
 
         self.set_id()
+        self.add_to_spatial_hash(spatialHash)
+        self.set_grid_position()
 
     def get_position(self):
         return self.position
 
-    def _push_position_to_nearest_open_tile(self, left_position, right_position,
-                                            top_position, bottom_position,
-                                            colliding_grid_position):
-        rect_left = left_position
-        rect_right = right_position
-        rect_top = top_position
-        rect_bottom = bottom_position
-        rect_top_left = [rect_left, rect_top] 
-        
-        tile_left = (colliding_grid_position[0] * self.tile_size) + 1
-        tile_right = tile_left + (self.tile_size - 1)
-        tile_top = (colliding_grid_position[1] * self.tile_size) + 1
-        tile_bottom = tile_top + (self.tile_size - 1)
-        
-        top_displacement = (tile_top - rect_bottom) - 2
-        bottom_displacement = tile_bottom - rect_top
-        left_displacement = (tile_left - rect_right) - 2
-        right_displacement = tile_right - rect_left
-
-        squared_top_displacement = {'name': 'squared_top_displacement',
-                                    'value': top_displacement ** 2}
-        squared_bottom_displacement = {'name': 'squared_bottom_displacement',
-                                       'value': bottom_displacement ** 2}
-        squared_left_displacement = {'name': 'squared_left_displacement',
-                                     'value': left_displacement ** 2}
-        squared_right_displacement = {'name': 'squared_right_displacement',
-                                      'value': right_displacement ** 2}
-        #print squared_top_displacement, squared_bottom_displacement, squared_left_displacement, squared_right_displacement
-
-        displacements = []
-        displacements.extend([squared_left_displacement,
-                              squared_right_displacement,
-                              squared_top_displacement,
-                              squared_bottom_displacement])
-
-        # Sorting all the displacements to find the smallest one
-        sorted_displacements = []
-        # for all our unsorted displacements
-        for d in displacements:
-            # go through all the sorted displacements
-
-            if len(sorted_displacements) == 0:
-                sorted_displacements.append(d)
-            else:
-                for list_index in range(0, (len(sorted_displacements) + 1)):
-
-                    try:
-                        # if the unsorted one is greater than the current sorted one
-                        if d['value'] > sorted_displacements[list_index]['value']:
-                            if len(sorted_displacements) < (list_index - 1):
-                                sorted_displacements.append(d)
-                                break
-                            else:
-                                pass
-                        else:
-                            # if its less
-                            sorted_displacements.insert(list_index, d)
-                            break
-                            
-                    except IndexError:
-                        sorted_displacements.append(d)
-
-        smallest_displacement = sorted_displacements[0]
-
-        if smallest_displacement['name'] == 'squared_top_displacement':
-            rect_top_left[1] += top_displacement
-        elif smallest_displacement['name'] == 'squared_bottom_displacement':
-            rect_top_left[1] += bottom_displacement
-        elif smallest_displacement['name'] == 'squared_left_displacement':
-            rect_top_left[0] += left_displacement
-        elif smallest_displacement['name'] == 'squared_right_displacement':
-            rect_top_left[0] += right_displacement
-       
-        return rect_top_left
-
     def move(self, keyboard_input):
-        # move in given direction
-        if keyboard_input == 'UP':
-            self.position[1] -= self.movement_speed
-        elif keyboard_input == 'DOWN':
-            self.position[1] += self.movement_speed
-        elif keyboard_input == 'LEFT':
-            self.position[0] -= self.movement_speed
-        elif keyboard_input == 'RIGHT':
-            self.position[0] += self.movement_speed
-
-        # diagonal movement
-        elif keyboard_input == 'LEFTUP':
-            self.position[0] -= (self.movement_speed * .707)
-            self.position[1] -= (self.movement_speed * .707)
-        elif keyboard_input == 'RIGHTUP':
-            self.position[0] += (self.movement_speed * .707)
-            self.position[1] -= (self.movement_speed * .707)
-        elif keyboard_input == 'LEFTDOWN':
-            self.position[0] -= (self.movement_speed * .707)
-            self.position[1] += (self.movement_speed * .707)
-        elif keyboard_input == 'RIGHTDOWN':
-            self.position[0] += (self.movement_speed * .707)
-            self.position[1] += (self.movement_speed * .707)
-        # pixel position
-        self.position = [self.position[0], self.position[1]]
-
-        ##### COLLISIONS WITH WALLS #####
-        # pixel positions
-        left_position = self.position[0]
-        right_position = self.position[0] + (self.tile_size - 1)
-        top_position = self.position[1]
-        bottom_position = self.position[1] + (self.tile_size - 1)
-
-        top_left_position = [left_position, top_position]
-        top_right_position = [right_position, top_position]
-        bottom_left_position = [left_position, bottom_position]
-        bottom_right_position = [right_position, bottom_position]
-        # grid positions
-
-        top_left_grid_position = mapgrid.convert_position_to_grid_position(top_left_position, self.tile_size)
-        top_right_grid_position = mapgrid.convert_position_to_grid_position(top_right_position, self.tile_size)
-        bottom_left_grid_position = mapgrid.convert_position_to_grid_position(bottom_left_position, self.tile_size)
-        bottom_right_grid_position = mapgrid.convert_position_to_grid_position(bottom_right_position, self.tile_size)
-
-        if self.collisionGrid.is_tile_open(top_left_grid_position) == False:
-            self.position = self._push_position_to_nearest_open_tile(left_position,
-                                                                     right_position,
-                                                                     top_position,
-                                                                     bottom_position,
-                                                                     top_left_grid_position)
-        if self.collisionGrid.is_tile_open(top_right_grid_position) == False:
-            self.position = self._push_position_to_nearest_open_tile(left_position,
-                                                                     right_position,
-                                                                     top_position,
-                                                                     bottom_position,
-                                                                     top_right_grid_position)
-        if self.collisionGrid.is_tile_open(bottom_left_grid_position) == False:
-            self.position = self._push_position_to_nearest_open_tile(left_position,
-                                                                     right_position,
-                                                                     top_position,
-                                                                     bottom_position,
-                                                                     bottom_left_grid_position)
-        if self.collisionGrid.is_tile_open(bottom_right_grid_position) == False:
-            self.position = self._push_position_to_nearest_open_tile(left_position,
-                                                                     right_position,
-                                                                     top_position,
-                                                                     bottom_position,
-                                                                     bottom_right_grid_position)
-
-
-
-            
-        self.state_changed = True
-
-        # HOW IT WILL WORK
-        # check if four corners are colliding
-        # for all grid positions that the colliding corners are in
-        # find the closest wall to push the cube out to
-        ##### get positions of walls,
-        ##### see which wall has the smallest distance to travel
-        # push the character out to that wall
+        self.position = movement.move_character(self.position, keyboard_input, self.movement_speed,
+                                                self.tile_size, self.collisionGrid)
+        self.set_grid_position()
+        self.set_changed()
 
     def update(self, delta_time):
         # so the server knows if this object needs something
@@ -352,6 +282,7 @@ class CharacterState(ServerStateObject):
         
         self.position[0] += self.velocity[0] * delta_time
         self.position[1] += self.velocity[1] * delta_time
+        self.set_grid_position()
 
         return command_request
 
@@ -554,10 +485,11 @@ class WallState(ServerStateObject):
     represents a wall object in the game state
     '''
     ##def __init__(self, collisionGrid, aiGrid, grid_position):
-    def __init__(self, collisionGrid, grid_position):
+    def __init__(self, collisionGrid, flowField, spatialHash, changed_objects, grid_position, tile_size):
         ServerStateObject.__init__(self)
 
         self.grid_position = grid_position
+        self.tile_size = tile_size
         self.state = 'alive'
         self.object_type = 'wall'
 
@@ -568,19 +500,25 @@ class WallState(ServerStateObject):
 ##        self.starting_generation = 1
 
         self.velocity = [0.0,0.0]
-        self.state_changed = True
 
         #self.ai_children_positions = []
 
         self.collisionGrid = collisionGrid
+        self.flowField = flowField
+        self.changed_objects = changed_objects
         ##self.aiGrid = aiGrid
         self.set_id()
+        self.set_changed()
+        self.add_to_spatial_hash(spatialHash)
         self._spawn()
 
     def _spawn(self):
-        ''' updates the collision grid and the ai grid'''
+        ''' updates the collision grid and the flow field'''
         
         self.collisionGrid.close_tile(self.grid_position)
+        self.flowField.tile_closed(self.grid_position)
+        # enemies come for walls too
+        self.flowField.move_target(self.id, self.grid_position)
 
 ##        self.aiGrid.add_source_to_grid(self.grid_position,
 ##                                       self.ai_grid_strength,
@@ -600,6 +538,9 @@ class WallState(ServerStateObject):
     def get_grid_position(self):
         return self.grid_position
 
+    def get_pixel_position(self):
+        return mapgrid.convert_grid_position_to_position(self.grid_position, self.tile_size)
+
 ##    def add_ai_child_position(self, child_position):
 ##        self.ai_children_positions.append(child_position)
 
@@ -615,9 +556,11 @@ class WallState(ServerStateObject):
 ##        self._remove_ai_children_positions()
         # remove the influence on the collision grid
         self.collisionGrid.open_tile(self.grid_position)
+        self.flowField.tile_opened(self.grid_position)
+        self.flowField.remove_target(self.id)
         # change our state
         self.state = 'dead'
-        self.state_changed = True
+        self.set_changed()
         print 'Wall destroyed'
 
     def get_attacked(self, attack_damage):
@@ -627,6 +570,9 @@ class WallState(ServerStateObject):
 
     def update(self, delta_time):
         command_request = {'request': None}
+        if self.state == 'dead' and self.sent_changed_dead_state:
+            # the clients know we are dead
+            self.state = 'pending removal'
         # if we're waiting to be removed from the game
         if self.state == 'pending removal':
             # request to be removed
@@ -634,140 +580,229 @@ class WallState(ServerStateObject):
 
         return command_request
 
-class ProjectileState(ServerStateObject):
-    '''represents a projectile in the server state'''
-    def __init__(self, collisionGrid, map_size, tile_size, spawn_position, destination_position):
-        ServerStateObject.__init__(self)
-
-        self.state = 'alive'
-        self.object_type = 'projectile'
+class ProjectileSystem():
+    '''
+    holds every projectile in the game as arrays instead of one object
+    each, so moving, bounds checking and bouncing thousands of
+    projectiles only takes a few numpy operations per tick
+    '''
+    ALIVE = 0
+    DEAD = 1
+    PENDING_REMOVAL = 2
+    STATE_NAMES = ['alive', 'dead', 'pending removal']
+
+    # every array that has one row per projectile
+    ARRAY_NAMES = ['ids', 'positions', 'velocities', 'grid_positions', 'previous_grid_positions',
+                   'direction_changes', 'states', 'state_changed', 'sent_changed_dead_state']
+    
+    def __init__(self, collisionGrid, spatialHash, map_size, tile_size, capacity=256):
         self.collisionGrid = collisionGrid
+        self.spatialHash = spatialHash
         self.map_size = map_size
         self.tile_size = tile_size
 
-        self.position = [spawn_position[0], spawn_position[1]]
-        self.set_grid_position()
         self.speed = 300
-        self._set_velocity(destination_position)
-        self.direction_changes = 0
         self.max_direction_changes = 5
-        
-        self.set_id()
-        
-        self.state_changed = True
 
-        print 'New projectile... id: ' + str(self.id)
-
-    def _set_velocity(self, destination_position):
-        if destination_position:
-            # set a vector for the target
-            vector_target_position = mapgrid.Vector(destination_position[0], destination_position[1])
-            # set a vector for our position
-            vector_position = mapgrid.Vector(self.position[0], self.position[1])
-            # subtract the vectors to find total displacement
-            displacement_to_target = vector_target_position - vector_position
-            # normalize to find direction to move
-            velocity = displacement_to_target.normalize()
-            # set that as our velocity
-            self.velocity = [velocity[0] * self.speed, velocity[1] * self.speed]
-
-    def _switch_x_direction(self):
-        self.velocity = [self.velocity[0] * -1, self.velocity[1]]
-
-    def _switch_y_direction(self):
-        self.velocity = [self.velocity[0], self.velocity[1] * -1]
+        self.count = 0 # rows 0 to count - 1 are projectiles, the rest is free space
+        self.capacity = capacity
+        self.ids = numpy.zeros(capacity, numpy.int64)
+        self.positions = numpy.zeros((capacity, 2), numpy.float64)
+        self.velocities = numpy.zeros((capacity, 2), numpy.float64)
+        self.grid_positions = numpy.zeros((capacity, 2), numpy.int64)
+        self.previous_grid_positions = numpy.zeros((capacity, 2), numpy.int64)
+        self.direction_changes = numpy.zeros(capacity, numpy.int32)
+        self.states = numpy.zeros(capacity, numpy.uint8)
+        self.state_changed = numpy.zeros(capacity, numpy.bool_)
+        # we only need to let the client know we're dead once
+        self.sent_changed_dead_state = numpy.zeros(capacity, numpy.bool_)
+
+        self.id_rows = None # object id: row, rebuilt after rows move
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, object_id):
+        return self._get_row(object_id) is not None
+
+    def _grow(self):
+        '''doubles the room we have for projectiles'''
+        self.capacity *= 2
+        for name in self.ARRAY_NAMES:
+            array = getattr(self, name)
+            grown_array = numpy.zeros((self.capacity,) + array.shape[1:], array.dtype)
+            grown_array[:self.count] = array[:self.count]
+            setattr(self, name, grown_array)
+
+    def _get_row(self, object_id):
+        if self.id_rows is None:
+            self.id_rows = dict(zip(self.ids[:self.count].tolist(), range(self.count)))
+        return self.id_rows.get(object_id)
+
+    def _get_velocity(self, spawn_position, destination_position):
+        # set a vector for the target
+        vector_target_position = mapgrid.Vector(destination_position[0], destination_position[1])
+        # set a vector for our position
+        vector_position = mapgrid.Vector(spawn_position[0], spawn_position[1])
+        # subtract the vectors to find total displacement
+        displacement_to_target = vector_target_position - vector_position
+        # normalize to find direction to move
+        velocity = displacement_to_target.normalize()
+        return [velocity[0] * self.speed, velocity[1] * self.speed]
+
+    def add_projectile(self, spawn_position, destination_position):
+        if self.count == self.capacity:
+            self._grow()
+
+        row = self.count
+        object_id = next(object_ids)
+        grid_position = mapgrid.convert_position_to_grid_position(spawn_position, self.tile_size)
+
+        self.ids[row] = object_id
+        self.positions[row] = spawn_position
+        self.velocities[row] = self._get_velocity(spawn_position, destination_position)
+        self.grid_positions[row] = grid_position
+        self.previous_grid_positions[row] = grid_position
+        self.direction_changes[row] = 0
+        self.states[row] = self.ALIVE
+        self.state_changed[row] = True
+        self.sent_changed_dead_state[row] = False
+        self.count += 1
+
+        if self.id_rows is not None:
+            self.id_rows[object_id] = row
+        self.spatialHash.insert(object_id, spawn_position)
+        return object_id
+
+    def _remove_pending_projectiles(self):
+        '''removes projectiles every client knows are dead, the rest move up to fill the gaps'''
+        states = self.states[:self.count]
+        states[(states == self.DEAD) & self.sent_changed_dead_state[:self.count]] = self.PENDING_REMOVAL
+        pending = states == self.PENDING_REMOVAL
+        if not pending.any():
+            return
         
-    def _switch_direction(self):
-        prev_x = self.previous_grid_position[0]
-        prev_y = self.previous_grid_position[1]
-
-        x = self.grid_position[0]
-        y = self.grid_position[1]
-
-        delta_x = x - prev_x
-        delta_y = y - prev_y
-
-        (top_left, top_mid, top_right,
-         center_left, center_mid, center_right,
-         bottom_left, bottom_mid, bottom_right) = self.collisionGrid.get_surrounding_tiles(x, y)
-
-        if delta_x < 0:
-            if delta_y < 0:
-                # top left
-                if center_left == 0:# if the spot is open
-                    self._switch_x_direction()
-                if top_mid == 0:# if the spot is open
-                    self._switch_y_direction()
-                    
-            elif delta_y == 0:
-                # center left
-                self._switch_x_direction()
-                
-            elif delta_y > 0:
-                # bot left
-                if center_left == 0:# if the spot is open
-                    self._switch_x_direction()
-                if bottom_mid == 0:# if the spot is open
-                    self._switch_y_direction()
-
-        elif delta_x == 0:
-            if delta_y < 0:# top mid
-                self._switch_y_direction()
-                
-            elif delta_y == 0:# center mid
-                self._switch_x_direction()
-                self._switch_y_direction()
-                
-            elif delta_y > 0:# bot mid
-                self._switch_y_direction()
-
-        elif delta_x > 0:
-            if delta_y < 0:# top right
-                if center_right == 0:# if the spot is open
-                    self._switch_x_direction()
-                if top_mid == 0:# if the spot is open
-                    self._switch_y_direction()
-                    
-            elif delta_y == 0:# center right
-                self._switch_x_direction()
-                
-            elif delta_y > 0:# bot right
-                if center_right == 0:# if the spot is open
-                    self._switch_x_direction()
-                if bottom_mid == 0:# if the spot is open
-                    self._switch_y_direction()
+        for object_id in self.ids[:self.count][pending].tolist():
+            self.spatialHash.remove(object_id)
+
+        remaining_rows = numpy.nonzero(~pending)[0]
+        for name in self.ARRAY_NAMES:
+            array = getattr(self, name)
+            array[:len(remaining_rows)] = array[remaining_rows]
+        self.count = len(remaining_rows)
+        self.id_rows = None
+
+    def _switch_directions(self, rows):
+        '''
+        bounces the projectiles in rows off the closed tile they moved into.
+        which way we bounce depends on the direction we came into the tile from:
+        straight in flips that direction, diagonally in flips each direction
+        that has an open tile beside us, not moving at all flips both
+        '''
+        grid_positions = self.grid_positions[rows]
+        grid_deltas = numpy.sign(grid_positions - self.previous_grid_positions[rows])
+        delta_x = grid_deltas[:, 0]
+        delta_y = grid_deltas[:, 1]
+
+        side_x_grid_positions = grid_positions.copy()
+        side_x_grid_positions[:, 0] += delta_x
+        side_y_grid_positions = grid_positions.copy()
+        side_y_grid_positions[:, 1] += delta_y
+        side_x_open = self.collisionGrid.get_tile_values(side_x_grid_positions) == 0
+        side_y_open = self.collisionGrid.get_tile_values(side_y_grid_positions) == 0
+
+        not_moved = (delta_x == 0) & (delta_y == 0)
+        switch_x = ((delta_x != 0) & ((delta_y == 0) | side_x_open)) | not_moved
+        switch_y = ((delta_y != 0) & ((delta_x == 0) | side_y_open)) | not_moved
+
+        self.velocities[rows[switch_x], 0] *= -1
+        self.velocities[rows[switch_y], 1] *= -1
 
-##    def update(self, delta_time, enemies):
     def update(self, delta_time):
+        self._remove_pending_projectiles()
+        count = self.count
+        if count == 0:
+            return
         
-        command_request = {'request': None}
-        # if we're waiting to be removed from the game
-        if self.state == 'pending removal':
-            # request to be removed
-            command_request['request'] = 'removal request'
-            return command_request
-        
-        self.position[0] += (self.velocity[0] * delta_time)
-        self.position[1] += (self.velocity[1] * delta_time)
+        positions = self.positions[:count]
+        states = self.states[:count]
+        grid_positions = self.grid_positions[:count]
+        previous_grid_positions = self.previous_grid_positions[:count]
+
+        positions += self.velocities[:count] * delta_time
+
+        # leaving the map kills the projectile
+        off_map = ((positions[:, 0] < 0) | (positions[:, 0] > self.map_size[0]) |
+                   (positions[:, 1] < 0) | (positions[:, 1] > self.map_size[1]))
+        states[off_map] = self.DEAD
+        self.state_changed[:count] |= off_map
+
+        previous_grid_positions[:] = grid_positions
+        grid_positions[:] = numpy.floor(positions / self.tile_size)
+
+        # bounce off walls
+        hit_rows = numpy.nonzero(self.collisionGrid.get_tile_values(grid_positions) == 1)[0]
+        if len(hit_rows):
+            self._switch_directions(hit_rows)
+            self.direction_changes[hit_rows] += 1
+            self.state_changed[hit_rows] = True
+            worn_out_rows = hit_rows[self.direction_changes[hit_rows] >= self.max_direction_changes]
+            states[worn_out_rows] = self.DEAD
+
+        # only projectiles that moved into a new grid cell touch the spatial hash
+        moved_rows = numpy.nonzero((grid_positions != previous_grid_positions).any(axis=1))[0]
+        if len(moved_rows):
+            moved_ids = self.ids[moved_rows].tolist()
+            moved_positions = positions[moved_rows].tolist()
+            for object_id, position in zip(moved_ids, moved_positions):
+                self.spatialHash.move(object_id, position)
+
+    def _package_rows(self, rows):
+        object_states = []
+        for object_id, position, velocity, state in zip(self.ids[rows].tolist(),
+                                                        self.positions[rows].tolist(),
+                                                        self.velocities[rows].tolist(),
+                                                        self.states[rows].tolist()):
+            object_states.append({'object_type': 'projectile',
+                                  'object_id': object_id,
+                                  'object_position': position,
+                                  'object_velocity': velocity,
+                                  'object_state': self.STATE_NAMES[state]})
+        return object_states
+
+    def package_states(self, request_type):
+        '''
+        the same as ServerStateObject.package_state for all the projectiles,
+        'full' packages every projectile, 'changed' only the ones that changed.
+        once the changed state has told the clients a projectile is dead it
+        is removed on the next update
+        '''
+        count = self.count
+        if request_type == 'full':
+            rows = numpy.arange(count)
+        elif request_type == 'changed':
+            rows = numpy.nonzero(self.state_changed[:count])[0]
+            self.state_changed[rows] = False
+            self.sent_changed_dead_state[rows[self.states[rows] == self.DEAD]] = True
+        else:
+            raise RuntimeError(str(request_type))
 
-        if self.position[0] < 0 or self.position[0] > self.map_size[0]:
-            self.state = 'dead'
-            self.state_changed = True
-        if self.position[1] < 0 or self.position[1] > self.map_size[1]:
-            self.state = 'dead'
-            self.state_changed = True
+        return self._package_rows(rows)
 
-        self.set_grid_position()
+    def get_state(self, object_id):
+        return self.STATE_NAMES[self.states[self._get_row(object_id)]]
 
-        if not self.collisionGrid.is_tile_open(self.grid_position): # if the position is closed
-            self._switch_direction()
-            self.direction_changes += 1
-            self.state_changed = True
-            if self.direction_changes >= self.max_direction_changes:
-                self.state = 'dead'
-                self.state_changed = True
+    def get_object_state(self, object_id):
+        return self._package_rows([self._get_row(object_id)])[0]
 
-        return command_request
+    def get_despawned_state(self, object_id):
+        '''tells a client a projectile went out of its view'''
+        object_state = {'object_type': 'projectile',
+                        'object_id': object_id,
+                        'object_position': [0.0, 0.0],
+                        'object_velocity': [0.0, 0.0],
+                        'object_state': 'despawned'}
+        return object_state
 
 class ClientState(ServerStateObject):
     '''
@@ -784,9 +819,25 @@ class ClientState(ServerStateObject):
         self.client_ip = client_ip
 
         self.character_id = None
+        self.acknowledged_sequence = None # the last changed game state the client applied
+
+        # input frames waiting to be applied, one a step
+        self.input_frames = deque()
+        self.last_input_sequence = 0
+        self.missed_input_frames = 0 # input frames are not answered, gaps in the sequence are counted here
+        self.last_applied_input_sequence = 0 # told to the client so it can replay the frames after it
 
         self.set_id()
 
+    def add_input_frame(self, input_frame):
+        if input_frame.sequence <= self.last_input_sequence:
+            # we already have this one, or it came after a newer one
+            return
+        # a lost frame's step, shots and walls never happen, the client's prediction corrects itself
+        self.missed_input_frames += input_frame.sequence - self.last_input_sequence - 1
+        self.last_input_sequence = input_frame.sequence
+        self.input_frames.append(input_frame)
+
     def set_character_id(self, character_id):
         self.character_id = character_id
 
@@ -795,12 +846,19 @@ class ServerView():
     Controls game state objects
     such as character, projectile etc...
     '''
-    def __init__(self, eventManager, object_registry):
+    def __init__(self, eventManager, object_registry, mapArtifact=None):
         self.object_registry = object_registry
         self.eventManager = eventManager
-        self.eventManager.add_listener(self)
+        self.eventManager.add_listener(self, ['Tick Event',
+                                              'New Client Connected Event',
+                                              'Complete Game State Request Event',
+                                              'Game State Acknowledge Event',
+                                              'Input Frame Event'])
 
         self.map_dimensions = [25, 20]
+        if mapArtifact:
+            # a pre-built map, see mapartifact.MapLibrary
+            self.map_dimensions = mapArtifact.map_dimensions
         self.tile_size = 32
         self.map_width = self.map_dimensions[0] * self.tile_size
         self.map_height = self.map_dimensions[1] * self.tile_size
@@ -810,21 +868,90 @@ class ServerView():
         self.characters = {}
 ##        self.enemies = {}
         self.walls = {}
-        self.projectiles = {}
-        self.collisionGrid = mapgrid.CollisionGrid(self.map_dimensions)
+        self.mapArtifact = mapArtifact
+        if self.mapArtifact:
+            self.collisionGrid = self.mapArtifact.get_collision_grid()
+        else:
+            self.collisionGrid = mapgrid.CollisionGrid(self.map_dimensions)
+
+        # every changed game state gets the next sequence number,
+        # clients acknowledge the last sequence they applied
+        self.sequence = 0
+        # clients interpolate between changed game states, so they only
+        # need one every replication_interval ticks (20 a second).
+        # Every state says how much game time had been stepped
+        self.replication_interval = 3
+        self.ticks_since_changed_state = 0
+        self.simulation_time = 0.0
+        self.sequence_server_time = 0.0 # the simulation time of the last changed state
+
+        # clients only get told about objects inside this many pixels
+        # (left and right, up and down) of their character
+        self.interest_area = [self.map_width, self.map_height]
+        # every character, wall and projectile by grid cell. It keeps the
+        # ids of everything that moved so interests are only updated for those
+        self.spatialHash = mapgrid.SpatialHash(self.tile_size, track_changes=True)
+        self.projectileSystem = ProjectileSystem(self.collisionGrid, self.spatialHash,
+                                                 self.map_size, self.tile_size)
+        self.client_interests = {} # client number: ids of the objects the client knows about
+        self.client_interest_rects = {} # client number: the area client_interests was worked out for
+        # what every client was sent for the last few changed states,
+        # (sequence, {client number: object states}). Each client gets
+        # everything that changed since the last one it acknowledged
+        self.snapshot_history = deque(maxlen=64)
+        # characters and walls put themselves in here when they change,
+        # so the changed state doesn't have to look at every object
+        self.changed_objects = set()
+
+        # the full state is only packaged when a client asks for it,
+        # and kept until something changes
+        self.full_state = None # (object states, sequence, client game states, server time)
+        self.full_state_is_stale = True
+
+        # how many input frames a client can get ahead of us before we catch up
+        self.max_buffered_input_frames = movement.MAX_BUFFERED_INPUT_FRAMES
 ##        self.aiGrid = mapgrid.AIGrid(self.map_dimensions)
+        # the way to the nearest character or wall from every tile, shared by every enemy.
+        # Only worked out when something asks for it
+        self.flowField = flowfield.FlowField(self.collisionGrid)
 
 ##        self.enemyGenerator = EnemyGenerator(self.eventManager)
 
-    def _process_user_keyboard_input_event(self, event):
-        # get client number
-        client_number = event.client_number
-        # get client object
-        client = self.clients[client_number]
-        # get client's charactr object
-        client_character = self.characters[client.character_id]
-        # tell character to move
-        client_character.move(event.keyboard_input)
+    def _process_input_frame_event(self, event):
+        client = self.clients.get(event.client_number)
+        if client:
+            client.add_input_frame(event)
+
+    def _apply_input_frames(self):
+        '''
+        every client gets one input frame applied a step, no matter how fast
+        it sends them. If a client is too far ahead we catch up, the shots
+        and walls of the frames we skip still happen but only the newest
+        direction moves the character. A character never moves more than
+        one step a step, so sending frames faster doesn't make it faster.
+        The client's prediction follows the same rule
+        '''
+        for client_number in self.clients:
+            client = self.clients[client_number]
+            
+            frame_count = min(len(client.input_frames), 1)
+            if len(client.input_frames) > self.max_buffered_input_frames:
+                frame_count = len(client.input_frames) - self.max_buffered_input_frames + 1
+                
+            direction = ''
+            for i in range(frame_count):
+                input_frame = client.input_frames.popleft()
+                client.last_applied_input_sequence = input_frame.sequence
+                for destination_position in input_frame.shots:
+                    self._shoot_projectile(client, destination_position)
+                for grid_position in input_frame.walls:
+                    self._place_wall(grid_position)
+                direction = input_frame.direction
+            if direction:
+                # get client's character object
+                client_character = self.characters[client.character_id]
+                # tell character to move
+                client_character.move(direction)
 
 ##    def _process_add_enemy_to_game_request_event(self, event):
 ##        '''
@@ -860,23 +987,21 @@ class ServerView():
 ##            elif enemy_center == [x + 1, y + 1]:
 ##                wall.get_attacked(attack_damage)
 
-    def _process_place_wall_request_event(self, event):
+    def _place_wall(self, grid_position):
         '''when the user wants to place a wall'''
-        if self.collisionGrid.is_tile_open(event.grid_position):
+        if self.collisionGrid.is_tile_open(grid_position):
             # add a wall to the game
-##            wall = WallState(self.collisionGrid, self.aiGrid, event.grid_position)
-            wall = WallState(self.collisionGrid, event.grid_position)
+##            wall = WallState(self.collisionGrid, self.aiGrid, grid_position)
+            wall = WallState(self.collisionGrid, self.flowField, self.spatialHash, self.changed_objects,
+                             grid_position, self.tile_size)
             self.walls[wall.get_id()] = wall
 
-    def _process_shoot_projectile_request_event(self, event):
+    def _shoot_projectile(self, client, destination_position):
         '''when the user wants to shoot a projectile'''
-        client_number = event.client_number
-        client = self.clients[client_number]
         character = self.characters[client.character_id]
         character_position = character.get_position()
         
-        projectile = ProjectileState(self.collisionGrid, self.map_size, self.tile_size, character_position, event.destination_position)
-        self.projectiles[projectile.get_id()] = projectile
+        self.projectileSystem.add_projectile(character_position, destination_position)
 
     def _add_client_to_game(self, client_number, client_ip):
         clientState = ClientState(client_number, client_ip)
@@ -884,14 +1009,36 @@ class ServerView():
         self._add_character_to_game(clientState.id, client_number)
 
     def _add_character_to_game(self, client_id, client_number):
-        characterState = CharacterState(client_id, client_number, self.collisionGrid, self.tile_size)
+        characterState = CharacterState(client_id, client_number, self.collisionGrid, self.spatialHash,
+                                        self.changed_objects, self.tile_size)
         # add the character to our characters group
         self.characters[characterState.id] = characterState
         # let the client know it's character id
         self.clients[client_number].set_character_id(characterState.id)
         
+    def _post_full_state(self):
+        '''
+        sends the full state, only packaging it again if something changed.
+        It always has the current sequence, clients that get it go on from
+        there. When changed states went out with nothing in them the one we
+        have is still right, it keeps the server time it was packaged at
+        '''
+        if self.full_state is None or self.full_state_is_stale:
+            self.full_state = self._prepare_full_state()
+            self.full_state_is_stale = False
+        elif self.full_state[1] != self.sequence:
+            object_states, sequence, client_game_states, server_time = self.full_state
+            self.full_state = (object_states, self.sequence, client_game_states, server_time)
+        
+        object_states, sequence, client_game_states, server_time = self.full_state
+        event = events.CompleteGameStateEvent(object_states, sequence, client_game_states, server_time)
+        self.eventManager.post(event)
+
     def _prepare_full_state(self):
-        ''' sends full state regardless of if the state has changed '''
+        '''
+        packages every object regardless of if the state has changed,
+        returns (object states, sequence, client game states, server time)
+        '''
         object_states = []
         default_state = object_state = {'object_type': 'default',
                                         'object_id': 000000,
@@ -931,21 +1078,23 @@ class ServerView():
             if not object_state:
                 raise RuntimeError('Object state: ' + str(object_state))
 
-        for object_id in self.projectiles:
-            current_object = self.projectiles[object_id]
-            if current_object.state == 'pending removal':
-                raise RuntimeError('Object state: ' + str(object_state))
-            
-            object_state = current_object.package_state('full')
-            object_states.append(object_state)
-            if not object_state:
-                raise RuntimeError('Object state: ' + str(object_state))
+        object_states.extend(self.projectileSystem.package_states('full'))
                 
-        event = events.CompleteGameStateEvent(object_states)
-        self.eventManager.post(event)
+        client_game_states = {}
+        for client_number in self.clients:
+            if client_number not in self.client_interests:
+                # a new client, it will know about everything in here
+                self._set_client_interests(client_number)
+            visible_object_ids = self.client_interests[client_number]
+            client_game_states[client_number] = [object_state for object_state in object_states
+                                                 if object_state['object_id'] in visible_object_ids]
+                
+        return object_states, self.sequence, client_game_states, self.sequence_server_time
 
     def _prepare_changed_state(self):
         ''' send state of objects that have changed their state '''
+        self.sequence += 1
+        self.sequence_server_time = self.simulation_time
         object_states = []
         default_state = object_state = {'object_type': 'default',
                                         'object_id': 000000,
@@ -955,13 +1104,14 @@ class ServerView():
         
         object_states.append(default_state)
         
-        for object_id in self.characters:
-            current_object = self.characters[object_id]
+        # only the characters and walls that changed since the last changed state
+        for current_object in self.changed_objects:
             if current_object.state_has_changed():
                 object_state = current_object.package_state('changed')
                 object_states.append(object_state)
                 if not object_state:
                     raise RuntimeError('Object state: ' + str(object_state))
+        self.changed_objects.clear()
 
 ##        for object_id in self.enemies:
 ##            current_object = self.enemies[object_id]
@@ -970,32 +1120,195 @@ class ServerView():
 ##                object_states.append(object_state)
 ##                if not object_state:
 ##                    raise RuntimeError('Object state: ' + str(object_state))
+
+        object_states.extend(self.projectileSystem.package_states('changed'))
                 
-        for object_id in self.walls:
-            current_object = self.walls[object_id]
-            if current_object.state_has_changed(): 
-                object_state = current_object.package_state('changed')
-                object_states.append(object_state)
-                if not object_state:
-                    raise RuntimeError('Object state: ' + str(object_state))
+        client_game_states = self._prepare_client_changed_states(object_states)
+        # the default state is always in there
+        if len(object_states) > 1 or any(client_game_states.values()):
+            self.full_state_is_stale = True
 
-        for object_id in self.projectiles:
-            current_object = self.projectiles[object_id]
-            if current_object.state_has_changed():
-                object_state = current_object.package_state('changed')
-                object_states.append(object_state)
-                if not object_state:
-                    raise RuntimeError('Object state: ' + str(object_state))
+        self.snapshot_history.append((self.sequence, client_game_states))
+        client_game_states, client_baselines = self._prepare_client_delta_states()
                 
-        event = events.ChangedGameStateEvent(object_states)
+        client_inputs = {}
+        for client_number in self.clients:
+            client = self.clients[client_number]
+            client_inputs[client_number] = (client.character_id, client.last_applied_input_sequence)
+                
+        event = events.ChangedGameStateEvent(object_states, self.sequence, client_game_states,
+                                             None, client_baselines, self.sequence_server_time,
+                                             client_inputs)
         self.eventManager.post(event)
 
+    def _get_object(self, object_id):
+        if object_id in self.characters:
+            return self.characters[object_id]
+        elif object_id in self.walls:
+            return self.walls[object_id]
+
+    def _get_object_state_name(self, object_id):
+        '''the state of any object, 'alive', 'dead', etc... None if it left the game'''
+        if object_id in self.projectileSystem:
+            return self.projectileSystem.get_state(object_id)
+        current_object = self._get_object(object_id)
+        if current_object:
+            return current_object.state
+
+    def _package_object_state(self, object_id):
+        if object_id in self.projectileSystem:
+            return self.projectileSystem.get_object_state(object_id)
+        return self._get_object(object_id)._get_object_state()
+
+    def _package_despawned_state(self, object_id):
+        if object_id in self.projectileSystem:
+            return self.projectileSystem.get_despawned_state(object_id)
+        return self._get_object(object_id).get_despawned_state()
+
+    def _get_interest_rect(self, client):
+        '''(left, top, right, bottom) of the interest area around the client's character'''
+        position = self.characters[client.character_id].get_position()
+        return (position[0] - self.interest_area[0], position[1] - self.interest_area[1],
+                position[0] + self.interest_area[0], position[1] + self.interest_area[1])
+
+    def _is_object_visible(self, object_id, interest_rect):
+        '''if the object is in the game and inside interest_rect'''
+        if object_id not in self.spatialHash:
+            return False
+        position = self.spatialHash.get_position(object_id)
+        left, top, right, bottom = interest_rect
+        if not (left <= position[0] <= right and top <= position[1] <= bottom):
+            return False
+        # objects that are leaving the game already told the client they died
+        return self._get_object_state_name(object_id) != 'pending removal'
+
+    def _set_client_interests(self, client_number):
+        '''works out everything the client can see from scratch, only done for new clients'''
+        client = self.clients[client_number]
+        interest_rect = self._get_interest_rect(client)
+        visible_object_ids = set([object_id for object_id in self.spatialHash.query_rect(*interest_rect)
+                                  if self._is_object_visible(object_id, interest_rect)])
+        visible_object_ids.add(client.character_id)
+        self.client_interests[client_number] = visible_object_ids
+        self.client_interest_rects[client_number] = interest_rect
+
+    def _prepare_client_changed_states(self, changed_object_states):
+        '''
+        filters the changed state down to what each client can see.
+        Objects coming into view are sent in full, objects going out
+        of view are sent as despawned.
+
+        What a client sees only changes for objects that moved, came
+        or went, and for the objects in the strips of the map its
+        interest area moved over, so only those are looked at
+        '''
+        changed_object_ids = set([object_state['object_id'] for object_state in changed_object_states])
+        moved_object_ids = self.spatialHash.pop_changed_object_ids()
+        
+        client_game_states = {}
+        for client_number in self.clients:
+            client = self.clients[client_number]
+            if client_number not in self.client_interests:
+                # it hasn't had the full state yet, everything it sees comes into view
+                self.client_interests[client_number] = set()
+                self.client_interest_rects[client_number] = None
+            visible_object_ids = self.client_interests[client_number]
+            interest_rect = self._get_interest_rect(client)
+            previous_interest_rect = self.client_interest_rects[client_number]
+
+            object_ids_to_check = set(moved_object_ids)
+            if previous_interest_rect is None:
+                object_ids_to_check.update(self.spatialHash.query_rect(*interest_rect))
+            elif interest_rect != previous_interest_rect:
+                for rect in (mapgrid.get_rect_difference(interest_rect, previous_interest_rect) +
+                             mapgrid.get_rect_difference(previous_interest_rect, interest_rect)):
+                    object_ids_to_check.update(self.spatialHash.query_rect(*rect))
+            self.client_interest_rects[client_number] = interest_rect
+
+            new_object_ids = []
+            despawned_object_states = []
+            for object_id in object_ids_to_check:
+                visible = object_id == client.character_id or self._is_object_visible(object_id, interest_rect)
+                if visible and object_id not in visible_object_ids:
+                    visible_object_ids.add(object_id)
+                    new_object_ids.append(object_id)
+                elif not visible and object_id in visible_object_ids:
+                    visible_object_ids.discard(object_id)
+                    object_state_name = self._get_object_state_name(object_id)
+                    # objects that left the game already told the client they died
+                    if object_state_name and object_state_name != 'pending removal':
+                        despawned_object_states.append(self._package_despawned_state(object_id))
+
+            object_states = [object_state for object_state in changed_object_states
+                             if object_state['object_id'] in visible_object_ids]
+            for object_id in new_object_ids:
+                if object_id not in changed_object_ids:
+                    object_states.append(self._package_object_state(object_id))
+            object_states.extend(despawned_object_states)
+
+            client_game_states[client_number] = object_states
+            
+        return client_game_states
+
+    def _reset_client_baseline(self, client_number):
+        '''
+        a client getting the full state throws away what it acknowledged
+        before, the next changed states it gets start from the full state
+        '''
+        client = self.clients.get(client_number)
+        if client:
+            client.acknowledged_sequence = self.full_state[1]
+
+    def _get_client_baseline(self, client):
+        '''
+        the last changed state the client acknowledged, if we still have everything after it.
+        None if we don't know what it has, then it only gets this tick and
+        asks for the full state if it missed anything
+        '''
+        oldest_sequence = self.snapshot_history[0][0]
+        baseline = client.acknowledged_sequence
+        if baseline is None or baseline < oldest_sequence - 1 or baseline >= self.sequence:
+            return None
+        return baseline
+
+    def _prepare_client_delta_states(self):
+        '''
+        every client gets the newest state of every object that changed
+        for it since its baseline, returns ({client number: object states},
+        {client number: baseline})
+        '''
+        client_game_states = {}
+        client_baselines = {}
+        for client_number in self.clients:
+            baseline = self._get_client_baseline(self.clients[client_number])
+            first_sequence = self.sequence
+            if baseline is not None:
+                first_sequence = baseline + 1
+            delta_object_states = {}
+            for sequence, snapshot in reversed(self.snapshot_history):
+                if sequence < first_sequence:
+                    break
+                for object_state in snapshot.get(client_number, ()):
+                    if object_state['object_id'] not in delta_object_states:
+                        delta_object_states[object_state['object_id']] = object_state
+            client_game_states[client_number] = delta_object_states.values()
+            client_baselines[client_number] = baseline
+        return client_game_states, client_baselines
+
+    def _record_phase_time(self, phase_name, phase_start_time):
+        '''tells the stats how long a part of the tick took, returns when the next part starts'''
+        phase_end_time = time.time()
+        if self.eventManager.stats:
+            self.eventManager.stats.record_phase_time(phase_name, phase_end_time - phase_start_time)
+        return phase_end_time
+
     def _update_objects(self, delta_time):
 
         
         for object_id in self.characters:
             # update the character, will return an optional request
             command_requet = self.characters[object_id].update(delta_time)
+            self.flowField.move_target(object_id, self.characters[object_id].grid_position)
             
 ##        for object_id in self.enemies:
 ##            # update the enemy, will return an optional request
@@ -1011,17 +1324,12 @@ class ServerView():
             if command_request['request'] == 'removal request':
                 wall_ids_to_remove.append(object_id)           
         for i in wall_ids_to_remove:
+            self.changed_objects.discard(self.walls[i])
+            self.walls[i].remove_from_spatial_hash()
             del self.walls[i]
 
-        projectile_ids_to_remove = []
-        for object_id in self.projectiles:
-##            command_request = self.projectiles[object_id].update(delta_time,
-##                                                                 self.enemies)
-            command_request = self.projectiles[object_id].update(delta_time)
-            if command_request['request'] == 'removal request':
-                projectile_ids_to_remove.append(object_id)
-        for i in projectile_ids_to_remove:
-            del self.projectiles[i]
+        # moves every projectile at once, and removes the ones that asked to be removed
+        self.projectileSystem.update(delta_time)
                 
 ##        self.aiGrid.update()
 ##        self.enemyGenerator.update(delta_time = 0.025)
@@ -1029,36 +1337,61 @@ class ServerView():
     def notify(self, event):
         if event.name == 'Tick Event':
             # !@$%!@%!# SHOULD SEND CHANGED !%@!^#^!
+            phase_start_time = time.time()
+            self._apply_input_frames()
+            phase_start_time = self._record_phase_time('input', phase_start_time)
             self._update_objects(event.delta_time)
-            self._prepare_changed_state()
-            self._prepare_full_state()
+            self.simulation_time += event.delta_time
+            phase_start_time = self._record_phase_time('update', phase_start_time)
+            self.ticks_since_changed_state += 1
+            if self.ticks_since_changed_state >= self.replication_interval:
+                self.ticks_since_changed_state = 0
+                self._prepare_changed_state()
+                self._record_phase_time('changed state packing', phase_start_time)
 
         elif event.name == 'New Client Connected Event':
+            # the client asks for the full state once it subscribed
             self._add_client_to_game(event.client_number, event.client_ip)
-            self._prepare_full_state()
-            
-        elif event.name == 'User Keyboard Input Event':
-            self._process_user_keyboard_input_event(event)
+            self.full_state_is_stale = True
 
-        elif event.name == 'Place Wall Request Event':
-            self._process_place_wall_request_event(event)
+        elif event.name == 'Complete Game State Request Event':
+            phase_start_time = time.time()
+            self._post_full_state()
+            self._reset_client_baseline(event.client_number)
+            self._record_phase_time('full state packing', phase_start_time)
+            
+        elif event.name == 'Input Frame Event':
+            self._process_input_frame_event(event)
 
-        elif event.name == 'Shoot Projectile Request Event':
-            self._process_shoot_projectile_request_event(event)
+        elif event.name == 'Game State Acknowledge Event':
+            client = self.clients.get(event.client_number)
+            if client and event.sequence > client.acknowledged_sequence:
+                client.acknowledged_sequence = event.sequence
 
 ##        elif event.name == 'Add Enemy To Game Request Event':
 ##            self._process_add_enemy_to_game_request_event(event)
     
 
+# the map the server plays on. Clients are sent these when they connect
+# and make (or load) the same map themselves
+MAP_DIMENSIONS = [25, 20]
+MAP_GENERATOR = 'rooms'
+MAP_PARAMETERS = {'number_of_rooms': 6}
+MAP_SEED = 0
+
 def main():
     object_registry = {}
-    eventManager = events.EventManager()
+    eventManager = events.EventManager(stats.Stats())
     programClock = ProgramClock(eventManager)
-    serverView = ServerView(eventManager, object_registry)
+    mapLibrary = mapartifact.MapLibrary(mapartifact.MAP_DIRECTORY)
+    mapArtifact = mapLibrary.get_map_artifact(MAP_DIMENSIONS, MAP_GENERATOR, MAP_PARAMETERS, MAP_SEED)
+    serverView = ServerView(eventManager, object_registry, mapArtifact)
     programClock.run()
     
     serverFactory = serverfactory.ServerFactory(eventManager)
     serverFactory.protocol = serverfactory.ClientConnectionProtocol
+    serverFactory.map_event = events.MapEvent(MAP_DIMENSIONS, MAP_GENERATOR, MAP_PARAMETERS,
+                                              MAP_SEED, mapArtifact.key)
     reactor.listenTCP(8557, serverFactory)
     print 'started'
     reactor.run()
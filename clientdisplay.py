@@ -17,6 +17,9 @@ import events
 import userinputmanager
 
 import mapgrid
+import mapartifact
+import interpolation
+import movement
 
 class ClientSpriteObject(rabbyt.Sprite):
     def __init__(self, screen_dimensions, object_state, object_id=None):
@@ -30,6 +33,8 @@ class ClientSpriteObject(rabbyt.Sprite):
         self.state = object_state
         self.position = None
         self.velocity = None
+        # moving objects are drawn between the server states in here
+        self.interpolationBuffer = None
 
         self.textures = {}
         self.rot = 0 # rabbyt texture rotation
@@ -54,6 +59,21 @@ class ClientSpriteObject(rabbyt.Sprite):
     def set_velocity(self, velocity):
         self.velocity = [velocity[0], velocity[1]]
 
+    def add_server_state(self, server_time, position, velocity, new_object=False):
+        '''sets our position and velocity, through the interpolation buffer if we have one'''
+        self.set_velocity(velocity)
+        if self.interpolationBuffer and server_time is not None:
+            if new_object:
+                self.interpolationBuffer.reset(server_time, position, velocity)
+            else:
+                self.interpolationBuffer.add_state(server_time, position, velocity)
+        else:
+            self.set_position(position)
+
+    def interpolate(self, render_time):
+        if self.interpolationBuffer and render_time is not None and self.interpolationBuffer.states:
+            self.position = self.interpolationBuffer.get_position(render_time)
+
     def set_state(self, object_state):
         self.state = object_state
         if object_state == 'pending removal':
@@ -195,6 +215,24 @@ class WallSprite(ClientSpriteObject):
         self.position[0] += self.velocity[0] * delta_time
         self.position[1] += self.velocity[1] * delta_time
 
+class TerrainSprite(ClientSpriteObject):
+    '''a tile of the map the server sent us, it never moves or changes'''
+    def __init__(self, screen_dimensions, terrain_type, object_position):
+
+        ClientSpriteObject.__init__(self, screen_dimensions, terrain_type)
+
+        self._load_textures()
+        self.set_texture()
+
+        self.set_position(object_position)
+
+    def _load_textures(self):
+        self.textures['wall'] = os.path.join('resources', 'walltile.png')
+        self.textures['floor'] = os.path.join('resources', 'grass.png')
+
+    def update(self, delta_time):
+        pass
+
 class ProjectileSprite(ClientSpriteObject):
     def __init__(self, screen_dimensions, object_id, object_state,
                  object_position, object_velocity):
@@ -206,6 +244,8 @@ class ProjectileSprite(ClientSpriteObject):
         self.particle_timer = 0.0
         self.time_between_particles = .05
 
+        # the server only tells us when we bounce, so keep going until then
+        self.interpolationBuffer = interpolation.InterpolationBuffer(max_extrapolation_time=None)
         self.set_position(object_position)
         self.set_velocity(object_velocity)
 
@@ -246,9 +286,10 @@ class ProjectileSprite(ClientSpriteObject):
                 self.set_texture()
                 self.spawn_particles(delta_time)
                     
-                # set the position
-                self.position[0] += self.velocity[0] * delta_time
-                self.position[1] += self.velocity[1] * delta_time
+                # set the position, unless the interpolation buffer does
+                if not self.interpolationBuffer.states:
+                    self.position[0] += self.velocity[0] * delta_time
+                    self.position[1] += self.velocity[1] * delta_time
         else:
             self.state = self.previous_state
 
@@ -309,6 +350,7 @@ class CharacterSprite(ClientSpriteObject):
         self._load_textures()
         self.set_texture()
 
+        self.interpolationBuffer = interpolation.InterpolationBuffer()
         self.set_position(object_position)
         self.set_velocity(object_velocity)
 
@@ -325,14 +367,24 @@ class CharacterSprite(ClientSpriteObject):
         
         self.set_texture()
         
-        # set the position
-        self.position[0] += self.velocity[0] * delta_time
-        self.position[1] += self.velocity[1] * delta_time
+        # set the position, unless the interpolation buffer does
+        if not self.interpolationBuffer.states:
+            self.position[0] += self.velocity[0] * delta_time
+            self.position[1] += self.velocity[1] * delta_time
 
 class ClientDisplay():
     def __init__(self, eventManager, object_registry):
         self.eventManager = eventManager
-        self.eventManager.add_listener(self)
+        self.eventManager.add_listener(self, ['Tick Event',
+                                              'User Quit Event',
+                                              'Connection Failed Event',
+                                              'Connection Lost Event',
+                                              'Complete Game State Event',
+                                              'Changed Game State Event',
+                                              'Complete Game State Progress Event',
+                                              'Input Frame Sent Event',
+                                              'Map Event',
+                                              'User Mouse Input Event'])
 
         self.map_dimensions = [25, 20]
         self.tile_size = 32
@@ -347,6 +399,22 @@ class ClientDisplay():
         self.user_controlled_character = None
         self.initial_game_state_received = False
 
+        # the server pushes us sequence numbered changed game states
+        self.subscribed_to_game_state = False
+        self.waiting_for_complete_game_state = False
+        self.last_applied_sequence = None
+        self.last_acknowledged_sequence = None
+        # moving objects are drawn a little behind the server time
+        self.serverClock = interpolation.ServerClock()
+
+        # our own character isn't interpolated, it is moved as soon as we
+        # send the input and corrected when the server says where it is.
+        # The collision grid mirrors the server's from the walls we know about
+        self.collisionGrid = mapgrid.CollisionGrid(self.map_dimensions)
+        self.characterPredictor = movement.CharacterPredictor(self.tile_size, self.collisionGrid)
+        self.user_controlled_character_id = None
+        self.user_controlled_character_server_position = None
+
         self.object_registry = object_registry
 
         self.background_sprites = []
@@ -399,10 +467,11 @@ class ClientDisplay():
                 self.eventManager.post(event)
       
     def _add_object_to_game(self, object_type, object_id, object_position,
-                            object_velocity, object_state):
+                            object_velocity, object_state, server_time=None):
         if object_type == 'character':
             characterSprite = CharacterSprite(self.screen_dimensions, object_id, object_state,
                                               object_position, object_velocity)
+            characterSprite.add_server_state(server_time, object_position, object_velocity, True)
             self.character_sprites.append(characterSprite)
             self.object_registry[object_id] = characterSprite
 
@@ -417,6 +486,7 @@ class ClientDisplay():
             grid_position = object_position
             object_position = mapgrid.convert_grid_position_to_position(grid_position, self.tile_size)
             
+            self._update_collision_grid(grid_position, object_state)
             wallSprite = WallSprite(self.screen_dimensions, object_id, object_state,
                                     object_position, object_velocity)
             self.wall_sprites.append(wallSprite)
@@ -425,11 +495,76 @@ class ClientDisplay():
         elif object_type == 'projectile':
             projectileSprite = ProjectileSprite(self.screen_dimensions, object_id, object_state,
                                                 object_position, object_velocity)
+            projectileSprite.add_server_state(server_time, object_position, object_velocity, True)
             self.projectile_sprites.append(projectileSprite)
             self.object_registry[object_id] = projectileSprite
+
+    def _remove_object(self, object_id):
+        '''takes an object the server no longer shows us out of the game'''
+        current_object = self.object_registry.pop(object_id, None)
+        if current_object is None:
+            return
+        if current_object in self.wall_sprites:
+            grid_position = mapgrid.convert_position_to_grid_position(current_object.position, self.tile_size)
+            self._update_collision_grid(grid_position, 'despawned')
+        for sprites in [self.character_sprites, self.enemy_sprites,
+                        self.wall_sprites, self.projectile_sprites]:
+            if current_object in sprites:
+                sprites.remove(current_object)
         
-    def _update_game_state(self, object_packages):
+    def _load_map(self, event):
+        '''
+        makes (or loads) the same map the server plays on, so our
+        prediction runs into the same walls the server's character does
+        and we can draw them
+        '''
+        mapArtifact = mapartifact.MapLibrary(mapartifact.MAP_DIRECTORY).get_map_artifact(
+            event.map_dimensions, event.generator, event.parameters, event.seed)
+        if mapArtifact.key != event.key:
+            raise RuntimeError('The map made here is not the server\'s map: ' + mapArtifact.key)
+        # the window is as big as the server's map
+        if list(mapArtifact.map_dimensions) != self.map_dimensions:
+            if self.object_registry:
+                raise RuntimeError('The map size changed during the game: ' + str(mapArtifact.map_dimensions))
+            self.map_dimensions = list(mapArtifact.map_dimensions)
+            self.screen_dimensions = [self.map_dimensions[0] * self.tile_size,
+                                      self.map_dimensions[1] * self.tile_size]
+            self._initialize_display(self.screen_dimensions)
+        self._load_terrain_sprites(mapArtifact)
+        self.collisionGrid = mapArtifact.get_collision_grid()
+        self.characterPredictor.collisionGrid = self.collisionGrid
+        # the walls placed in the game go on top of the map
+        for wallSprite in self.wall_sprites:
+            grid_position = mapgrid.convert_position_to_grid_position(wallSprite.position, self.tile_size)
+            self._update_collision_grid(grid_position, 'alive')
+
+    def _load_terrain_sprites(self, mapArtifact):
+        '''a sprite for every wall and floor tile of the map, drawn under everything else'''
+        self.background_sprites = []
+        for x in range(mapArtifact.map_dimensions[0]):
+            for y in range(mapArtifact.map_dimensions[1]):
+                if mapArtifact.collision_array[x, y]:
+                    terrain_type = 'wall'
+                elif mapArtifact.terrain_array[x, y]:
+                    terrain_type = 'floor'
+                else:
+                    continue
+                object_position = mapgrid.convert_grid_position_to_position([x, y], self.tile_size)
+                self.background_sprites.append(TerrainSprite(self.screen_dimensions, terrain_type,
+                                                             object_position))
+
+    def _update_collision_grid(self, grid_position, object_state):
+        '''the walls we know about close the tiles our character can't move into'''
+        if object_state == 'alive':
+            self.collisionGrid.close_tile(grid_position)
+        else:
+            self.collisionGrid.open_tile(grid_position)
+
+    def _update_game_state(self, object_packages, server_time=None, complete_game_state=False):
         # recieved a list of game objects (characters, projectiles, etc...)
+        if server_time is not None:
+            self.serverClock.add_server_time(server_time, time.time())
+
         for object_package in object_packages:
             object_type = object_package['object_type']
             object_id = object_package['object_id']
@@ -437,7 +572,18 @@ class ClientDisplay():
             object_velocity = object_package['object_velocity']
             object_state = object_package['object_state']
 
-            if object_type != 'default':
+            if object_state == 'despawned':
+                # it left our view
+                self._remove_object(object_id)
+
+            elif object_state == 'dead' and object_id not in self.object_registry:
+                # we already took it out, or never saw it alive
+                pass
+
+            elif object_type != 'default':
+
+                if object_id == self.user_controlled_character_id:
+                    self.user_controlled_character_server_position = object_position
 
                 if object_id in self.object_registry:
                     current_object = self.object_registry[object_id] # get the object
@@ -446,14 +592,51 @@ class ClientDisplay():
                     if object_type in ['wall']:
                         grid_position = object_position
                         object_position = mapgrid.convert_grid_position_to_position(grid_position, self.tile_size)
-                    current_object.set_position(object_position)
-                    current_object.set_velocity(object_velocity)
+                        self._update_collision_grid(grid_position, object_state)
+                    current_object.add_server_state(server_time, object_position, object_velocity,
+                                                    complete_game_state)
                     current_object.set_state(object_state)
 
                 # if the object does not exist
                 else:
                     self._add_object_to_game(object_type, object_id, object_position,
-                                             object_velocity, object_state)
+                                             object_velocity, object_state, server_time)
+                
+    def _request_complete_game_state(self):
+        self.waiting_for_complete_game_state = True
+        event = events.CompleteGameStateRequestEvent()
+        self.eventManager.post(event)
+
+    def _apply_changed_game_state(self, event):
+        '''
+        applies pushed changed game states in order, resyncs if we missed one.
+        Each one has everything that changed since its baseline, so one
+        we missed is fine as long as a later one starts before where we are
+        '''
+        if self.waiting_for_complete_game_state:
+            return
+        
+        if event.sequence <= self.last_applied_sequence:
+            # already included in what we have
+            return
+
+        baseline = event.baseline
+        if baseline is None:
+            baseline = event.sequence - 1
+        if baseline > self.last_applied_sequence:
+            print 'Missed changed game state ' + str(self.last_applied_sequence + 1) + ', resyncing'
+            self._request_complete_game_state()
+            return
+
+        self.last_applied_sequence = event.sequence
+        if event.character_id is not None:
+            self.user_controlled_character_id = event.character_id
+        self._update_game_state(event.changed_game_state, event.server_time)
+
+        if event.input_sequence is not None and self.user_controlled_character_server_position is not None:
+            # start from where the server has us and do the input it hasn't applied yet
+            self.characterPredictor.set_server_state(self.user_controlled_character_server_position,
+                                                     event.input_sequence)
                 
     def _update_objects(self, delta_time):              
         for w in self.wall_sprites:
@@ -503,15 +686,29 @@ class ClientDisplay():
 
     def notify(self, event):
         if event.name == 'Tick Event':
+            self.characterPredictor.add_time(event.delta_time)
+            render_time = self.serverClock.get_render_time(time.time())
+            for sprites in [self.character_sprites, self.projectile_sprites]:
+                for sprite in sprites:
+                    sprite.interpolate(render_time)
+            predicted_position = self.characterPredictor.get_position()
+            if predicted_position and self.user_controlled_character_id in self.object_registry:
+                self.object_registry[self.user_controlled_character_id].set_position(predicted_position)
             self._update_objects(event.delta_time)
             self._render_display()
 
-            # ask for a full game state
-            if not self.initial_game_state_received:
-                event = events.CompleteGameStateRequestEvent()
+            # subscribe first so no changed game state is missed
+            # between the full game state and the first push
+            if not self.subscribed_to_game_state:
+                self.subscribed_to_game_state = True
+                event = events.SubscribeGameStateRequestEvent()
                 self.eventManager.post(event)
-            else:
-                event = events.ChangedGameStateRequestEvent()
+                self._request_complete_game_state()
+
+            # let the server know how far along we are
+            elif self.last_applied_sequence != self.last_acknowledged_sequence:
+                self.last_acknowledged_sequence = self.last_applied_sequence
+                event = events.GameStateAcknowledgeEvent(self.last_applied_sequence)
                 self.eventManager.post(event)
 
         elif event.name == 'User Quit Event':
@@ -531,10 +728,28 @@ class ClientDisplay():
             
         elif event.name == 'Complete Game State Event':
             self.initial_game_state_received = True
-            self._update_game_state(event.complete_game_state)
+            self.waiting_for_complete_game_state = False
+            self.last_applied_sequence = event.sequence
+            # anything we still have that is not in the complete game state is out of view
+            visible_object_ids = set(object_package['object_id'] for object_package in event.complete_game_state)
+            for object_id in self.object_registry.keys():
+                if object_id not in visible_object_ids:
+                    self._remove_object(object_id)
+            self._update_game_state(event.complete_game_state, event.server_time, True)
 
         elif event.name == 'Changed Game State Event':
-            self._update_game_state(event.changed_game_state)
+            self._apply_changed_game_state(event)
+
+        elif event.name == 'Map Event':
+            self._load_map(event)
+
+        elif event.name == 'Input Frame Sent Event':
+            self.characterPredictor.add_input_frame(event.input_frame.sequence,
+                                                    event.input_frame.direction)
+
+        elif event.name == 'Complete Game State Progress Event':
+            print ('Loading game state... ' + str(event.received_chunks) +
+                   '/' + str(event.chunk_count))
 
         elif event.name == 'User Mouse Input Event':
             mouse_button = event.mouse_button
@@ -1,22 +1,103 @@
+import ast
+
 from twisted.internet import protocol
 from twisted.internet import reactor
 from twisted.protocols import amp
 from twisted.internet.error import ConnectionDone
 
 import events
+import statecodec
 from serverfactory import RemoteTextMessageEvent
 from serverfactory import RemoteCompleteGameStateRequestEvent
 from serverfactory import RemoteChangedGameStateRequestEvent
-from serverfactory import RemoteUserKeyboardInputEvent
-from serverfactory import RemotePlaceWallRequestEvent
-from serverfactory import RemoteShootProjectileRequestEvent
+from serverfactory import RemoteInputFrameEvent
+from serverfactory import RemoteSubscribeGameStateEvent
+from serverfactory import RemoteAcknowledgeGameStateEvent
+from serverfactory import RemotePushChangedGameStateEvent
+from serverfactory import RemoteCompleteGameStateChunkEvent
+from serverfactory import RemoteMapEvent
+
+class GameStateAssembler():
+    '''
+    puts the chunks of a game state back together. Every connection
+    has its own, if the connection drops the chunks we had go with it
+    and we ask for the whole game state again
+    '''
+    def __init__(self):
+        self._reset(None, 0)
+
+    def _reset(self, sequence, chunk_count):
+        self.sequence = sequence
+        self.chunk_count = chunk_count
+        self.chunks = {}
+
+    def add_chunk(self, sequence, chunk_index, chunk_count, chunk):
+        '''returns the complete encoded game state once every chunk is here'''
+        if sequence != self.sequence or chunk_count != self.chunk_count:
+            # a newer game state, whatever we had is useless now
+            self._reset(sequence, chunk_count)
+        self.chunks[chunk_index] = chunk
+
+        if len(self.chunks) == self.chunk_count:
+            encoded_game_state = ''.join([self.chunks[i] for i in range(self.chunk_count)])
+            self._reset(None, 0)
+            return encoded_game_state
+
+    def get_progress(self):
+        return len(self.chunks), self.chunk_count
+
+class InputFrameBatcher():
+    '''
+    collects everything the user did during one tick into one
+    sequence numbered input frame. The held direction is sent every
+    tick while a key is down, each frame with a direction moves our
+    character one step on the server (and in our prediction), as long
+    as we don't send them faster than it steps. Nothing is sent while
+    nothing is happening
+    '''
+    def __init__(self):
+        self.sequence = 0
+        self._reset()
+
+    def _reset(self):
+        self.direction = ''
+        self.shots = []
+        self.walls = []
+
+    def add_event(self, event):
+        if event.name == 'User Keyboard Input Event':
+            self.direction = event.keyboard_input
+        elif event.name == 'Shoot Projectile Request Event':
+            self.shots.append(event.destination_position)
+        elif event.name == 'Place Wall Request Event':
+            self.walls.append(event.grid_position)
+        else:
+            raise RuntimeError('The event <' + event.name + '> is not user input')
+
+    def pop_input_frame(self):
+        '''the input frame for this tick, None if there is nothing new to tell the server'''
+        input_frame = None
+        if self.direction or self.shots or self.walls:
+            self.sequence += 1
+            input_frame = events.InputFrameEvent(self.sequence, self.direction,
+                                                 self.shots, self.walls)
+        self._reset()
+        return input_frame
 
 class ClientProtocol(amp.AMP):
     def __init__(self, eventManager, eventEncoder):
         self.eventManager = eventManager
+        # any event can be sent over the network, so we want all of them
         self.eventManager.add_listener(self)
 
         self.eventEncoder = eventEncoder
+        self.completeGameStateAssembler = GameStateAssembler()
+        self.changedGameStateAssembler = GameStateAssembler()
+        # what the server codes the changed game states relative to
+        self.deltaReferences = statecodec.DeltaReferences()
+        self.delta_resync_requested = False
+        self.inputFrameBatcher = InputFrameBatcher()
+        self.input_frame_scheduled = False
 
     def connectionMade(self):
         '''Called when a connection is made. '''
@@ -34,35 +115,32 @@ class ClientProtocol(amp.AMP):
                     remoteCall.addCallback(self.MessageReceived) # do we need this?
                     remoteCall.addErrback(self.ErrorCallback)
 
-                elif event.name == 'User Keyboard Input Event':
-                    encoded_event = self.eventEncoder.encode_event(event)
-                    remoteCall = self.callRemote(RemoteUserKeyboardInputEvent,
-                                                        message = encoded_event)
-                    remoteCall.addCallback(self.InputReceived)
-                    remoteCall.addErrback(self.ErrorCallback)
-
-                elif event.name == 'Place Wall Request Event':
-                    encoded_event = self.eventEncoder.encode_event(event)
-                    remoteCall = self.callRemote(RemotePlaceWallRequestEvent,
-                                                        message = encoded_event)
-                    remoteCall.addCallback(self.InputReceived)
-                    remoteCall.addErrback(self.ErrorCallback)
+                elif event.name in ['User Keyboard Input Event',
+                                    'Place Wall Request Event',
+                                    'Shoot Projectile Request Event']:
+                    # goes out with the rest of this tick's input
+                    self.inputFrameBatcher.add_event(event)
 
-                elif event.name == 'Shoot Projectile Request Event':
+                elif event.name == 'Input Frame Event':
+                    # no answer, the sequence number tells the server about missing frames
                     encoded_event = self.eventEncoder.encode_event(event)
-                    remoteCall = self.callRemote(RemoteShootProjectileRequestEvent,
-                                                        message = encoded_event)
-                    remoteCall.addErrback(self.ErrorCallback)
+                    self.callRemote(RemoteInputFrameEvent, message = encoded_event)
 
                 elif event.name == 'Complete Game State Request Event':
-                    remoteCall = self.callRemote(RemoteCompleteGameStateRequestEvent, message = event.name)
-                    remoteCall.addCallback(self.CompleteGameStateReceived)
-                    remoteCall.addErrback(self.ErrorCallback)
+                    # no answer, the server streams the chunks to us
+                    self.callRemote(RemoteCompleteGameStateRequestEvent, message = event.name)
                     
                 elif event.name == 'Changed Game State Request Event':
                     remoteCall = self.callRemote(RemoteChangedGameStateRequestEvent, message = event.name)
                     remoteCall.addCallback(self.ChangedGameStateReceived)
                     remoteCall.addErrback(self.ErrorCallback)
+
+                elif event.name == 'Subscribe Game State Request Event':
+                    # no answer, the server starts pushing changed game states
+                    self.callRemote(RemoteSubscribeGameStateEvent, message = event.name)
+
+                elif event.name == 'Game State Acknowledge Event':
+                    self.callRemote(RemoteAcknowledgeGameStateEvent, sequence = event.sequence)
                 else:
                     print 'The event <' + event.name + '> cannot be sent over the network!'
             
@@ -71,26 +149,86 @@ class ClientProtocol(amp.AMP):
         ''' This is added as a callback when sending a text message '''
         pass
 
-    def InputReceived(self, message):
-        ''' This is added as a callback when sending an input message '''
-        pass
+    def remote_map_event(self, width, height, generator, parameters, seed, key):
+        ''' the server tells us its map as soon as we connect '''
+        event = events.MapEvent([width, height], generator, ast.literal_eval(parameters), seed, key)
+        self.eventManager.post(event)
+        return {}
+    RemoteMapEvent.responder(remote_map_event)
 
-    def CompleteGameStateReceived(self, game_state):
-        ''' This is added as a callback when sending a game update request '''
-        event = events.CompleteGameStateEvent(game_state['response'])
+    def remote_complete_game_state_chunk_event(self, sequence, chunk_index, chunk_count, chunk,
+                                               server_time=None):
+        ''' the server streams these to us after we ask for the complete game state '''
+        encoded_game_state = self.completeGameStateAssembler.add_chunk(sequence, chunk_index,
+                                                                       chunk_count, chunk)
+        if encoded_game_state is None:
+            received_chunks, chunk_count = self.completeGameStateAssembler.get_progress()
+            event = events.CompleteGameStateProgressEvent(received_chunks, chunk_count)
+        else:
+            complete_game_state = statecodec.decode_object_states(encoded_game_state)
+            event = events.CompleteGameStateEvent(complete_game_state, sequence, None, server_time)
         self.eventManager.post(event)
+        return {}
+    RemoteCompleteGameStateChunkEvent.responder(remote_complete_game_state_chunk_event)
 
     def ChangedGameStateReceived(self, game_state):
         ''' This is added as a callback when sending a game update request '''
-        event = events.ChangedGameStateEvent(game_state['response'])
+        changed_game_state = statecodec.decode_object_states(game_state['response'])
+        event = events.ChangedGameStateEvent(changed_game_state, game_state['sequence'])
+        self.eventManager.post(event)
+
+    def remote_push_changed_game_state_event(self, sequence, changed_game_state, baseline=None,
+                                             server_time=None, character_id=None, input_sequence=None,
+                                             chunk_index=None, chunk_count=None):
+        ''' the server pushes this to us every tick once we have subscribed '''
+        if chunk_count is not None:
+            changed_game_state = self.changedGameStateAssembler.add_chunk(sequence, chunk_index,
+                                                                          chunk_count, changed_game_state)
+            if changed_game_state is None:
+                # wait for the rest of it
+                return {}
+            
+        try:
+            changed_game_state = statecodec.decode_object_states(changed_game_state, self.deltaReferences,
+                                                                 sequence, baseline)
+        except RuntimeError, error:
+            # we don't have what it was coded against. Asking for the complete
+            # game state makes the server forget what it coded against too
+            if not self.delta_resync_requested:
+                print str(error) + ', resyncing'
+                self.delta_resync_requested = True
+                self.deltaReferences = statecodec.DeltaReferences()
+                event = events.CompleteGameStateRequestEvent()
+                self.eventManager.post(event)
+            return {}
+        self.delta_resync_requested = False
+            
+        event = events.ChangedGameStateEvent(changed_game_state, sequence, None, baseline, None,
+                                             server_time, None, character_id, input_sequence)
         self.eventManager.post(event)
+        return {}
+    RemotePushChangedGameStateEvent.responder(remote_push_changed_game_state_event)
 
     def ErrorCallback(self, failure):
         '''if the remotecall goes wrong, this is added as an error back'''
         #print 'Error callback received, reason: ' + str(failure)
         pass
 
+    def _send_input_frame(self):
+        self.input_frame_scheduled = False
+        input_frame = self.inputFrameBatcher.pop_input_frame()
+        if input_frame:
+            self.send_message(input_frame)
+            # the display moves our character now instead of waiting for the server
+            event = events.InputFrameSentEvent(input_frame)
+            self.eventManager.post(event)
+
     def notify(self, event):
+        if event.name == 'Tick Event' and not self.input_frame_scheduled:
+            # the input for this tick is posted while the tick is processed,
+            # send it all together once the tick is done
+            self.input_frame_scheduled = True
+            reactor.callLater(0, self._send_input_frame)
         self.send_message(event)
         
 class ClientFactory(protocol.ClientFactory):
@@ -133,7 +271,7 @@ class ClientConnector():
         self.ip_address = ip_address
         self.port = port
         self.eventManager = eventManager
-        self.eventManager.add_listener(self)
+        self.eventManager.add_listener(self, ['Stop Network Connection Event'])
         
         self.clientFactory = ClientFactory(eventManager, eventEncoder, ip_address, port)
 
@@ -1,106 +1,168 @@
-from weakref import WeakKeyDictionary
+import time
+from weakref import WeakKeyDictionary, ref
 
 # all the events
 
-class Event():
+class Event(object):
     '''
-    superclass for events
+    superclass for events.
+    events use __slots__ so they don't carry a __dict__ each, the name,
+    type code and whether it is sent over the network belong to the class
     '''
+    __slots__ = ()
     name = 'Default Event'
+    type_code = None # set below from EVENT_TYPES
     client_number = None
     send_over_network = False
 
 class TickEvent(Event):
-    ''' update the game! gets created 60 times a sec '''
-    def __init__(self, delta_time):
-        self.name = 'Tick Event'
+    '''
+    update the game! gets created 60 times a sec.
+    The server numbers its ticks, every server tick steps the same delta time
+    '''
+    __slots__ = ('delta_time', 'tick_number')
+    name = 'Tick Event'
+
+    def __init__(self, delta_time, tick_number=None):
         self.delta_time = delta_time
+        self.tick_number = tick_number
 
 class NewClientConnectedEvent(Event):
     '''
     used by the server to know when a new
     client connects
     '''
+    __slots__ = ('client_number', 'client_ip')
+    name = 'New Client Connected Event'
+
     def __init__(self, client_number, client_ip):
-        self.name = 'New Client Connected Event'
         self.client_number = client_number
         self.client_ip = client_ip
 
 class ConnectedToServerEvent(Event):
     '''used by the client to know when weve connected'''
-    def __init__(self):
-        self.name = 'Connected To Server Event'
+    __slots__ = ()
+    name = 'Connected To Server Event'
 
 class StopNetworkConnectionEvent(Event):
     '''used by the client state to inform everyone that were stopping'''
-    def __init__(self):
-        self.name = 'Stop Network Connection Event'
+    __slots__ = ()
+    name = 'Stop Network Connection Event'
 
 class ConnectionFailedEvent(Event):
     '''used by the client to know when we disconnected'''
+    __slots__ = ('reconnectable_factory',)
+    name = 'Connection Failed Event'
+
     def __init__(self, reconnectable_factory):
-        self.name = 'Connection Failed Event'
         self.reconnectable_factory = reconnectable_factory
 
 class ConnectionLostEvent(Event):
     '''used by the client when we lose connection of the server'''
-    def __init__(self):
-        self.name = 'Connection Lost Event'
+    __slots__ = ()
+    name = 'Connection Lost Event'
 
 class UserQuitEvent(Event):
     '''when our clients quit the game'''
-    def __init__(self):
-        self.name = 'User Quit Event'
+    __slots__ = ()
+    name = 'User Quit Event'
 
 class TextMessageEvent(Event):
     ''' Just text '''
+    __slots__ = ('text', 'send_over_network')
+    name = 'Text Message Event'
+
     def __init__(self, text, send_over_network):
-        self.name = 'Text Message Event'
         self.text = text # any string
         self.send_over_network = send_over_network # True or False
 
-class CompleteGameStateEvent(Event):
-    '''
-    Holds the  visual info for every
-    object in the game
-    '''
-    # example of game state list
-    # [['OBJECT NAME', id, [position]], object2, object3...
-    # [['CHARACTER', 19376408, [300, 300]], ect... ]
-    def __init__(self, game_state):
-        self.name = 'Complete Game State Event'
-        self.game_state = game_state
-        self.send_over_network = True
-
 class CompleteGameStateEvent(Event):
     '''Holds the info for every object'''
-    def __init__(self, complete_game_state):
-        self.name = 'Complete Game State Event'
+    __slots__ = ('complete_game_state', 'sequence', 'client_game_states', 'server_time')
+    name = 'Complete Game State Event'
+
+    def __init__(self, complete_game_state, sequence=None, client_game_states=None, server_time=None):
         self.complete_game_state = complete_game_state
+        self.sequence = sequence # the changed game state sequence this state matches
+        # {client number: [only the objects that client can see]}
+        self.client_game_states = client_game_states
+        self.server_time = server_time # seconds of game time the server had stepped
 
 class ChangedGameStateEvent(Event):
     '''Contains the state for all the objects which have changed'''
-    def __init__(self, changed_game_state):
-        self.name = 'Changed Game State Event'
+    __slots__ = ('changed_game_state', 'sequence', 'client_game_states', 'baseline', 'client_baselines',
+                 'server_time', 'client_inputs', 'character_id', 'input_sequence')
+    name = 'Changed Game State Event'
+
+    def __init__(self, changed_game_state, sequence=None, client_game_states=None,
+                 baseline=None, client_baselines=None, server_time=None,
+                 client_inputs=None, character_id=None, input_sequence=None):
         self.changed_game_state = changed_game_state
+        self.sequence = sequence # goes up by one every server tick
+        # {client number: [only the objects that client can see]}
+        self.client_game_states = client_game_states
+        # everything that changed after the baseline sequence is in here,
+        # None means sequence - 1
+        self.baseline = baseline
+        self.client_baselines = client_baselines # {client number: baseline}
+        self.server_time = server_time # seconds of game time the server had stepped
+        # {client number: (its character id, the last input frame sequence applied)}
+        self.client_inputs = client_inputs
+        # what the client gets out of client_inputs
+        self.character_id = character_id
+        self.input_sequence = input_sequence
 
 class CompleteGameStateRequestEvent(Event):
-    def __init__(self):
-        self.name = 'Complete Game State Request Event'
-        self.send_over_network = True
+    '''the client asks for the complete game state, on the server it says which client asked'''
+    __slots__ = ('client_number',)
+    name = 'Complete Game State Request Event'
+    send_over_network = True
+
+    def __init__(self, client_number=None):
+        self.client_number = client_number
+
+class CompleteGameStateProgressEvent(Event):
+    '''the client received another chunk of the complete game state'''
+    __slots__ = ('received_chunks', 'chunk_count')
+    name = 'Complete Game State Progress Event'
+
+    def __init__(self, received_chunks, chunk_count):
+        self.received_chunks = received_chunks
+        self.chunk_count = chunk_count
 
 class ChangedGameStateRequestEvent(Event):
-    def __init__(self):
-        self.name = 'Changed Game State Request Event'
-        self.send_over_network = True
+    __slots__ = ()
+    name = 'Changed Game State Request Event'
+    send_over_network = True
+
+class SubscribeGameStateRequestEvent(Event):
+    '''
+    the client wants the server to push every changed
+    game state to it instead of asking for it every tick
+    '''
+    __slots__ = ()
+    name = 'Subscribe Game State Request Event'
+    send_over_network = True
+
+class GameStateAcknowledgeEvent(Event):
+    '''the client tells the server the last changed game state it applied'''
+    __slots__ = ('sequence', 'client_number')
+    name = 'Game State Acknowledge Event'
+    send_over_network = True
+
+    def __init__(self, sequence, client_number=None):
+        self.sequence = sequence
+        self.client_number = client_number
 
 ##### USER INPUT EVENTS #####
 class UserMouseInputEvent(Event):
     '''
     when the user clicks down on the mouse
     '''
+    __slots__ = ('mouse_button', 'mouse_position')
+    name = 'User Mouse Input Event'
+
     def __init__(self, mouse_button, mouse_position):
-        self.name = 'User Mouse Input Event'
         self.mouse_button = mouse_button
         self.mouse_position = mouse_position
 
@@ -109,29 +171,93 @@ class UserKeyboardInputEvent(Event):
     When the user presses keyboard keys
     generated by the KeyboardController
     '''
+    __slots__ = ('keyboard_input', 'client_number')
+    name = 'User Keyboard Input Event'
+    send_over_network = True
+
     def __init__(self, keyboard_input, client_number = None):  
-        self.name = 'User Keyboard Input Event'
         self.keyboard_input = keyboard_input
         self.client_number = client_number # server uses this to track which client's input it was
-        self.send_over_network = True
 
 class PlaceWallRequestEvent(Event):
     '''
     when the user clicks and wants to place a new wall
     '''
+    __slots__ = ('grid_position', 'client_number')
+    name = 'Place Wall Request Event'
+    send_over_network = True
+
     def __init__(self, grid_position, client_number = None):
-        self.name = 'Place Wall Request Event'
         self.grid_position = grid_position
         self.client_number = client_number # server uses this to track which client's input it was
-        self.send_over_network = True
 
 class ShootProjectileRequestEvent(Event):
     '''this is created when the user clicks and wants to shoot a projectile'''
+    __slots__ = ('destination_position', 'client_number')
+    name = 'Shoot Projectile Request Event'
+    send_over_network = True
+
     def __init__(self, destination_position, client_number=None):
-        self.name = 'Shoot Projectile Request Event'
         self.destination_position = destination_position
         self.client_number = client_number
-        self.send_over_network = True
+
+class MapEvent(Event):
+    '''
+    the server tells a client that just connected which map it plays on.
+    The same generator, parameters and seed make the same map, the key
+    says which one it is (see mapartifact)
+    '''
+    __slots__ = ('map_dimensions', 'generator', 'parameters', 'seed', 'key')
+    name = 'Map Event'
+
+    def __init__(self, map_dimensions, generator, parameters, seed, key):
+        self.map_dimensions = map_dimensions
+        self.generator = generator
+        self.parameters = parameters
+        self.seed = seed
+        self.key = key
+
+class InputFrameSentEvent(Event):
+    '''the client sent an input frame, so it can predict where it moves its character'''
+    __slots__ = ('input_frame',)
+    name = 'Input Frame Sent Event'
+
+    def __init__(self, input_frame):
+        self.input_frame = input_frame
+
+class InputFrameEvent(Event):
+    '''
+    everything the user did during one client tick, the client
+    sends these one at a time numbered by sequence. The server
+    applies what has come in every step.
+    direction: the held direction ('LEFTUP', etc... '' for none),
+    the character moves at most one step every server step, in
+    the direction of the newest frame
+    shots: destination positions of every projectile shot
+    walls: grid positions of every wall placed
+    '''
+    __slots__ = ('sequence', 'direction', 'shots', 'walls', 'client_number')
+    name = 'Input Frame Event'
+    send_over_network = True
+
+    def __init__(self, sequence, direction, shots, walls, client_number=None):
+        self.sequence = sequence
+        self.direction = direction
+        self.shots = shots
+        self.walls = walls
+        self.client_number = client_number # server uses this to track which client's input it was
+
+# every event type gets a small number, its place in this list
+EVENT_TYPES = [TickEvent, NewClientConnectedEvent, ConnectedToServerEvent,
+               StopNetworkConnectionEvent, ConnectionFailedEvent, ConnectionLostEvent,
+               UserQuitEvent, TextMessageEvent, CompleteGameStateEvent, ChangedGameStateEvent,
+               CompleteGameStateRequestEvent, CompleteGameStateProgressEvent,
+               ChangedGameStateRequestEvent, SubscribeGameStateRequestEvent,
+               GameStateAcknowledgeEvent, UserMouseInputEvent, UserKeyboardInputEvent,
+               PlaceWallRequestEvent, ShootProjectileRequestEvent, InputFrameEvent,
+               InputFrameSentEvent, MapEvent]
+for type_code, event_type in enumerate(EVENT_TYPES):
+    event_type.type_code = type_code
 
 ##class AddEnemyToGameRequestEvent(Event):
 ##    '''
@@ -154,24 +280,13 @@ class EventEncoder():
             event_list.append(dict_event)
             return encoded_event
         
-        elif event.name == 'User Keyboard Input Event':
+        elif event.name == 'Input Frame Event':
             encoded_event = []
-            dict_event = {'name': 'User Keyboard Input Event',
-                          'input': event.keyboard_input}
-            encoded_event.append(dict_event)
-            return encoded_event
-
-        elif event.name == 'Place Wall Request Event':
-            encoded_event = []
-            dict_event = {'name': 'Place Wall Request Event',
-                          'grid_position': event.grid_position}
-            encoded_event.append(dict_event)
-            return encoded_event
-
-        elif event.name == 'Shoot Projectile Request Event':
-            encoded_event = []
-            dict_event = {'name': 'Shoot Projectile Request Event',
-                          'destination position': event.destination_position}
+            dict_event = {'name': 'Input Frame Event',
+                          'sequence': event.sequence,
+                          'direction': event.direction,
+                          'shots': [{'x': int(x), 'y': int(y)} for x, y in event.shots],
+                          'walls': [{'x': x, 'y': y} for x, y in event.walls]}
             encoded_event.append(dict_event)
             return encoded_event
 
@@ -180,18 +295,16 @@ class EventEncoder():
         
     def decode_event(self, encoded_event, client_number = None):
         '''
-        event: [{'input': 'LEFT', 'name': 'User Keyboard Input Event'}]
+        event: [{'name': 'Input Frame Event', 'sequence': 12, 'direction': 'LEFT',
+                 'shots': [{'x': 300, 'y': 200}], 'walls': []}]
         returns: Event instance
         '''
         for e in encoded_event:
-            if e['name'] == 'User Keyboard Input Event':
-                event = UserKeyboardInputEvent(e['input'], client_number)
-                return event
-            elif e['name'] == 'Place Wall Request Event':
-                event = PlaceWallRequestEvent(e['grid_position'], client_number)
-                return event
-            elif e['name'] == 'Shoot Projectile Request Event':
-                event = ShootProjectileRequestEvent(e['destination position'], client_number)
+            if e['name'] == 'Input Frame Event':
+                event = InputFrameEvent(e['sequence'], e['direction'],
+                                        [[shot['x'], shot['y']] for shot in e['shots']],
+                                        [[wall['x'], wall['y']] for wall in e['walls']],
+                                        client_number)
                 return event
 
 
@@ -199,22 +312,53 @@ class EventManager():
     '''
     acts as the connection between all the different program elements,
     all events are sent through here.
+
+    listeners can give the names of the events they want, they are
+    only notified of those. Events are sent through a table indexed
+    by event type code that is only rebuilt when someone is added or
+    removed. Listeners that don't give any names get every event.
+
+    give it a stats.Stats to count the events and time every listener
     '''
-    def __init__(self):
-        self.listeners = WeakKeyDictionary() # holds our listeners
+    def __init__(self, stats=None):
+        self.listeners = WeakKeyDictionary() # listener: the event names it wants, None for all
+        # event type code: weak references to the listeners that want it, None until it's needed
+        self.dispatch_table = [None] * len(EVENT_TYPES)
         self.event_queue = []
         self.processing_events = True
+        self.stats = stats
 
-    def add_listener(self, listener):
-        self.listeners[listener] = True
+    def add_listener(self, listener, event_names=None):
+        if event_names is None:
+            self.listeners[listener] = None
+        else:
+            self.listeners[listener] = frozenset(event_names)
+        self.dispatch_table = [None] * len(EVENT_TYPES)
 
     def remove_listener(self, listener):
         if listener in self.listeners:
             del self.listeners[listener]
+            self.dispatch_table = [None] * len(EVENT_TYPES)
+
+    def _listener_removed(self, reference):
+        '''a listener was garbage collected'''
+        self.dispatch_table = [None] * len(EVENT_TYPES)
+
+    def _get_event_listeners(self, event):
+        '''the listeners that want this event, worked out once per event type'''
+        if event.type_code is None:
+            raise RuntimeError('The event <' + event.name + '> is not in EVENT_TYPES')
+        listener_references = self.dispatch_table[event.type_code]
+        if listener_references is None:
+            listener_references = [ref(listener, self._listener_removed)
+                                   for listener, event_names in self.listeners.items()
+                                   if event_names is None or event.name in event_names]
+            self.dispatch_table[event.type_code] = listener_references
+        return listener_references
 
     def post(self, event):
         self._add_event_to_queue(event)
-        if event.name == 'Tick Event':
+        if event.type_code == TickEvent.type_code:
             self._process_event_queue()
         if event.name == 'Program Quit Event':
             self.processing_events = False
@@ -224,12 +368,73 @@ class EventManager():
 
     def _process_event_queue(self):
         if self.processing_events:
-            event_number = 0
-            while event_number < len(self.event_queue):
-                event = self.event_queue[event_number]
-                event_number += 1
-                for listener in self.listeners:
-                    listener.notify(event)
+            if self.stats:
+                self._process_event_queue_with_stats()
+            else:
+                event_number = 0
+                while event_number < len(self.event_queue):
+                    event = self.event_queue[event_number]
+                    event_number += 1
+                    for listener_reference in self._get_event_listeners(event):
+                        listener = listener_reference()
+                        if listener is not None:
+                            listener.notify(event)
             self.event_queue = []
 
-
+    def _process_event_queue_with_stats(self):
+        '''the same as _process_event_queue, but reports to the stats'''
+        stats = self.stats
+        event_number = 0
+        while event_number < len(self.event_queue):
+            event = self.event_queue[event_number]
+            event_number += 1
+            stats.count_event(event.name)
+            for listener_reference in self._get_event_listeners(event):
+                listener = listener_reference()
+                if listener is None:
+                    continue
+                notify_start_time = time.time()
+                listener.notify(event)
+                stats.record_listener_time(listener, time.time() - notify_start_time)
+        stats.record_queue_depth(event_number)
+        stats.dump_if_due()
+
+
+def run_benchmark(number_of_ticks=20000, events_per_tick=10):
+    '''
+    how long making the per tick events takes the old way (a classic
+    instance with a __dict__) and with __slots__. Every tick makes
+    events_per_tick events and then drops them like the event manager
+    does after a tick
+    '''
+    import gc
+    import sys
+    import timeit
+
+    class ClassicTickEvent():
+        def __init__(self, delta_time, tick_number=None):
+            self.name = 'Tick Event'
+            self.delta_time = delta_time
+            self.tick_number = tick_number
+
+    def make_classic_events():
+        events = [ClassicTickEvent(0.016, tick_number) for tick_number in xrange(events_per_tick)]
+
+    def make_slots_events():
+        events = [TickEvent(0.016, tick_number) for tick_number in xrange(events_per_tick)]
+
+    classic_event = ClassicTickEvent(0.016, 1)
+    slots_event = TickEvent(0.016, 1)
+    print 'classic event: ' + str(sys.getsizeof(classic_event) + sys.getsizeof(classic_event.__dict__)) + ' bytes'
+    print '__slots__ event: ' + str(sys.getsizeof(slots_event)) + ' bytes'
+
+    number_of_events = number_of_ticks * events_per_tick
+    for benchmark_name, make_events in [('classic', make_classic_events),
+                                        ('__slots__', make_slots_events)]:
+        gc.collect()
+        seconds = min(timeit.repeat(make_events, number=number_of_ticks, repeat=3))
+        print (benchmark_name + ': ' + str(int(seconds / number_of_events * 1000000000)) +
+               ' ns per event')
+
+if __name__ == '__main__':
+    run_benchmark()
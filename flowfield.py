@@ -0,0 +1,177 @@
+##### FLOW FIELD PATHFINDING #####
+# one shared field that every enemy can follow instead of each of them
+# searching for its own path. It holds how many steps every tile is from
+# the nearest target (characters, walls) and which way to step to get
+# closer, worked out over the whole CollisionGrid with numpy
+import numpy
+
+UNREACHABLE = numpy.iinfo(numpy.int32).max # the distance of tiles no target can be reached from
+
+# [x, y] steps to the four side neighbours, in the same order as MapGrid.get_random_direction
+DIRECTIONS = numpy.array([[1, 0], [0, -1], [-1, 0], [0, 1]], numpy.int8)
+
+
+class FlowField():
+    '''
+    distances are kept in an int32 array with a one tile closed border
+    around the map, so a neighbour is just a fixed offset in the flat array.
+
+    the field is only worked out when it is asked for, and only when
+    something changed since. Opening a tile only lets distances shrink, so
+    that spreads out from the opened tile. Closing a tile someone could
+    get to or changing the targets builds the field again from the targets
+    '''
+    def __init__(self, collisionGrid):
+        self.collisionGrid = collisionGrid
+        self.map_dimensions = collisionGrid.map_dimensions
+        self.padded_shape = (self.map_dimensions[0] + 2, self.map_dimensions[1] + 2)
+        # flat offsets to the neighbours in DIRECTIONS order
+        self.neighbour_offsets = numpy.array([self.padded_shape[1], -1, -self.padded_shape[1], 1])
+
+        self.padded_distances = numpy.empty(self.padded_shape, numpy.int32)
+        self.padded_distances.fill(UNREACHABLE)
+        self.distances = self.padded_distances[1:-1, 1:-1] # [x, y]
+        self.directions = numpy.zeros((self.map_dimensions[0], self.map_dimensions[1], 2), numpy.int8)
+
+        self.targets = {} # target id: grid position
+        self.needs_rebuild = True
+        self.opened_tiles = [] # tiles opened since the field was worked out
+
+    ##### keeping it up to date #####
+
+    def _is_on_map(self, grid_position):
+        return (0 <= grid_position[0] < self.map_dimensions[0] and
+                0 <= grid_position[1] < self.map_dimensions[1])
+
+    def move_target(self, target_id, grid_position):
+        '''adds the target, or moves it if it is somewhere else now'''
+        grid_position = (grid_position[0], grid_position[1])
+        if self.targets.get(target_id) != grid_position:
+            self.targets[target_id] = grid_position
+            self.needs_rebuild = True
+
+    def remove_target(self, target_id):
+        if self.targets.pop(target_id, None) is not None:
+            self.needs_rebuild = True
+
+    def tile_closed(self, grid_position):
+        '''call after closing the tile on the collision grid'''
+        if self.needs_rebuild or not self._is_on_map(grid_position):
+            return
+        if self.distances[grid_position[0], grid_position[1]] != UNREACHABLE:
+            # paths might have gone through here
+            self.needs_rebuild = True
+
+    def tile_opened(self, grid_position):
+        '''call after opening the tile on the collision grid'''
+        if not self.needs_rebuild and self._is_on_map(grid_position):
+            self.opened_tiles.append(grid_position)
+
+    ##### working it out #####
+
+    def _get_walkable(self):
+        '''open tiles, flat and padded with closed tiles'''
+        walkable = numpy.zeros(self.padded_shape, bool)
+        walkable[1:-1, 1:-1] = self.collisionGrid.collision_array == 0
+        return walkable.ravel()
+
+    def _get_flat_index(self, grid_position):
+        return (grid_position[0] + 1) * self.padded_shape[1] + grid_position[1] + 1
+
+    def _spread(self, frontier, walkable):
+        '''
+        lowers the distances of the open tiles around the frontier until
+        nothing gets any closer. One numpy pass for every step of distance
+        '''
+        distances = self.padded_distances.ravel()
+        while frontier.size:
+            next_distances = numpy.repeat(distances[frontier] + 1, len(self.neighbour_offsets))
+            neighbours = (frontier[:, numpy.newaxis] + self.neighbour_offsets).ravel()
+            closer = walkable[neighbours] & (next_distances < distances[neighbours])
+            neighbours = neighbours[closer]
+            # the same tile can be reached from more than one frontier tile
+            numpy.minimum.at(distances, neighbours, next_distances[closer])
+            frontier = numpy.unique(neighbours)
+
+    def _rebuild(self, walkable):
+        '''every distance again, from the targets out'''
+        self.padded_distances.fill(UNREACHABLE)
+        distances = self.padded_distances.ravel()
+        frontier = numpy.array([self._get_flat_index(grid_position) for grid_position in self.targets.values()
+                                if self._is_on_map(grid_position)], numpy.intp)
+        # targets can be on closed tiles (walls), enemies walk up next to them
+        distances[frontier] = 0
+        self._spread(numpy.unique(frontier), walkable)
+
+    def _spread_from_opened_tiles(self, walkable):
+        distances = self.padded_distances.ravel()
+        frontier = []
+        for grid_position in self.opened_tiles:
+            flat_index = self._get_flat_index(grid_position)
+            if not walkable[flat_index]:
+                # closed again since
+                continue
+            nearest_neighbour = distances[flat_index + self.neighbour_offsets].min()
+            if nearest_neighbour != UNREACHABLE and nearest_neighbour + 1 < distances[flat_index]:
+                distances[flat_index] = nearest_neighbour + 1
+                frontier.append(flat_index)
+        self._spread(numpy.array(frontier, numpy.intp), walkable)
+
+    def _update_directions(self):
+        '''every tile steps to its closest neighbour, tiles no closer than that stay put'''
+        padded = self.padded_distances
+        width = self.map_dimensions[0]
+        height = self.map_dimensions[1]
+        neighbour_distances = numpy.array([padded[1 + step[0]:1 + step[0] + width,
+                                                  1 + step[1]:1 + step[1] + height]
+                                           for step in DIRECTIONS])
+        closest_neighbour = neighbour_distances.argmin(axis=0)
+        gets_closer = neighbour_distances.min(axis=0) < self.distances
+        self.directions[:] = DIRECTIONS[closest_neighbour]
+        self.directions[~gets_closer] = 0
+
+    def update(self):
+        '''works out whatever changed, the queries call this for you'''
+        if not self.needs_rebuild and not self.opened_tiles:
+            return
+
+        walkable = self._get_walkable()
+        if self.needs_rebuild:
+            self._rebuild(walkable)
+        else:
+            self._spread_from_opened_tiles(walkable)
+        self.needs_rebuild = False
+        self.opened_tiles = []
+        self._update_directions()
+
+    ##### asking it things #####
+
+    def get_distance(self, grid_position):
+        '''steps to the nearest target, None if there is no way there'''
+        self.update()
+        if not self._is_on_map(grid_position):
+            return None
+        distance = self.distances[grid_position[0], grid_position[1]]
+        if distance == UNREACHABLE:
+            return None
+        return int(distance)
+
+    def get_direction(self, grid_position):
+        '''the [x, y] step towards the nearest target, [0, 0] if there is none to take'''
+        self.update()
+        if not self._is_on_map(grid_position):
+            return [0, 0]
+        direction = self.directions[grid_position[0], grid_position[1]]
+        return [int(direction[0]), int(direction[1])]
+
+    def get_directions_many(self, grid_positions):
+        '''get_direction for an array of grid positions, returns an int8 array of [x, y] steps'''
+        self.update()
+        grid_positions = numpy.asarray(grid_positions)
+        x = grid_positions[..., 0]
+        y = grid_positions[..., 1]
+        on_map = (x >= 0) & (x < self.map_dimensions[0]) & (y >= 0) & (y < self.map_dimensions[1])
+
+        directions = numpy.zeros(x.shape + (2,), numpy.int8)
+        directions[on_map] = self.directions[x[on_map], y[on_map]]
+        return directions
@@ -0,0 +1,133 @@
+##### CLIENT INTERPOLATION #####
+# the server only sends a changed game state every few ticks. Instead of
+# jumping to each one, the client keeps the last few states of every
+# moving object with the server time they are from and draws the world
+# a little in the past, between two states it already has
+
+
+class ServerClock():
+    '''
+    guesses the server time from the server times in the game states
+    we receive. The render time is render_delay seconds behind that, so
+    there is almost always a newer state to interpolate towards
+    '''
+    def __init__(self, render_delay=0.1):
+        self.render_delay = render_delay
+        self.time_offset = None # server time - local time
+        self.smoothing = 0.1 # how much of each new offset we take
+        self.max_offset_error = 0.5 # further off than this and we jump straight to it
+        self.last_render_time = None
+
+    def add_server_time(self, server_time, local_time):
+        time_offset = server_time - local_time
+        if self.time_offset is None or abs(time_offset - self.time_offset) > self.max_offset_error:
+            self.time_offset = time_offset
+            self.last_render_time = None
+        else:
+            self.time_offset += (time_offset - self.time_offset) * self.smoothing
+
+    def get_render_time(self, local_time):
+        '''the server time to draw the world at, never goes backwards'''
+        if self.time_offset is None:
+            return None
+        render_time = local_time + self.time_offset - self.render_delay
+        if self.last_render_time is not None and render_time < self.last_render_time:
+            render_time = self.last_render_time
+        self.last_render_time = render_time
+        return render_time
+
+
+class InterpolationBuffer():
+    '''
+    the last few states of one object as (server time, position, velocity).
+    get_position interpolates between the two states around the render
+    time. Past the newest state it keeps moving with the newest velocity
+    for at most max_extrapolation_time seconds (None for no limit, for
+    things that only get sent when they change direction).
+
+    When a new state moves the object away from where we were drawing
+    it, the difference is taken out over correction_time seconds
+    instead of all at once
+    '''
+    def __init__(self, max_extrapolation_time=0.25, correction_time=0.1, max_states=32):
+        self.states = []
+        self.max_extrapolation_time = max_extrapolation_time
+        self.correction_time = correction_time
+        self.max_states = max_states
+
+        self.last_position = None # where we last drew the object
+        self.last_render_time = None
+        self.correction = [0.0, 0.0] # added to where we should be, shrinks to nothing
+        self.correction_start_time = None
+
+    def reset(self, server_time, position, velocity):
+        '''forget every state, for complete game states and objects that just came into view'''
+        self.states = []
+        self.correction = [0.0, 0.0]
+        self.correction_start_time = None
+        self.last_position = None
+        self.add_state(server_time, position, velocity)
+
+    def add_state(self, server_time, position, velocity):
+        if self.states and server_time < self.states[-1][0]:
+            # older than what we have
+            return
+        if self.states and server_time == self.states[-1][0]:
+            self.states.pop()
+        self.states.append((server_time, [position[0], position[1]], [velocity[0], velocity[1]]))
+        if len(self.states) > self.max_states:
+            del self.states[0]
+
+        if self.last_position is not None:
+            # take out the jump over the next correction_time seconds
+            position = self._get_position(self.last_render_time)
+            self.correction = [self.last_position[0] - position[0],
+                               self.last_position[1] - position[1]]
+            self.correction_start_time = self.last_render_time
+
+    def _forget_old_states(self, render_time):
+        '''keeps the newest state at or before the render time and everything after it'''
+        while len(self.states) > 2 and self.states[1][0] <= render_time:
+            del self.states[0]
+
+    def _get_position(self, render_time):
+        '''where the states put the object at render time, without the correction'''
+        if render_time is None:
+            render_time = self.states[-1][0]
+
+        first_time, first_position, first_velocity = self.states[0]
+        if render_time <= first_time:
+            return list(first_position)
+
+        for state_index in range(1, len(self.states)):
+            next_time, next_position, next_velocity = self.states[state_index]
+            if render_time <= next_time:
+                previous_time, previous_position, previous_velocity = self.states[state_index - 1]
+                fraction = (render_time - previous_time) / (next_time - previous_time)
+                return [previous_position[0] + (next_position[0] - previous_position[0]) * fraction,
+                        previous_position[1] + (next_position[1] - previous_position[1]) * fraction]
+
+        # dead reckoning past the newest state
+        newest_time, newest_position, newest_velocity = self.states[-1]
+        extrapolation_time = render_time - newest_time
+        if self.max_extrapolation_time is not None:
+            extrapolation_time = min(extrapolation_time, self.max_extrapolation_time)
+        return [newest_position[0] + newest_velocity[0] * extrapolation_time,
+                newest_position[1] + newest_velocity[1] * extrapolation_time]
+
+    def get_position(self, render_time):
+        if render_time is not None:
+            self._forget_old_states(render_time)
+        position = self._get_position(render_time)
+
+        if self.correction_start_time is not None and render_time is not None:
+            remaining = 1.0 - (render_time - self.correction_start_time) / self.correction_time
+            if remaining <= 0.0:
+                self.correction_start_time = None
+            else:
+                position[0] += self.correction[0] * remaining
+                position[1] += self.correction[1] * remaining
+
+        self.last_position = position
+        self.last_render_time = render_time
+        return list(position)
@@ -0,0 +1,186 @@
+##### MAP ARTIFACTS #####
+# a generated map saved to disk so it doesn't have to be made again.
+# Maps are keyed on (generator, parameters, seed): the same key always
+# makes the same map, so a server can boot from a library of pre-built
+# maps and clients can load the exact same file instead of being sent
+# every wall.
+#
+# file layout (little endian):
+#   header: magic, format version, map width, map height, key
+#   then every layer in LAYERS order, each starting on a 16 byte boundary,
+#   as a raw array indexed [x, y] (gravity is [x, y, (velocity x, velocity y, force)])
+import os
+import struct
+import hashlib
+import tempfile
+
+import numpy
+
+import mapgrid
+
+MAP_ARTIFACT_MAGIC = 'PDMAP\x00\x00\x00'
+MAP_ARTIFACT_FORMAT = 3
+HEADER_FORMAT = '<8sIII40s'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+LAYER_ALIGNMENT = 16
+
+# name, dtype, values per tile
+LAYERS = [('collision', numpy.dtype('u1'), 1),
+          ('terrain', numpy.dtype('u1'), 1),
+          ('gravity', numpy.dtype('<f4'), 3)]
+
+GENERATORS = ['rooms', 'caves']
+
+# where the server and the client keep their MapLibrary, next to this file
+# so it doesn't depend on where the game was started from
+MAP_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'maps')
+
+
+def get_map_key(map_dimensions, generator, parameters, seed):
+    '''the name of the map made by this generator with these parameters and seed'''
+    key_source = repr((MAP_ARTIFACT_FORMAT, tuple(map_dimensions), generator,
+                       sorted(parameters.items()), seed))
+    return hashlib.sha1(key_source).hexdigest()
+
+def _get_layer_offsets(map_dimensions):
+    '''where every layer starts in the file, and where the file ends'''
+    offsets = {}
+    offset = HEADER_SIZE
+    for name, dtype, values_per_tile in LAYERS:
+        offset += -offset % LAYER_ALIGNMENT
+        offsets[name] = offset
+        offset += map_dimensions[0] * map_dimensions[1] * values_per_tile * dtype.itemsize
+    return offsets, offset
+
+def _get_layer_shape(map_dimensions, values_per_tile):
+    if values_per_tile == 1:
+        return (map_dimensions[0], map_dimensions[1])
+    return (map_dimensions[0], map_dimensions[1], values_per_tile)
+
+
+class MapArtifact():
+    '''
+    the layers of one generated map as numpy arrays indexed [x, y].
+    loaded ones are read only memmaps, copy what you want to change
+    (CollisionGrid copies the collision layer for you)
+    '''
+    def __init__(self, map_dimensions, key, collision_array, terrain_array, gravity_array):
+        self.map_dimensions = map_dimensions
+        self.key = key
+        self.collision_array = collision_array
+        self.terrain_array = terrain_array
+        self.gravity_array = gravity_array
+
+    def get_collision_grid(self):
+        return mapgrid.CollisionGrid(self.map_dimensions, self.collision_array)
+
+
+def generate_map_artifact(map_dimensions, generator='rooms', parameters=None, seed=0):
+    '''
+    makes a map. parameters go to the generator:
+    rooms: the TerrainGrid room settings, number_of_rooms is needed
+    caves: the OutsideTerrainGrid settings, filled cave tiles become closed walls
+    '''
+    if parameters is None:
+        parameters = {}
+    if generator not in GENERATORS:
+        raise RuntimeError('Unknown map generator: ' + str(generator))
+
+    key = get_map_key(map_dimensions, generator, parameters, seed)
+
+    if generator == 'rooms':
+        terrainGrid = mapgrid.TerrainGrid(map_dimensions, seed=seed, **parameters)
+        terrain_array = terrainGrid.terrain_map_grid
+        collision_array = terrainGrid.get_collision_array()
+
+    elif generator == 'caves':
+        outsideTerrainGrid = mapgrid.OutsideTerrainGrid(map_dimensions, seed=seed, **parameters)
+        # filled tiles are closed walls, the rest is floor
+        terrain_array = numpy.where(outsideTerrainGrid.outside_terrain_grid != 0, 2, 1).astype(numpy.uint8)
+        collision_array = outsideTerrainGrid.outside_terrain_grid.astype(numpy.uint8)
+
+    gravity_array = mapgrid.GravityGrid(map_dimensions).get_gravity_array()
+
+    return MapArtifact(map_dimensions, key, collision_array, terrain_array, gravity_array)
+
+def write_map_artifact(mapArtifact, path):
+    '''
+    writes the map to a temporary file next to path and renames it
+    into place, so nobody ever loads half a map
+    '''
+    map_dimensions = mapArtifact.map_dimensions
+    offsets, file_size = _get_layer_offsets(map_dimensions)
+    arrays = {'collision': mapArtifact.collision_array,
+              'terrain': mapArtifact.terrain_array,
+              'gravity': mapArtifact.gravity_array}
+
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    map_file = os.fdopen(file_descriptor, 'wb')
+    try:
+        map_file.write(struct.pack(HEADER_FORMAT, MAP_ARTIFACT_MAGIC, MAP_ARTIFACT_FORMAT,
+                                   map_dimensions[0], map_dimensions[1], mapArtifact.key))
+        for name, dtype, values_per_tile in LAYERS:
+            array = numpy.ascontiguousarray(arrays[name], dtype)
+            if array.shape != _get_layer_shape(map_dimensions, values_per_tile):
+                raise RuntimeError('Map layer ' + name + ' has the wrong shape: ' + str(array.shape))
+            map_file.write('\x00' * (offsets[name] - map_file.tell()))
+            map_file.write(array.tostring())
+        map_file.close()
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temporary_path, path)
+    except:
+        map_file.close()
+        os.remove(temporary_path)
+        raise
+
+def load_map_artifact(path):
+    '''memory maps every layer of the map file, nothing is read until it is used'''
+    map_file = open(path, 'rb')
+    try:
+        header = map_file.read(HEADER_SIZE)
+    finally:
+        map_file.close()
+    if len(header) != HEADER_SIZE:
+        raise RuntimeError('Map file is too short: ' + path)
+    magic, map_format, map_width, map_height, key = struct.unpack(HEADER_FORMAT, header)
+    if magic != MAP_ARTIFACT_MAGIC:
+        raise RuntimeError('Not a map file: ' + path)
+    if map_format != MAP_ARTIFACT_FORMAT:
+        raise RuntimeError('Unsupported map format ' + str(map_format) + ': ' + path)
+
+    map_dimensions = [map_width, map_height]
+    offsets, file_size = _get_layer_offsets(map_dimensions)
+    if os.path.getsize(path) != file_size:
+        raise RuntimeError('Map file is the wrong size: ' + path)
+
+    arrays = {}
+    for name, dtype, values_per_tile in LAYERS:
+        arrays[name] = numpy.memmap(path, dtype, 'r', offsets[name],
+                                    _get_layer_shape(map_dimensions, values_per_tile))
+
+    return MapArtifact(map_dimensions, key, arrays['collision'], arrays['terrain'], arrays['gravity'])
+
+
+class MapLibrary():
+    '''a directory of map files named by their key, maps are made the first time they are asked for'''
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def get_map_path(self, key):
+        return os.path.join(self.directory, key + '.map')
+
+    def get_map_artifact(self, map_dimensions, generator='rooms', parameters=None, seed=0):
+        if parameters is None:
+            parameters = {}
+        path = self.get_map_path(get_map_key(map_dimensions, generator, parameters, seed))
+
+        if not os.path.exists(path):
+            write_map_artifact(generate_map_artifact(map_dimensions, generator, parameters, seed), path)
+        return load_map_artifact(path)
+
+    def load_map_artifact(self, key):
+        '''a map someone else made, by its key'''
+        return load_map_artifact(self.get_map_path(key))
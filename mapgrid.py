@@ -4,6 +4,8 @@ import pygame
 import random
 import math
 import time
+import numpy
+import heapq
 
 # used in the aigrid pending sources to active sources transfer
 from collections import deque
@@ -48,6 +50,31 @@ def convert_grid_position_to_position(grid_position, tile_size):
 
     return [position_x, position_y]
 
+def get_rect_difference(rect, other_rect):
+    '''
+    rectangles (left, top, right, bottom) that together cover the part
+    of rect outside other_rect. They include their edges, so they can
+    overlap other_rect along them
+    '''
+    left, top, right, bottom = rect
+    other_left, other_top, other_right, other_bottom = other_rect
+    if other_left > right or other_right < left or other_top > bottom or other_bottom < top:
+        return [rect]
+
+    rects = []
+    # the strips beside other_rect, then above and below it
+    if left < other_left:
+        rects.append((left, top, other_left, bottom))
+    if right > other_right:
+        rects.append((other_right, top, right, bottom))
+    middle_left = max(left, other_left)
+    middle_right = min(right, other_right)
+    if top < other_top:
+        rects.append((middle_left, top, middle_right, other_top))
+    if bottom > other_bottom:
+        rects.append((middle_left, other_bottom, middle_right, bottom))
+    return rects
+
 class Vector():
     '''
     Class:
@@ -82,6 +109,9 @@ class Vector():
         return (0, 0)
 
 class MapGrid():
+    # generators that have to make the same map from the same seed give
+    # themselves their own random.Random(seed)
+    randomGenerator = random.Random()
 
     def _generate_empty_map_grid(self, map_width, map_height):
         '''
@@ -121,7 +151,7 @@ class MapGrid():
         for x in range(map_width):
             new_map_grid.append([]) # add our columns to the array
             for y in range(map_height):
-                new_map_grid[x].append(random.choice([0,1])) # fill in our rows
+                new_map_grid[x].append(self.randomGenerator.choice([0,1])) # fill in our rows
 
         return new_map_grid
 
@@ -150,7 +180,7 @@ class MapGrid():
         generates a random direction,
         used in the random walk algorithm
         '''
-        random_direction = random.choice(['right', 'up', 'left', 'down'])
+        random_direction = self.randomGenerator.choice(['right', 'up', 'left', 'down'])
 
         return random_direction
                     
@@ -159,179 +189,324 @@ class CollisionGrid(MapGrid):
     '''
     tiles with a value of 1 are closed
     tiles with a value of 0 are open
+    tiles off the map count as open
+
+    the tiles are kept in one uint8 numpy array indexed [x, y].
+    the methods that take arrays of grid positions answer for
+    hundreds of tiles in one call
     '''
-    def __init__(self, map_dimensions):
+    OFF_MAP = -1 # the value returned for tiles off the map
+
+    # [x, y] offsets of a 3x3 neighbourhood, in the same order get_surrounding_tiles returns them
+    NEIGHBOURHOOD_OFFSETS = numpy.array([[-1, -1], [0, -1], [1, -1],
+                                         [-1, 0], [0, 0], [1, 0],
+                                         [-1, 1], [0, 1], [1, 1]])
+    
+    def __init__(self, map_dimensions, collision_array=None):
         self.map_dimensions = map_dimensions
         
         # create a grid which holds the collision tile information
-        self.collision_grid = self._generate_empty_map_grid(self.map_dimensions[0], self.map_dimensions[1])
+        self.collision_array = numpy.zeros((self.map_dimensions[0], self.map_dimensions[1]), numpy.uint8)
+        if collision_array is not None:
+            # start from a pre-built map, copied so it can be changed
+            self.collision_array[:] = collision_array
 
     def close_tile(self, grid_position):
-        self.collision_grid = self._set_grid_position_value(self.collision_grid, grid_position, 1)
+        self.collision_array[grid_position[0], grid_position[1]] = 1
 
     def open_tile(self, grid_position):
-        self.collision_grid = self._set_grid_position_value(self.collision_grid, grid_position, 0)
+        self.collision_array[grid_position[0], grid_position[1]] = 0
+
+    def _clip_rect(self, top_left_grid_position, bottom_right_grid_position):
+        '''the part of the rectangle that is on the map, as slices'''
+        left = max(top_left_grid_position[0], 0)
+        top = max(top_left_grid_position[1], 0)
+        right = min(bottom_right_grid_position[0] + 1, self.map_dimensions[0])
+        bottom = min(bottom_right_grid_position[1] + 1, self.map_dimensions[1])
+        return slice(left, max(right, left)), slice(top, max(bottom, top))
+
+    def close_rect(self, top_left_grid_position, bottom_right_grid_position):
+        '''closes every tile in the rectangle, corners included'''
+        self.collision_array[self._clip_rect(top_left_grid_position, bottom_right_grid_position)] = 1
+
+    def open_rect(self, top_left_grid_position, bottom_right_grid_position):
+        '''opens every tile in the rectangle, corners included'''
+        self.collision_array[self._clip_rect(top_left_grid_position, bottom_right_grid_position)] = 0
+
+    def _is_on_map(self, x, y):
+        return (x >= 0) & (x < self.map_dimensions[0]) & (y >= 0) & (y < self.map_dimensions[1])
 
     def is_tile_open(self, grid_position):
-        value = self._get_grid_position_value(self.collision_grid, grid_position)
-        if value == 1:
-            # the tile is closed
-            return False
-        elif value == 0:
-            # the tile is open
-            return True
-        elif value == None:
+        x = grid_position[0]
+        y = grid_position[1]
+        if not self._is_on_map(x, y):
             return True
-        else:
-            raise RuntimeError('Incorrect tile value: ' + str(value))
+        return bool(self.collision_array[x, y] == 0)
 
-    def get_surrounding_tiles(self, column_index, tile_index):
-        '''Goes through all the surrounding tiles, and returns the lowest value of each one'''
-                                            
-        # get the surrounding tile values for each tile
-        x = column_index
-        y = tile_index
-
-        # TOP ROW 
-        # if too far up
-        if y - 1 < 0:
-            top_left = None
-            top_mid = None
-            top_right = None
-        else:
-            
-            # TOP LEFT
-            # if too far left 
-            if x - 1 < 0:
-                top_left = None
-            else:
-                try:
-                    top_left = self.collision_grid[x - 1][y - 1]
-                # handle too far right or down
-                except IndexError:
-                    top_left = None
-            
+    def get_tile_values(self, grid_positions):
+        '''
+        grid_positions: an array of [x, y] grid positions
+        returns: an int8 array of the tile values, OFF_MAP for tiles off the map
+        '''
+        grid_positions = numpy.asarray(grid_positions)
+        x = grid_positions[..., 0]
+        y = grid_positions[..., 1]
+        on_map = self._is_on_map(x, y)
 
-            # TOP MID
-            # if too far left
-            if x < 0:
-                top_mid = None
+        tile_values = numpy.empty(x.shape, numpy.int8)
+        tile_values.fill(self.OFF_MAP)
+        tile_values[on_map] = self.collision_array[x[on_map], y[on_map]]
+        return tile_values
 
-            else:
-                try:
-                    top_mid = self.collision_grid[x][y - 1]
-                # if too far right or down
-                except IndexError:
-                    top_mid = None
-
-            # TOP RIGHT
-            # if too far left
-            if x + 1 < 0:
-                top_right = None
-            else:
-                try:
-                    top_right = self.collision_grid[x + 1][y - 1]
-                except IndexError:
-                    top_right = None
-                    
-        # CENTER ROW
-        # if too far up
-        if y < 0:
-            center_left = None
-            center_mid = None
-            center_right = None
+    def are_tiles_open(self, grid_positions):
+        '''is_tile_open for an array of grid positions, returns an array of bools'''
+        return self.get_tile_values(grid_positions) != 1
 
-        else:
-            # CENTER LEFT
-            # if too far left
-            if x - 1 < 0:
-                center_left = None
-            else:
-                try:
-                    center_left = self.collision_grid[x - 1][y]
-                    # if too far right or down
-                except IndexError:
-                    center_left = None
-
-            # CENTER MID
-            # if too far left
-            if x < 0:
-                center_mid = None
-            else:
-                try:
-                    center_mid = self.collision_grid[x][y]
-                # if too far right or down
-                except IndexError:
-                    center_mid = None
-
-            # CENTER RIGHT
-            # if too far left
-            if x + 1 < 0:
-                center_right = None
-            else:
-                try:
-                    center_right = self.collision_grid[x + 1][y]
-                # if too far right or down
-                except IndexError:
-                    center_right = None
-                    
+    def get_surrounding_tiles_many(self, grid_positions):
+        '''
+        the 3x3 neighbourhood around each grid position.
+        returns an int8 array shaped (number of positions, 9) in the same
+        order as get_surrounding_tiles, OFF_MAP for tiles off the map
+        '''
+        grid_positions = numpy.asarray(grid_positions)
+        neighbourhood_positions = grid_positions[:, numpy.newaxis, :] + self.NEIGHBOURHOOD_OFFSETS
+        return self.get_tile_values(neighbourhood_positions)
+
+    def get_surrounding_tiles(self, column_index, tile_index):
+        '''Goes through all the surrounding tiles, and returns the value of each one, None if it is off the map'''
+        tile_values = self.get_surrounding_tiles_many([[column_index, tile_index]])[0]
+        return tuple([None if tile_value == self.OFF_MAP else int(tile_value)
+                      for tile_value in tile_values])
+    
+class SpatialHash():
+    '''
+    keeps track of which grid cell every object is in, so finding
+    everything in an area only looks at the cells that cover that
+    area instead of every object.
 
-        # BOTTOM ROW
-        # if too far up
-        if y + 1 < 0:
-            bottom_left = None
-            bottom_mid = None
-            bottom_right = None
+    objects are inserted once, moved when their grid position
+    changes, and removed when they leave the game.
+
+    with track_changes it also keeps the ids of every object that was
+    inserted, moved or removed until pop_changed_object_ids is called
+    '''
+    def __init__(self, tile_size, track_changes=False):
+        self.tile_size = tile_size
+        self.cells = {} # (grid x, grid y): set of object ids
+        self.object_cells = {} # object id: (grid x, grid y)
+        self.object_positions = {} # object id: [pixel x, pixel y]
+        self.track_changes = track_changes
+        self.changed_object_ids = set()
+
+    def __len__(self):
+        return len(self.object_cells)
+
+    def __contains__(self, object_id):
+        return object_id in self.object_cells
+
+    def _get_cell(self, position):
+        return (int(math.floor(position[0] / self.tile_size)),
+                int(math.floor(position[1] / self.tile_size)))
+
+    def _add_to_cell(self, object_id, cell):
+        if cell in self.cells:
+            self.cells[cell].add(object_id)
         else:
-            # BOTTOM LEFT
-            # if too far left
-            if x - 1 < 0:
-                bottom_left = None
-            else:
-                try:
-                    bottom_left = self.collision_grid[x - 1][y + 1]
-                # if too far right or down
-                except IndexError:
-                    bottom_left = None
-
-            # BOTTOM MID
-            # if too far left
-            if x < 0:
-                bottom_mid = None
-            else:
-                try:
-                    bottom_mid = self.collision_grid[x][y + 1]
-                # if too far right or down
-                except IndexError:
-                    bottom_mid = None
-
-            # BOTTOM RIGHT
-            # if too far left
-            if x + 1 < 0:
-                bottom_right = None
+            self.cells[cell] = set([object_id])
+        self.object_cells[object_id] = cell
+
+    def _remove_from_cell(self, object_id, cell):
+        cell_object_ids = self.cells[cell]
+        cell_object_ids.discard(object_id)
+        if not cell_object_ids:
+            # don't keep empty cells around, queries skip missing cells
+            del self.cells[cell]
+
+    def insert(self, object_id, position):
+        if object_id in self.object_cells:
+            raise RuntimeError('Object is already in the spatial hash: ' + str(object_id))
+        self.object_positions[object_id] = [position[0], position[1]]
+        self._add_to_cell(object_id, self._get_cell(position))
+        if self.track_changes:
+            self.changed_object_ids.add(object_id)
+
+    def move(self, object_id, position):
+        '''updates the object's position, only touches the cells if it moved into a new one'''
+        self.object_positions[object_id] = [position[0], position[1]]
+        if self.track_changes:
+            self.changed_object_ids.add(object_id)
+        cell = self._get_cell(position)
+        previous_cell = self.object_cells[object_id]
+        if cell != previous_cell:
+            self._remove_from_cell(object_id, previous_cell)
+            self._add_to_cell(object_id, cell)
+
+    def remove(self, object_id):
+        cell = self.object_cells.pop(object_id, None)
+        if cell is not None:
+            self._remove_from_cell(object_id, cell)
+            del self.object_positions[object_id]
+            if self.track_changes:
+                self.changed_object_ids.add(object_id)
+
+    def pop_changed_object_ids(self):
+        '''the ids inserted, moved or removed since the last time this was called'''
+        changed_object_ids = self.changed_object_ids
+        self.changed_object_ids = set()
+        return changed_object_ids
+
+    def get_position(self, object_id):
+        return self.object_positions[object_id]
+
+    def get_cell_object_ids(self, grid_position):
+        '''the ids of every object in one grid cell'''
+        return list(self.cells.get((grid_position[0], grid_position[1]), ()))
+
+    def _get_cells_in_rect(self, left, top, right, bottom):
+        '''the occupied cells that overlap the rectangle'''
+        top_left_cell = self._get_cell([left, top])
+        bottom_right_cell = self._get_cell([right, bottom])
+        cell_count = ((bottom_right_cell[0] - top_left_cell[0] + 1) *
+                      (bottom_right_cell[1] - top_left_cell[1] + 1))
+        if cell_count > len(self.cells):
+            # big areas, it's faster to look at the cells that have something in them
+            return [cell for cell in self.cells
+                    if top_left_cell[0] <= cell[0] <= bottom_right_cell[0]
+                    and top_left_cell[1] <= cell[1] <= bottom_right_cell[1]]
+
+        cells = []
+        for cell_x in range(top_left_cell[0], bottom_right_cell[0] + 1):
+            for cell_y in range(top_left_cell[1], bottom_right_cell[1] + 1):
+                if (cell_x, cell_y) in self.cells:
+                    cells.append((cell_x, cell_y))
+        return cells
+
+    def query_rect(self, left, top, right, bottom):
+        '''returns the ids of every object with its position inside the rectangle'''
+        object_ids = []
+        for cell in self._get_cells_in_rect(left, top, right, bottom):
+            for object_id in self.cells[cell]:
+                position = self.object_positions[object_id]
+                if left <= position[0] <= right and top <= position[1] <= bottom:
+                    object_ids.append(object_id)
+        return object_ids
+
+    def query_radius(self, center, radius):
+        '''returns the ids of every object with its position inside the circle'''
+        object_ids = []
+        squared_radius = radius ** 2
+        for cell in self._get_cells_in_rect(center[0] - radius, center[1] - radius,
+                                            center[0] + radius, center[1] + radius):
+            for object_id in self.cells[cell]:
+                position = self.object_positions[object_id]
+                if (position[0] - center[0]) ** 2 + (position[1] - center[1]) ** 2 <= squared_radius:
+                    object_ids.append(object_id)
+        return object_ids
+
+    def get_cells_on_segment(self, start_position, end_position):
+        '''
+        every grid cell a line from start to end passes through, in order.
+        walks the grid one cell border at a time (a DDA walk) so fast
+        objects can't skip over a cell between two updates
+        '''
+        cell_x, cell_y = self._get_cell(start_position)
+        end_cell_x, end_cell_y = self._get_cell(end_position)
+        cells = [(cell_x, cell_y)]
+
+        direction_x = end_position[0] - start_position[0]
+        direction_y = end_position[1] - start_position[1]
+        step_x = 1 if direction_x > 0 else -1
+        step_y = 1 if direction_y > 0 else -1
+
+        # how far along the segment (0 to 1) the next x and y cell borders are,
+        # and how far along it one whole cell is
+        if direction_x != 0:
+            next_border_x = (cell_x + (step_x > 0)) * self.tile_size
+            t_max_x = (next_border_x - start_position[0]) / float(direction_x)
+            t_delta_x = self.tile_size / float(abs(direction_x))
+        else:
+            t_max_x = t_delta_x = float('inf')
+        if direction_y != 0:
+            next_border_y = (cell_y + (step_y > 0)) * self.tile_size
+            t_max_y = (next_border_y - start_position[1]) / float(direction_y)
+            t_delta_y = self.tile_size / float(abs(direction_y))
+        else:
+            t_max_y = t_delta_y = float('inf')
+
+        while (cell_x, cell_y) != (end_cell_x, end_cell_y):
+            # the end cell check keeps floating point error from walking past the end
+            if (t_max_x < t_max_y and cell_x != end_cell_x) or cell_y == end_cell_y:
+                cell_x += step_x
+                t_max_x += t_delta_x
             else:
-                try:
-                    bottom_right = self.collision_grid[x + 1][y + 1]
-                # if too far right or down
-                except IndexError:
-                    bottom_right = None
-        return (top_left, top_mid, top_right,
-                center_left, center_mid, center_right,
-                bottom_left, bottom_mid, bottom_right)
-    
+                cell_y += step_y
+                t_max_y += t_delta_y
+            cells.append((cell_x, cell_y))
+        return cells
+
+    def query_segment(self, start_position, end_position):
+        '''returns the ids of every object in the cells the segment passes through, nearest first'''
+        object_ids = []
+        for cell in self.get_cells_on_segment(start_position, end_position):
+            if cell in self.cells:
+                object_ids.extend(self.cells[cell])
+        return object_ids
+
 class TerrainGrid(MapGrid):
+    '''
+    rooms joined by hallways, grown out from one room in the middle of the map.
+    number_of_rooms is how many rooms it tries to make. A room that doesn't
+    fit closes the wall it would have been built off of, and it gives up
+    after max_room_attempts rooms didn't fit (number_of_rooms * 10 if not
+    given) or when there is no wall left to build off of. rooms_placed
+    says how many it made
+    tile values:
+    0 = empty
+    1 = floor
+    2 = closed wall (unable to build off of)
+    3 = right wall
+    4 = up wall
+    5 = left wall
+    6 = down wall
+    7 = hallway
+
+    the tiles are kept in one uint8 numpy array indexed [x, y]
+    '''
+    # the wall a hall has to start on to go in each direction
+    HALL_START_WALLS = {'right': 3, 'up': 4, 'left': 5, 'down': 6}
+    # the tiles characters can't walk through
+    WALL_TILES = [2, 3, 4, 5, 6]
+
+    def __init__(self, map_dimensions, number_of_rooms,
+                 starting_room_direction='center',
+                 max_room_width=5, max_room_height=5,
+                 min_room_width=3, min_room_height=3,
+                 max_hall_length=5, min_hall_length=3,
+                 room_size_multiplier=1.2, seed=None, max_room_attempts=None):
+        self.map_dimensions = map_dimensions
+        self.map_width = map_dimensions[0]
+        self.map_height = map_dimensions[1]
+        if max_room_attempts is None:
+            max_room_attempts = number_of_rooms * 10
+
+        # the same seed and settings make the same map
+        self.randomGenerator = random.Random(seed)
 
-    def __init__(self):
         # create a grid which holds the terrain image information
-        self.empty_terrain_map_grid = self._generate_empty_map_grid(self.map_width, self.map_height)
+        self.terrain_map_grid = numpy.zeros((self.map_width, self.map_height), numpy.uint8)
         #self.terrain_map_grid = self._generate_terrain_map_random_walk(self.empty_terrain_map_grid)
 
-        self.terrain_map_grid = self._generate_terrain_map_random_rooms(self.empty_terrain_map_grid,
+        # the wall tiles of each direction we can still start a hall on, as heaps
+        # of (x, y) so we always build off the same wall the old full scan found.
+        # Tiles that got closed or built over are only thrown out when they reach the top
+        self.hall_start_candidates = dict([(wall, []) for wall in self.HALL_START_WALLS.values()])
+
+        self.terrain_map_grid = self._generate_terrain_map_random_rooms(self.terrain_map_grid,
                                                                         number_of_rooms, starting_room_direction,
                                                                         max_room_width, max_room_height,
                                                                         min_room_width, min_room_height,
                                                                         max_hall_length, min_hall_length,
-                                                                        room_size_multiplier)
+                                                                        room_size_multiplier, max_room_attempts)
     def _generate_terrain_map_random_walk(self, empty_terrain_map_grid):
         '''
         fills up our terrain grid with rooms.
@@ -365,28 +540,19 @@ class TerrainGrid(MapGrid):
 
         return terrain_map_grid
 
-    def _generate_terrain_map_random_rooms(self, empty_terrain_map_grid, number_of_rooms,
+    def _generate_terrain_map_random_rooms(self, terrain_map_grid, number_of_rooms,
                                            starting_room_direction,
                                            max_room_width, max_room_height,
                                            min_room_width, min_room_height,
                                            max_hall_length, min_hall_length,
-                                           room_size_multiplier):
+                                           room_size_multiplier, max_room_attempts):
         '''
-        fills up our grid with more clearly defined rooms
-        room variables:
-        0 = empty
-        1 = floor
-        2 = closed wall (unable to build off of)
-        3 = right wall
-        4 = up wall
-        5 = left wall
-        6 = down wall
-        7 = testing if stuff works
+        fills up our grid with more clearly defined rooms.
+        stops early if too many rooms didn't fit or there is no wall
+        left to build a hall off of, sets rooms_placed
         '''
-
-        terrain_map_grid = empty_terrain_map_grid
-        number_of_rooms = number_of_rooms
-        self.current_room_number = 0
+        self.rooms_placed = 0
+        failed_room_attempts = 0
 
         # set our starting room center (middle of the map)
         current_tile_position_x = self.map_width / 2
@@ -396,69 +562,58 @@ class TerrainGrid(MapGrid):
         ##### Create our first room #####
         
         # get room stats
-        print 'creating first room'
-        new_room_width = random.randrange(min_room_width, max_room_width)
-        new_room_height = random.randrange(min_room_height, max_room_height)
+        new_room_width = self.randomGenerator.randrange(min_room_width, max_room_width)
+        new_room_height = self.randomGenerator.randrange(min_room_height, max_room_height)
 
         terrain_map_grid = self._append_room_to_terrain_map(terrain_map_grid, current_tile_position,
                                                             new_room_width, new_room_height,
                                                             starting_room_direction)
-        self.current_room_number += 1
+        self.rooms_placed += 1
         
-        while self.current_room_number < number_of_rooms:
-            print 'making the rest of the rooms'
+        while self.rooms_placed < number_of_rooms and failed_room_attempts < max_room_attempts:
             ##### Make the rest of the rooms #####
 
             # get random hall direction
             hall_direction = self.get_random_direction()
             # get next hall starting position
             hall_start_position = self._get_hall_start_position(terrain_map_grid, hall_direction)
-            print 'hall start position'
-            print hall_start_position
-            if hall_start_position != False:
-
-                # get hall distance
-                hall_distance = random.randrange(min_hall_length, max_hall_length)
-                print 'hall distance'
-                print hall_distance
-                # get hall end position
-                hall_end_position = self._get_hall_end_position(hall_start_position, hall_direction, hall_distance)
-                print 'hall end position'
-                print hall_end_position
-
-                # get room stats
-                room_width = random.randrange(min_room_width, max_room_width)
-                room_height = random.randrange(min_room_height, max_room_height)
-
-                # check if area is clear
-                if self._area_is_empty_of_terrain(terrain_map_grid, hall_start_position, hall_direction, hall_distance, room_width, room_height, room_size_multiplier):
-
-                    print 'current room number'
-                    print self.current_room_number
-
-                    print 'hall end position to append room'
-                    print hall_end_position
-
-                    # create and append a room
-                    terrain_map_grid = self._append_room_to_terrain_map(terrain_map_grid, hall_end_position,
-                                                                        room_width, room_height, hall_direction)
-
-                    # create and append the hallway
-                    terrain_map_grid = self._append_hallway_to_terrain_map(terrain_map_grid, hall_start_position, hall_direction, hall_distance)
-                    print 'hall distance'
-                    print hall_distance
-
-                else:
-                    # close the wall
-                    print 'CLOSING TILE DUE TO BOUNDARIES'
-                    print hall_start_position
-                    terrain_grid_map = self._set_terrain_grid_position_value(terrain_map_grid, hall_start_position, 2)
-                    print 'hi'
-         
-                self.current_room_number += 1
+            if hall_start_position == False:
+                if not self._has_hall_start_positions(terrain_map_grid):
+                    # every wall is closed or built on
+                    break
+                continue
+
+            # get hall distance
+            hall_distance = self.randomGenerator.randrange(min_hall_length, max_hall_length)
+            # get hall end position
+            hall_end_position = self._get_hall_end_position(hall_start_position, hall_direction, hall_distance)
+
+            # get room stats
+            room_width = self.randomGenerator.randrange(min_room_width, max_room_width)
+            room_height = self.randomGenerator.randrange(min_room_height, max_room_height)
+
+            # check if area is clear
+            if self._area_is_empty_of_terrain(terrain_map_grid, hall_start_position, hall_direction, hall_distance, room_width, room_height, room_size_multiplier):
+
+                # create and append a room
+                terrain_map_grid = self._append_room_to_terrain_map(terrain_map_grid, hall_end_position,
+                                                                    room_width, room_height, hall_direction)
+
+                # create and append the hallway
+                terrain_map_grid = self._append_hallway_to_terrain_map(terrain_map_grid, hall_start_position, hall_direction, hall_distance)
+                self.rooms_placed += 1
+
+            else:
+                # close the wall
+                terrain_map_grid = self._set_grid_position_value(terrain_map_grid, hall_start_position, 2)
+                failed_room_attempts += 1
         
         return terrain_map_grid
 
+    def get_collision_array(self):
+        '''1 for the wall tiles and 0 for everything else, for a CollisionGrid'''
+        return numpy.in1d(self.terrain_map_grid, self.WALL_TILES).reshape(self.terrain_map_grid.shape).astype(numpy.uint8)
+
     def _area_is_empty_of_terrain(self, terrain_map_grid, hall_start_position, hall_direction,
                                  hall_distance, room_width, room_height,
                                  room_size_multiplier):
@@ -466,293 +621,69 @@ class TerrainGrid(MapGrid):
         returns true if the area is empty of terrain (if the space is filled with 0s
         room_size_multiplier: size of room * room_size_multiplier = size of area to check
         '''
-        position_to_check = hall_start_position
-        starting_grid_position = [0,0]
-        current_grid_position = [0,0]
-
         # get size to check for right and left rooms
-        if hall_direction == 'right':
-            width_to_check = (room_width * room_size_multiplier) + hall_distance
-            height_to_check = room_height * room_size_multiplier
+        if hall_direction in ['right', 'left']:
+            width_to_check = int(round(room_width * room_size_multiplier)) + hall_distance
+            height_to_check = int(round(room_height * room_size_multiplier))
+            top = hall_start_position[1] - (height_to_check / 2)
+            if hall_direction == 'right':
+                left = hall_start_position[0] + 1
+            else:
+                left = (hall_start_position[0] - width_to_check) - 1
 
+        # get size to check for up and down rooms
+        elif hall_direction in ['up', 'down']:
+            width_to_check = int(round(room_width * room_size_multiplier))
+            height_to_check = int(round(room_height * room_size_multiplier)) + hall_distance
+            left = hall_start_position[0] - (width_to_check / 2)
+            if hall_direction == 'up':
+                top = (hall_start_position[1] - 1) - height_to_check
+            else:
+                top = hall_start_position[1] + 1
 
-            # set the top left corner of our area to check
-            starting_grid_position[0] = hall_start_position[0] + 1
-            starting_grid_position[1] = hall_start_position[1] - (height_to_check / 2)
-            
-            # round and turn positions into integers
-            starting_grid_position[0] = int(round(starting_grid_position[0]))
-            starting_grid_position[1] = int(round(starting_grid_position[1]))
-
-            print 'AREA INTERSECTS TERRAIN'
-            print 'hall direction'
-            print hall_direction
-            print 'hall distance'
-            print hall_distance
-            print 'room width'
-            print room_width
-            print 'room height'
-            print room_height
-            print 'width to check'
-            print width_to_check
-            print 'height to check'
-            print height_to_check
-            print 'hall starting position'
-            print hall_start_position
-            print 'starting grid position'
-            print starting_grid_position
-            
-            # go through all the tiles in the space to check and see if they are open
-            for x in range(width_to_check):
-                for y in range(height_to_check):
-
-                    current_grid_position[0] = starting_grid_position[0] + x
-                    current_grid_position[1] = starting_grid_position[1] + y
-
-                    # check if the spot is open
-                    print current_grid_position
-                    if current_grid_position[0] < 0 or current_grid_position[1] < 0:
-                        print 'WERE AT THE EDGE OF THE MAP HERE'
-                        print current_grid_position
-                        # we are at the edge of the map
-                        return False
-
-                    else:
-                        # we are not at the top or left of the map, yet..
-                        
-                        try:
-                            if terrain_map_grid[current_grid_position[1]][current_grid_position[0]] == 0:
-                                pass
-                            else:
-                                print 'WERE RUNNING INTO WALLS HERE'
-                                print current_grid_position
-                                # the spot is closed
-                                return False
-                        except IndexError:
-                            print 'WERE AT THE EDGE OF THE MAP HERE'
-                            print current_grid_position
-                            # the spot is at the edge of the map
-                            return False
-
-        if hall_direction == 'left':
-            width_to_check = (room_width * room_size_multiplier) + hall_distance
-            height_to_check = room_height * room_size_multiplier
-
-            # set the top left corner of our area to check
-            starting_grid_position[0] = (hall_start_position[0] - width_to_check) - 1
-            starting_grid_position[1] = hall_start_position[1] - (height_to_check / 2)
-
-            # round and turn positions into integers
-            starting_grid_position[0] = int(round(starting_grid_position[0]))
-            starting_grid_position[1] = int(round(starting_grid_position[1]))
-
-            print 'AREA INTERSECTS TERRAIN'
-            print 'hall direction'
-            print hall_direction
-            print 'hall distance'
-            print hall_distance
-            print 'room width'
-            print room_width
-            print 'room height'
-            print room_height
-            print 'width to check'
-            print width_to_check
-            print 'height to check'
-            print height_to_check
-            print 'hall starting position'
-            print hall_start_position
-            print 'starting grid position'
-            print starting_grid_position
-
-            # go through all the tiles in the space to check and see if they are open
-            for x in range(width_to_check):
-                for y in range(height_to_check):
-
-                    current_grid_position[0] = starting_grid_position[0] + x
-                    current_grid_position[1] = starting_grid_position[1] + y
-
-                    # check if the spot is open
-                    print current_grid_position
-                    if current_grid_position[0] < 0 or current_grid_position[1] < 0:
-                        print 'WERE AT THE EDGE OF THE MAP HERE'
-                        print current_grid_position
-                        # we are at the edge of the map
-                        return False
-
-                    else:
-                        # we are not at the top or left of the map, yet..
-                        
-                        try:
-                            if terrain_map_grid[current_grid_position[1]][current_grid_position[0]] == 0:
-                                pass
-                            else:
-                                print 'WERE RUNNING INTO WALLS HERE'
-                                print current_grid_position
-                                # the spot is closed
-                                return False
-                        except IndexError:
-                            print 'WERE AT THE EDGE OF THE MAP HERE'
-                            print current_grid_position
-                            # the spot is at the edge of the map
-                            return False
+        right = left + width_to_check - 1
+        bottom = top + height_to_check - 1
 
-        # get size to check for up and down rooms
-        elif hall_direction == 'up':
-            width_to_check = room_width * room_size_multiplier
-            height_to_check = (room_height * room_size_multiplier) + hall_distance
-
-            # set the top left corner of our area to check
-            starting_grid_position[0] = hall_start_position[0] - (width_to_check / 2)
-            starting_grid_position[1] = (hall_start_position[1] - 1) - height_to_check
-
-            # round and turn positions into integers
-            starting_grid_position[0] = int(round(starting_grid_position[0]))
-            starting_grid_position[1] = int(round(starting_grid_position[1]))
-
-            print 'AREA INTERSECTS TERRAIN'
-            print 'hall direction'
-            print hall_direction
-            print 'hall distance'
-            print hall_distance
-            print 'room width'
-            print room_width
-            print 'room height'
-            print room_height
-            print 'width to check'
-            print width_to_check
-            print 'height to check'
-            print height_to_check
-            print 'hall starting position'
-            print hall_start_position
-            print 'starting grid position'
-            print starting_grid_position
-
-            # go through all the tiles in the space to check and see if they are open
-            for x in range(width_to_check):
-                for y in range(height_to_check):
-
-                    current_grid_position[0] = starting_grid_position[0] + x
-                    current_grid_position[1] = starting_grid_position[1] + y
-
-                    # check if the spot is open
-                    print current_grid_position
-                    if current_grid_position[0] < 0 or current_grid_position[1] < 0:
-                        print 'WERE AT THE EDGE OF THE MAP HERE'
-                        print current_grid_position
-                        # we are at the edge of the map
-                        return False
-
-                    else:
-                        # we are not at the top or left of the map, yet..
-                        
-                        try:
-                            if terrain_map_grid[current_grid_position[1]][current_grid_position[0]] == 0:
-                                pass
-                            else:
-                                print 'WERE RUNNING INTO WALLS HERE'
-                                print current_grid_position
-                                # the spot is closed
-                                return False
-                        except IndexError:
-                            print 'WERE AT THE EDGE OF THE MAP HERE'
-                            print current_grid_position
-                            # the spot is at the edge of the map
-                            return False
+        # the area runs off the edge of the map
+        if left < 0 or top < 0 or right >= self.map_width or bottom >= self.map_height:
+            return False
 
-        elif hall_direction == 'down':
-            width_to_check = room_width * room_size_multiplier
-            height_to_check = (room_height * room_size_multiplier) + hall_distance
-
-            # set the top left corner of our area to check
-            starting_grid_position[0] = hall_start_position[0] - (width_to_check / 2)
-            starting_grid_position[1] = hall_start_position[1] + 1
-
-            # round and turn positions into integers
-            starting_grid_position[0] = int(round(starting_grid_position[0]))
-            starting_grid_position[1] = int(round(starting_grid_position[1]))
-
-            print 'AREA INTERSECTS TERRAIN'
-            print 'hall direction'
-            print hall_direction
-            print 'hall distance'
-            print hall_distance
-            print 'room width'
-            print room_width
-            print 'room height'
-            print room_height
-            print 'width to check'
-            print width_to_check
-            print 'height to check'
-            print height_to_check
-            print 'hall starting position'
-            print hall_start_position
-            print 'starting grid position'
-            print starting_grid_position
-
-            # go through all the tiles in the space to check and see if they are open
-            for x in range(width_to_check):
-                for y in range(height_to_check):
-
-                    current_grid_position[0] = starting_grid_position[0] + x
-                    current_grid_position[1] = starting_grid_position[1] + y
-
-                    # check if the spot is open
-                    print current_grid_position
-                    if current_grid_position[0] < 0 or current_grid_position[1] < 0:
-                        print 'WERE AT THE EDGE OF THE MAP HERE'
-                        print current_grid_position
-                        # we are at the edge of the map
-                        return False
-
-                    else:
-                        # we are not at the top or left of the map, yet..
-                        
-                        try:
-                            if terrain_map_grid[current_grid_position[1]][current_grid_position[0]] == 0:
-                                pass
-                            else:
-                                print 'WERE RUNNING INTO WALLS HERE'
-                                print current_grid_position
-                                # the spot is closed
-                                return False
-                        except IndexError:
-                            print 'WERE AT THE EDGE OF THE MAP HERE'
-                            print current_grid_position
-                            # the spot is at the edge of the map
-                            return False
-                    
-        # if it has not returned False, then...
-        print 'THERE ARE NO WALLS WERE RUNNING INTO'
-        return True
+        # one slice of the array instead of a python loop over every tile
+        return not terrain_map_grid[left:right + 1, top:bottom + 1].any()
+
+    def _add_hall_start_candidates(self, grid_positions, wall):
+        candidates = self.hall_start_candidates[wall]
+        for grid_position in grid_positions:
+            heapq.heappush(candidates, grid_position)
 
     def _get_hall_start_position(self, terrain_map_grid, direction):
         '''
-        goes through the terrain grid and returns positions of walls that
-        use the given direction.
+        returns the first wall (by column, then row) that uses the given
+        direction. False if there are none left
         '''
-        directions = {'right': 3, 'up': 4, 'left': 5, 'down': 6}
-        # loop through the terrain map
-        for column_index, column in enumerate(terrain_map_grid):
-            for tile_index, tile_value in enumerate(column):
-                # check if the current tile is correct for the direction we want to move
-                if tile_value == directions[direction]:
-                    print 'hall wants to start on direction:'
-                    print direction
-                    start_position = [column_index, tile_index]
-                    print 'start position generated'
-                    print start_position
-                    return start_position
+        wall = self.HALL_START_WALLS[direction]
+        candidates = self.hall_start_candidates[wall]
+        while candidates:
+            column_index, tile_index = candidates[0]
+            if terrain_map_grid[column_index, tile_index] == wall:
+                return [column_index, tile_index]
+            # closed or built over since it went in
+            heapq.heappop(candidates)
 
         # we did not find any rooms with that direction available
         return False
+
+    def _has_hall_start_positions(self, terrain_map_grid):
+        for direction in self.HALL_START_WALLS:
+            if self._get_hall_start_position(terrain_map_grid, direction) != False:
+                return True
+        return False
                 
     def _get_hall_end_position(self, hall_start_position, hall_direction, hall_distance):
         '''
         uses the hall start position and the hall end position
         to get the ending hall position
         '''
-        print 'hall starting position in hall end position function'
-        print hall_start_position
         if hall_direction == 'right':
             # get the end position to the right
             hall_end_position = [hall_start_position[0] + hall_distance, hall_start_position[1]]
@@ -767,8 +698,6 @@ class TerrainGrid(MapGrid):
             hall_end_position = [hall_start_position[0], hall_start_position[1] + hall_distance]
             
         return hall_end_position
-        
-
 
     def _append_room_to_terrain_map(self, terrain_map_grid, hall_end_position, 
                                     room_width, room_height, direction):
@@ -776,15 +705,7 @@ class TerrainGrid(MapGrid):
         Adds the room specs to the terrain map grid.
         direction = which side the room is on in relation to the current_room_position
         '''
-        
         room_starting_position = [0,0]
-        current_grid_position = [0,0]
-
-        print 'in append room to terrain map'
-        print hall_end_position
-        print room_width
-        print room_height
-        print direction
 
         # set the top left starting positions
         if direction == 'center':
@@ -806,50 +727,30 @@ class TerrainGrid(MapGrid):
         elif direction == 'down':
             room_starting_position[0] = hall_end_position[0] - (room_width / 2)
             room_starting_position[1] = hall_end_position[1]
-        print 'room top left position'
-        print room_starting_position
 
-        for x in range(room_width):
-            for y in range(room_height):
-                
-                current_grid_position[0] = room_starting_position[0] + x
-                current_grid_position[1] = room_starting_position[1] + y
-                
-                # this tile is not a wall. if a tile is a wall, this will be 1. If its a corner, it will be 2.
-                number_of_walls_on_tile = 0
-
-                # this is a left side wall
-                if x == 0:
-                    terrain_map_grid[current_grid_position[0]][current_grid_position[1]] = 5
-                    number_of_walls_on_tile += 1 # this is a wall
-
-                # this is a up side wall
-                if y == 0:
-                    print 'ISSUES HERE'
-                    print current_grid_position
-                    terrain_map_grid[current_grid_position[0]][current_grid_position[1]] = 4
-                    number_of_walls_on_tile += 1 # this is a wall
-
-                # this is a right side wall
-                if x == room_width - 1:
-                    terrain_map_grid[current_grid_position[0]][current_grid_position[1]] = 3
-                    number_of_walls_on_tile += 1 # this is a wall
-
-                # this is a down wall
-                if y == room_height - 1:  
-                    terrain_map_grid[current_grid_position[0]][current_grid_position[1]] = 6
-                    number_of_walls_on_tile += 1 # this is a wall
-
-                # set the floors
-                if number_of_walls_on_tile < 1:
-                    terrain_map_grid[current_grid_position[0]][current_grid_position[1]] = 1
-
-                # block off the corners so we cannot build halls there
-                if  number_of_walls_on_tile >= 2:
-                    terrain_map_grid[current_grid_position[0]][current_grid_position[1]] = 2
+        left = room_starting_position[0]
+        top = room_starting_position[1]
+        right = left + room_width - 1
+        bottom = top + room_height - 1
+
+        # set the floors, then the walls around them
+        terrain_map_grid[left:right + 1, top:bottom + 1] = 1
+        terrain_map_grid[left, top:bottom + 1] = 5
+        terrain_map_grid[left:right + 1, top] = 4
+        terrain_map_grid[right, top:bottom + 1] = 3
+        terrain_map_grid[left:right + 1, bottom] = 6
+
+        # block off the corners so we cannot build halls there
+        for corner in [(left, top), (right, top), (left, bottom), (right, bottom)]:
+            terrain_map_grid[corner] = 2
+
+        # everything but the corners can have a hall built off it
+        self._add_hall_start_candidates([(left, y) for y in range(top + 1, bottom)], 5)
+        self._add_hall_start_candidates([(x, top) for x in range(left + 1, right)], 4)
+        self._add_hall_start_candidates([(right, y) for y in range(top + 1, bottom)], 3)
+        self._add_hall_start_candidates([(x, bottom) for x in range(left + 1, right)], 6)
 
         return terrain_map_grid
-    
 
     def _append_hallway_to_terrain_map(self, terrain_map_grid, hall_start_position,
                                        hall_direction, hall_distance):
@@ -857,207 +758,259 @@ class TerrainGrid(MapGrid):
         Adds the room specs to the terrain map grid.
         direction = which side the hallway is on in relation to the hall_start_position
         '''
-        
-        starting_grid_position = [0,0]
-        current_grid_position = [0,0]
-        starting_grid_position[0] = hall_start_position[0]
-        starting_grid_position[1] = hall_start_position[1]
-        hall_width = 1
-        print 'hall start position'
-        print starting_grid_position
-        print 'hall direction'
-        print hall_direction
+        x = hall_start_position[0]
+        y = hall_start_position[1]
 
         # add one to compensate for lists starting at 0
         hall_distance += 1
 
         # right hallways
         if hall_direction == 'right':
-            width_to_fill = hall_distance
-            height_to_fill = hall_width
-
-            for x in range(hall_distance):
-                for y in range(hall_width):
-
-                    current_grid_position[0] = starting_grid_position[0] + x
-                    current_grid_position[1] = starting_grid_position[1] + y
-
-                    terrain_map_grid[current_grid_position[0]][current_grid_position[1]] = 7
+            terrain_map_grid[x:x + hall_distance, y] = 7
 
         # up hallways
         elif hall_direction == 'up':
-            width_to_fill = 1
-            height_to_fill = hall_distance
-
-            for x in range(hall_width):
-                for y in range(hall_distance):
-
-                    current_grid_position[0] = starting_grid_position[0] - x
-                    current_grid_position[1] = starting_grid_position[1] - y
-
-                    terrain_map_grid[current_grid_position[0]][current_grid_position[1]] = 7
+            terrain_map_grid[x, y - hall_distance + 1:y + 1] = 7
 
         # left hallways
         elif hall_direction == 'left':
-            width_to_fill = hall_distance
-            height_to_fill = 1
+            terrain_map_grid[x - hall_distance + 1:x + 1, y] = 7
 
-            for x in range(hall_distance):
-                for y in range(hall_width):
+        # down hallways
+        elif hall_direction == 'down':
+            terrain_map_grid[x, y:y + hall_distance] = 7
 
-                    current_grid_position[0] = starting_grid_position[0] - x
-                    current_grid_position[1] = starting_grid_position[1] - y
+        else:
+            raise RuntimeError('Invalid hallway direction: ' + str(hall_direction))
 
-                    terrain_map_grid[current_grid_position[0]][current_grid_position[1]] = 7
+        return terrain_map_grid
 
-        # down hallways
-        elif hall_direction == 'down':
-            width_to_fill = 1
-            height_to_fill = hall_distance
 
-            for x in range(hall_width):
-                for y in range(hall_distance):
+class OutsideTerrainGrid(MapGrid):
+    '''
+    caves made with a cellular automaton, 1 is filled and 0 is empty.
+
+    the tiles are kept in uint8 numpy arrays indexed [x, y]. Every
+    generation works on whole arrays, so a stack of candidate maps shaped
+    (number of maps, width, height) steps as fast as one big map.
+
+    a tile is filled in the next generation when the 3x3 block around it
+    (itself included) has more filled tiles than a threshold picked at
+    random from birth_thresholds (empty tiles) or survival_thresholds
+    (filled tiles), or when more than close_neighbor_threshold of the
+    tile and its four side neighbours are filled.
+    edge_policy says what the tiles off the map count as: 'empty',
+    'filled', or 'wrap' to the other side of the map
+    '''
+    EDGE_POLICIES = ['empty', 'filled', 'wrap']
 
-                    current_grid_position[0] = starting_grid_position[0] + x
-                    current_grid_position[1] = starting_grid_position[1] + y
+    def __init__(self, map_dimensions, number_of_generations=1, seed=None,
+                 birth_thresholds=(3, 4, 5), survival_thresholds=(3, 4, 5),
+                 close_neighbor_threshold=3, edge_policy='empty'):
+        if edge_policy not in self.EDGE_POLICIES:
+            raise RuntimeError('Invalid edge policy: ' + str(edge_policy))
 
-                    terrain_map_grid[current_grid_position[0]][current_grid_position[1]] = 7
+        self.map_dimensions = map_dimensions
+        self.map_width = map_dimensions[0]
+        self.map_height = map_dimensions[1]
 
-        else:
-            print 'Invalid hallway direction in _append_hallway_to_terrain_map...'
-            
-        return terrain_map_grid
+        self.birth_thresholds = numpy.array(birth_thresholds, numpy.uint8)
+        self.survival_thresholds = numpy.array(survival_thresholds, numpy.uint8)
+        self.close_neighbor_threshold = close_neighbor_threshold
+        self.edge_policy = edge_policy
 
-class OutsideTerrainGrid(MapGrid):
-    def __init__(self, map_dimensions):
+        # the same seed makes the same caves
+        self.randomState = numpy.random.RandomState(seed)
 
         # generate outside rooms
-        self.empty_outside_terrain_grid = self._generate_empty_noise_grid(self.map_width, self.map_height)
+        self.empty_outside_terrain_grid = self._generate_noise_grids()
         self.outside_terrain_grid = self._generate_outside_terrain(self.empty_outside_terrain_grid, number_of_generations)
 
-    def _generate_outside_terrain(self, empty_outside_terrain_grid, number_of_generations):
+    def _generate_noise_grids(self, number_of_maps=None):
+        '''random 1s and 0s, one map or a stack of number_of_maps maps'''
+        shape = (self.map_width, self.map_height)
+        if number_of_maps is not None:
+            shape = (number_of_maps,) + shape
+        return self.randomState.randint(0, 2, shape).astype(numpy.uint8)
+
+    def generate_candidate_maps(self, number_of_maps, number_of_generations):
+        '''a stack of number_of_maps different caves, shaped (number_of_maps, width, height)'''
+        return self._generate_outside_terrain(self._generate_noise_grids(number_of_maps), number_of_generations)
+
+    def _pad_grid(self, grid):
+        '''adds a one tile border around the last two axes, filled in by the edge policy'''
+        pad_width = [(0, 0)] * (grid.ndim - 2) + [(1, 1), (1, 1)]
+        if self.edge_policy == 'wrap':
+            return numpy.pad(grid, pad_width, 'wrap')
+        if self.edge_policy == 'filled':
+            return numpy.pad(grid, pad_width, 'constant', constant_values=1)
+        return numpy.pad(grid, pad_width, 'constant', constant_values=0)
+
+    def _count_neighbors(self, grid):
         '''
-        creates a bubble effect with cellular automaton
+        returns (close neighbors, far neighbors): the tile and its four side
+        neighbours, and its four corner neighbours, added up for every tile
         '''
-        grid = empty_outside_terrain_grid
-        number_of_generations = number_of_generations
-
-        for x in range(number_of_generations):
-            next_grid = []
-            for column_index, column in enumerate(grid):
-                next_column = []
-                next_grid.append(next_column)
-                for tile_index, tile in enumerate(column):
-                    
-                    top_left = grid[column_index - 1][tile_index - 1]
-                    top_mid = grid[column_index][tile_index - 1]
-                    try:
-                        top_right = grid[column_index + 1][tile_index - 1]
-                    except IndexError:
-                        top_right = 0
-                    
-                    center_left = grid[column_index - 1][tile_index]
-                    center_mid = grid[column_index][tile_index]
-                    try:
-                        center_right = grid[column_index + 1][tile_index]
-                    except IndexError:
-                        center_right = 0
-
-                    try:
-                        bottom_left = grid[column_index - 1][tile_index + 1]
-                    except IndexError:
-                        bottom_left = 0
-                    try:
-                        bottom_mid = grid[column_index][tile_index + 1]
-                    except IndexError:
-                        bottom_mid = 0
-                    try:
-                        bottom_right = grid[column_index + 1][tile_index + 1]
-                    except IndexError:
-                        bottom_right = 0
-
-                    close_neighbors = (top_mid + center_left + center_mid +
-                                       center_right + bottom_mid)
-
-                    far_neighbors = (top_left + top_right +
-                                     bottom_left + bottom_right)
-
-                    number_of_neighbors = close_neighbors + far_neighbors
-
-                    if number_of_neighbors > random.choice([3,4,5]):
-                        next_cell = 1
-
-                    else:
-                        next_cell = 0
-
-                    if close_neighbors > 3:
-                        next_cell = 1
-
-                    next_column.append(next_cell)
-            grid = next_grid         
-                    
-                    
-        return next_grid
+        padded = self._pad_grid(grid)
+        width = grid.shape[-2]
+        height = grid.shape[-1]
 
-    
-class GravityGrid(MapGrid):
-    def __init__(self, map_dimensions):
+        def shifted(x_offset, y_offset):
+            return padded[..., 1 + x_offset:1 + x_offset + width, 1 + y_offset:1 + y_offset + height]
 
-        # create a grid which holds the gravitational tile information
-        self.gravity_map_grid = self._generate_empty_gravity_map_grid(self.map_width, self.map_height)
+        close_neighbors = grid + shifted(0, -1) + shifted(-1, 0) + shifted(1, 0) + shifted(0, 1)
+        far_neighbors = shifted(-1, -1) + shifted(1, -1) + shifted(-1, 1) + shifted(1, 1)
+        return close_neighbors, far_neighbors
 
-        #gravity_map_grid, gravity_position, radius, force_denometer
-        self.gravity_map_grid = self._add_gravity_point(self.gravity_map_grid, [4,4], 5, 1)
-        #print self.gravity_map_grid
+    def _pick_thresholds(self, grid):
+        '''a random threshold for every tile, from the birth or survival thresholds'''
+        birth_thresholds = self.randomState.choice(self.birth_thresholds, grid.shape)
+        if numpy.array_equal(self.birth_thresholds, self.survival_thresholds):
+            return birth_thresholds
+        survival_thresholds = self.randomState.choice(self.survival_thresholds, grid.shape)
+        return numpy.where(grid != 0, survival_thresholds, birth_thresholds)
 
-    def _generate_empty_gravity_map_grid(self, map_width, map_height):
+    def _generate_outside_terrain(self, empty_outside_terrain_grid, number_of_generations):
         '''
-        creates a new 2d array with the given specs
+        creates a bubble effect with cellular automaton.
+        takes one map or a stack of maps and returns new arrays
         '''
+        grid = numpy.asarray(empty_outside_terrain_grid, numpy.uint8)
 
-        new_map_grid = [] # create our new list
-        for x in range(map_width):
-            new_map_grid.append([]) # add our columns to the array
-            for y in range(map_height):
-                # fill the grid with empty:
-                #[[velocity], force]
-                new_map_grid[x].append([[0.0,0.0], 0]) # fill in our rows
-                
-
-        return new_map_grid
-
-    def _add_gravity_point(self, gravity_map_grid, gravity_position, radius, force_denometer):
-        gravity_position_vector = Vector(gravity_position[0], gravity_position[1])
-        diameter_to_check = radius * 2
-        # set the top left position to check
-        starting_position = [gravity_position[0] - radius, gravity_position[1] - radius]
-        current_position = [0,0]
-        for current_column in range(diameter_to_check):
-            for current_tile in range(diameter_to_check):
-                current_position = [starting_position[0] + current_tile,
-                                    starting_position[1] + current_column]
-                current_position_vector = Vector(current_position[0], current_position[1])
-                # get the distance to the gravity position
-                distance_to_gravity_position= gravity_position_vector - current_position_vector
-                # normalize the vector
-                normalized_distance = distance_to_gravity_position.normalize()
-                if normalized_distance == None:
-                    normalized_distance = [0.0,0.0]
-
-                length_to_gravity_position = distance_to_gravity_position.length()
-                force_of_gravity = length_to_gravity_position / force_denometer
+        for generation in range(number_of_generations):
+            close_neighbors, far_neighbors = self._count_neighbors(grid)
+            number_of_neighbors = close_neighbors + far_neighbors
 
-                # for testing purposes when using a text output
+            next_grid = number_of_neighbors > self._pick_thresholds(grid)
+            if self.close_neighbor_threshold is not None:
+                next_grid |= close_neighbors > self.close_neighbor_threshold
 
-                rounded_x_distance = int(round(normalized_distance[0] * 10)) / 10
-                rounded_y_distance = int(round(normalized_distance[1] * 10)) / 10
-                normalized_distance = [rounded_x_distance, rounded_y_distance]
+            grid = next_grid.astype(numpy.uint8)
 
-                force_of_gravity = int(round(force_of_gravity * 10)) / 10
+        return grid
 
-                gravity_map_grid[current_position[0]][current_position[1]] = [normalized_distance, force_of_gravity]
+    
+class GravityGrid(MapGrid):
+    '''
+    a force field over the map. Every gravity point pulls the tiles in a
+    square around it towards itself, harder the further away they are
+    (distance / force_denometer), and the pulls of all the points add up.
+
+    the field is kept as one float64 array indexed [x, y, (x, y)].
+    Adding a point adds its stamp to a slice of the array and removing it
+    takes the same stamp back off, so points can move every tick.
+    Stamps are cached by (radius, force_denometer)
+    '''
+    def __init__(self, map_dimensions, tile_size=32):
+        self.map_dimensions = map_dimensions
+        self.map_width = map_dimensions[0]
+        self.map_height = map_dimensions[1]
+        self.tile_size = tile_size
 
-        return gravity_map_grid
+        # create a grid which holds the gravitational tile information
+        self.gravity_field = numpy.zeros((self.map_width, self.map_height, 2))
+
+        self.gravity_points = {} # point id: (grid position, radius, force denometer)
+        self.gravity_stamps = {} # (radius, force denometer): stamp
+        self.next_gravity_point_id = 0
+
+        #gravity_position, radius, force_denometer
+        self.add_gravity_point([4,4], 5, 1)
+
+    def _get_gravity_stamp(self, radius, force_denometer):
+        '''the pull of one point on the (2 * radius + 1) square of tiles around it'''
+        key = (radius, force_denometer)
+        if key not in self.gravity_stamps:
+            offsets = numpy.arange(-radius, radius + 1, dtype=numpy.float64)
+            offset_x, offset_y = numpy.meshgrid(offsets, offsets, indexing='ij')
+            # normalized distance * (length / force_denometer) is just the
+            # distance from the tile to the point over force_denometer
+            stamp = numpy.empty((offsets.size, offsets.size, 2))
+            stamp[..., 0] = -offset_x / float(force_denometer)
+            stamp[..., 1] = -offset_y / float(force_denometer)
+            self.gravity_stamps[key] = stamp
+        return self.gravity_stamps[key]
+
+    def _apply_gravity_stamp(self, grid_position, radius, force_denometer, sign):
+        '''adds (sign 1) or takes off (sign -1) a point's stamp, cut down to the map'''
+        stamp = self._get_gravity_stamp(radius, force_denometer)
+        left = grid_position[0] - radius
+        top = grid_position[1] - radius
+        map_left = max(left, 0)
+        map_top = max(top, 0)
+        map_right = min(left + stamp.shape[0], self.map_width)
+        map_bottom = min(top + stamp.shape[1], self.map_height)
+        if map_right <= map_left or map_bottom <= map_top:
+            # off the map
+            return
+
+        stamp = stamp[map_left - left:map_right - left, map_top - top:map_bottom - top]
+        if sign > 0:
+            self.gravity_field[map_left:map_right, map_top:map_bottom] += stamp
+        else:
+            self.gravity_field[map_left:map_right, map_top:map_bottom] -= stamp
+
+    def add_gravity_point(self, gravity_position, radius, force_denometer):
+        '''starts pulling towards a grid position, returns the id to move or remove the point with'''
+        point_id = self.next_gravity_point_id
+        self.next_gravity_point_id += 1
+        gravity_position = [int(gravity_position[0]), int(gravity_position[1])]
+        self.gravity_points[point_id] = (gravity_position, radius, force_denometer)
+        self._apply_gravity_stamp(gravity_position, radius, force_denometer, 1)
+        return point_id
+
+    def remove_gravity_point(self, point_id):
+        gravity_position, radius, force_denometer = self.gravity_points.pop(point_id)
+        self._apply_gravity_stamp(gravity_position, radius, force_denometer, -1)
+
+    def move_gravity_point(self, point_id, gravity_position):
+        old_gravity_position, radius, force_denometer = self.gravity_points[point_id]
+        gravity_position = [int(gravity_position[0]), int(gravity_position[1])]
+        if gravity_position == old_gravity_position:
+            return
+        self._apply_gravity_stamp(old_gravity_position, radius, force_denometer, -1)
+        self.gravity_points[point_id] = (gravity_position, radius, force_denometer)
+        self._apply_gravity_stamp(gravity_position, radius, force_denometer, 1)
+
+    def get_gravity_many(self, positions):
+        '''
+        the pull at an array of pixel positions, shaped (number of positions, 2).
+        blends the four tiles around each position, taking each tile's
+        pull to be at its center. Positions off the map get the nearest edge
+        '''
+        positions = numpy.asarray(positions, numpy.float64)
+        # in tiles, from the center of the top left tile
+        x = numpy.clip(positions[:, 0] / self.tile_size - 0.5, 0, self.map_width - 1)
+        y = numpy.clip(positions[:, 1] / self.tile_size - 0.5, 0, self.map_height - 1)
+
+        left = numpy.minimum(x.astype(numpy.intp), max(self.map_width - 2, 0))
+        top = numpy.minimum(y.astype(numpy.intp), max(self.map_height - 2, 0))
+        right = numpy.minimum(left + 1, self.map_width - 1)
+        bottom = numpy.minimum(top + 1, self.map_height - 1)
+        x_fraction = (x - left)[:, numpy.newaxis]
+        y_fraction = (y - top)[:, numpy.newaxis]
+
+        field = self.gravity_field
+        top_pull = field[left, top] * (1 - x_fraction) + field[right, top] * x_fraction
+        bottom_pull = field[left, bottom] * (1 - x_fraction) + field[right, bottom] * x_fraction
+        return top_pull * (1 - y_fraction) + bottom_pull * y_fraction
+
+    def get_gravity(self, position):
+        '''the pull at one pixel position as [x, y]'''
+        return list(self.get_gravity_many([position])[0])
+
+    def get_gravity_array(self):
+        '''
+        the field as [x, y, (direction x, direction y, force)] in float32,
+        the layout map artifacts save it in
+        '''
+        force = numpy.sqrt((self.gravity_field ** 2).sum(axis=2))
+        gravity_array = numpy.zeros((self.map_width, self.map_height, 3), numpy.float32)
+        pulled = force > 0
+        gravity_array[pulled, 0] = self.gravity_field[pulled, 0] / force[pulled]
+        gravity_array[pulled, 1] = self.gravity_field[pulled, 1] / force[pulled]
+        gravity_array[..., 2] = force
+        return gravity_array
 
 ##
 ##class AIGridCell():
@@ -1657,12 +1610,7 @@ if __name__ == '__main__':
     number_of_generations = 1
     tile_size = 4
     
-    map_grid = MapGrid(map_width, map_height, number_of_rooms,
-                       starting_room_direction,
-                       max_room_width, max_room_height,
-                       min_room_width, min_room_height,
-                       max_hall_length, min_hall_length,
-                       room_size_multiplier, number_of_generations)
+    map_grid = OutsideTerrainGrid([map_width, map_height], number_of_generations)
 
     #print map_grid.outside_terrain_grid
 
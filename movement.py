@@ -0,0 +1,217 @@
+##### CHARACTER MOVEMENT #####
+# the server moves characters with this, and the client runs the same
+# steps on its own character so it doesn't have to wait for the server
+from collections import deque
+
+import mapgrid
+
+# pixels a character moves every step
+CHARACTER_MOVEMENT_SPEED = 3
+# the server's step, a character moves at most once in it
+STEP_TIME = 1.0 / 60.0
+# how many input frames a client can get ahead of the server before it catches up
+MAX_BUFFERED_INPUT_FRAMES = 3
+
+def push_position_to_nearest_open_tile(left_position, right_position,
+                                       top_position, bottom_position,
+                                       colliding_grid_position, tile_size):
+    '''the top left position that moves the character out of the closed tile it overlaps the least'''
+    rect_left = left_position
+    rect_right = right_position
+    rect_top = top_position
+    rect_bottom = bottom_position
+    rect_top_left = [rect_left, rect_top] 
+
+    tile_left = (colliding_grid_position[0] * tile_size) + 1
+    tile_right = tile_left + (tile_size - 1)
+    tile_top = (colliding_grid_position[1] * tile_size) + 1
+    tile_bottom = tile_top + (tile_size - 1)
+
+    top_displacement = (tile_top - rect_bottom) - 2
+    bottom_displacement = tile_bottom - rect_top
+    left_displacement = (tile_left - rect_right) - 2
+    right_displacement = tile_right - rect_left
+
+    squared_top_displacement = {'name': 'squared_top_displacement',
+                                'value': top_displacement ** 2}
+    squared_bottom_displacement = {'name': 'squared_bottom_displacement',
+                                   'value': bottom_displacement ** 2}
+    squared_left_displacement = {'name': 'squared_left_displacement',
+                                 'value': left_displacement ** 2}
+    squared_right_displacement = {'name': 'squared_right_displacement',
+                                  'value': right_displacement ** 2}
+    #print squared_top_displacement, squared_bottom_displacement, squared_left_displacement, squared_right_displacement
+
+    displacements = []
+    displacements.extend([squared_left_displacement,
+                          squared_right_displacement,
+                          squared_top_displacement,
+                          squared_bottom_displacement])
+
+    # Sorting all the displacements to find the smallest one
+    sorted_displacements = []
+    # for all our unsorted displacements
+    for d in displacements:
+        # go through all the sorted displacements
+
+        if len(sorted_displacements) == 0:
+            sorted_displacements.append(d)
+        else:
+            for list_index in range(0, (len(sorted_displacements) + 1)):
+
+                try:
+                    # if the unsorted one is greater than the current sorted one
+                    if d['value'] > sorted_displacements[list_index]['value']:
+                        if len(sorted_displacements) < (list_index - 1):
+                            sorted_displacements.append(d)
+                            break
+                        else:
+                            pass
+                    else:
+                        # if its less
+                        sorted_displacements.insert(list_index, d)
+                        break
+
+                except IndexError:
+                    sorted_displacements.append(d)
+
+    smallest_displacement = sorted_displacements[0]
+
+    if smallest_displacement['name'] == 'squared_top_displacement':
+        rect_top_left[1] += top_displacement
+    elif smallest_displacement['name'] == 'squared_bottom_displacement':
+        rect_top_left[1] += bottom_displacement
+    elif smallest_displacement['name'] == 'squared_left_displacement':
+        rect_top_left[0] += left_displacement
+    elif smallest_displacement['name'] == 'squared_right_displacement':
+        rect_top_left[0] += right_displacement
+
+    return rect_top_left
+
+def move_character(position, keyboard_input, movement_speed, tile_size, collisionGrid):
+    '''where a character with its top left at position ends up after one step in that direction'''
+    position = [position[0], position[1]]
+
+    # move in given direction
+    if keyboard_input == 'UP':
+        position[1] -= movement_speed
+    elif keyboard_input == 'DOWN':
+        position[1] += movement_speed
+    elif keyboard_input == 'LEFT':
+        position[0] -= movement_speed
+    elif keyboard_input == 'RIGHT':
+        position[0] += movement_speed
+
+    # diagonal movement
+    elif keyboard_input == 'LEFTUP':
+        position[0] -= (movement_speed * .707)
+        position[1] -= (movement_speed * .707)
+    elif keyboard_input == 'RIGHTUP':
+        position[0] += (movement_speed * .707)
+        position[1] -= (movement_speed * .707)
+    elif keyboard_input == 'LEFTDOWN':
+        position[0] -= (movement_speed * .707)
+        position[1] += (movement_speed * .707)
+    elif keyboard_input == 'RIGHTDOWN':
+        position[0] += (movement_speed * .707)
+        position[1] += (movement_speed * .707)
+    # pixel position
+    position = [position[0], position[1]]
+
+    ##### COLLISIONS WITH WALLS #####
+    # HOW IT WILL WORK
+    # check if four corners are colliding
+    # for all grid positions that the colliding corners are in
+    # find the closest wall to push the cube out to
+    ##### get positions of walls,
+    ##### see which wall has the smallest distance to travel
+    # push the character out to that wall
+
+    # pixel positions
+    left_position = position[0]
+    right_position = position[0] + (tile_size - 1)
+    top_position = position[1]
+    bottom_position = position[1] + (tile_size - 1)
+
+    top_left_position = [left_position, top_position]
+    top_right_position = [right_position, top_position]
+    bottom_left_position = [left_position, bottom_position]
+    bottom_right_position = [right_position, bottom_position]
+    # grid positions
+
+    top_left_grid_position = mapgrid.convert_position_to_grid_position(top_left_position, tile_size)
+    top_right_grid_position = mapgrid.convert_position_to_grid_position(top_right_position, tile_size)
+    bottom_left_grid_position = mapgrid.convert_position_to_grid_position(bottom_left_position, tile_size)
+    bottom_right_grid_position = mapgrid.convert_position_to_grid_position(bottom_right_position, tile_size)
+
+    # test all four corners in one call
+    corner_grid_positions = [top_left_grid_position, top_right_grid_position,
+                             bottom_left_grid_position, bottom_right_grid_position]
+    corners_open = collisionGrid.are_tiles_open(corner_grid_positions)
+
+    for corner_grid_position, corner_open in zip(corner_grid_positions, corners_open):
+        if not corner_open:
+            position = push_position_to_nearest_open_tile(left_position,
+                                                          right_position,
+                                                          top_position,
+                                                          bottom_position,
+                                                          corner_grid_position,
+                                                          tile_size)
+
+    return position
+
+
+class CharacterPredictor():
+    '''
+    moves the client's own character as soon as an input frame is sent.
+    The frames the server hasn't applied yet are kept, when the server
+    tells us where the character is after the last frame it applied we
+    start from there and do the frames after it again.
+
+    Like the server we move at most one step every STEP_TIME, give us the
+    time that passed with add_time. A frame sent faster than that keeps
+    no direction, the server won't move for it either
+    '''
+    def __init__(self, tile_size, collisionGrid, movement_speed=CHARACTER_MOVEMENT_SPEED,
+                 step_time=STEP_TIME, max_buffered_steps=MAX_BUFFERED_INPUT_FRAMES):
+        self.tile_size = tile_size
+        self.collisionGrid = collisionGrid # mirrors the server's, from the walls we know about
+        self.movement_speed = movement_speed
+        self.step_time = step_time
+        # the server buffers a few frames, so a short burst still moves every frame
+        self.max_movement_time = max_buffered_steps * step_time
+        self.movement_time = 0.0 # time we can still move in
+
+        self.pending_input_frames = deque() # (sequence, direction) the server hasn't applied
+        self.predicted_position = None
+
+    def _move(self, position, direction):
+        return move_character(position, direction, self.movement_speed, self.tile_size, self.collisionGrid)
+
+    def add_time(self, delta_time):
+        self.movement_time = min(self.movement_time + delta_time, self.max_movement_time)
+
+    def add_input_frame(self, sequence, direction):
+        if direction:
+            # half a step of slack so a tick that came a little early still moves
+            if self.movement_time >= self.step_time / 2:
+                self.movement_time -= self.step_time
+            else:
+                direction = ''
+        self.pending_input_frames.append((sequence, direction))
+        if self.predicted_position is not None and direction:
+            self.predicted_position = self._move(self.predicted_position, direction)
+
+    def set_server_state(self, server_position, input_sequence):
+        '''where the server has our character after applying input frames up to input_sequence'''
+        while self.pending_input_frames and self.pending_input_frames[0][0] <= input_sequence:
+            self.pending_input_frames.popleft()
+
+        position = [server_position[0], server_position[1]]
+        for sequence, direction in self.pending_input_frames:
+            if direction:
+                position = self._move(position, direction)
+        self.predicted_position = position
+
+    def get_position(self):
+        return self.predicted_position
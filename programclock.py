@@ -16,7 +16,7 @@ class ProgramClock():
     '''
     def __init__(self, eventManager):
         self.eventManager = eventManager
-        self.eventManager.add_listener(self)
+        self.eventManager.add_listener(self, ['Stop Network Connection Event'])
             
         self.clock = pygame.time.Clock()
         self.initial_time = time.time()
@@ -2,7 +2,123 @@ from twisted.internet.protocol import Factory
 from twisted.protocols import amp
 
 import events
+import statecodec
 
+# game states are sent in chunks that each fit inside one AMP value
+GAME_STATE_CHUNK_SIZE = amp.MAX_VALUE_LENGTH
+
+def split_game_state(encoded_game_state):
+    '''cuts an encoded game state into chunks the client puts back together'''
+    chunks = []
+    for chunk_start in range(0, len(encoded_game_state), GAME_STATE_CHUNK_SIZE):
+        chunks.append(encoded_game_state[chunk_start:chunk_start + GAME_STATE_CHUNK_SIZE])
+    return chunks
+
+class EncodedGameState():
+    '''
+    A game state that only gets encoded, split into chunks and
+    serialized into AMP boxes the first time a client needs it.
+    Every client that needs the same state gets the same bytes.
+
+    encoded_records is shared by all the game states made from one
+    event so an object seen by many clients is only encoded once.
+    A changed game state with a baseline has everything that changed
+    since that sequence. Give it the client's statecodec.DeltaReferences
+    to code it relative to what the client already has, it is then only
+    for that client. delta_records is shared the same way, clients coded
+    against the same reference share the record
+    '''
+    def __init__(self, object_states, sequence, quantized, encoded_records, baseline=None,
+                 deltaReferences=None, server_time=None, client_input=None, delta_records=None):
+        self.object_states = object_states
+        self.sequence = sequence
+        self.server_time = server_time
+        self.client_input = client_input # (character id, last input frame sequence applied)
+        self.baseline = baseline
+        self.deltaReferences = deltaReferences
+        self.quantized = quantized
+        self.encoded_records = encoded_records # {object id: encoded object state}
+        self.delta_records = delta_records # {(object id, reference sequence): delta coded record}
+
+        self.encoded_game_state = None
+        self.chunks = None
+        self.chunk_boxes = None
+        self.push_boxes = None
+
+    def _encode_object_state(self, object_state):
+        object_id = object_state['object_id']
+        encoded_record = self.encoded_records.get(object_id)
+        if encoded_record is None or object_state['object_state'] == 'despawned':
+            encoded_record = statecodec.encode_object_state(object_state, self.quantized)
+            if object_state['object_state'] != 'despawned':
+                self.encoded_records[object_id] = encoded_record
+        return encoded_record
+
+    def copy_with_sequence(self, sequence):
+        '''the same objects under a newer sequence, only the boxes are made again'''
+        encodedGameState = EncodedGameState(self.object_states, sequence, self.quantized,
+                                            self.encoded_records, self.baseline, self.deltaReferences,
+                                            self.server_time, self.client_input, self.delta_records)
+        encodedGameState.encoded_game_state = self.encoded_game_state
+        encodedGameState.chunks = self.chunks
+        return encodedGameState
+
+    def get_encoded_game_state(self):
+        if self.encoded_game_state is None and self.deltaReferences:
+            self.encoded_game_state = statecodec.encode_delta_object_states(self.object_states, self.sequence,
+                                                                            self.baseline, self.deltaReferences,
+                                                                            self.delta_records)
+        elif self.encoded_game_state is None:
+            records = [self._encode_object_state(object_state) for object_state in self.object_states]
+            self.encoded_game_state = statecodec.join_object_state_records(records, self.quantized)
+        return self.encoded_game_state
+
+    def get_chunks(self):
+        if self.chunks is None:
+            self.chunks = split_game_state(self.get_encoded_game_state())
+        return self.chunks
+
+    def get_chunk_box(self, chunk_index):
+        '''one piece of a complete game state'''
+        if self.chunk_boxes is None:
+            self.chunk_boxes = [None] * len(self.get_chunks())
+        
+        serialized_box = self.chunk_boxes[chunk_index]
+        if serialized_box is None:
+            box = amp.AmpBox()
+            box[amp.COMMAND] = RemoteCompleteGameStateChunkEvent.commandName
+            box['sequence'] = str(self.sequence)
+            box['chunk_index'] = str(chunk_index)
+            box['chunk_count'] = str(len(self.chunks))
+            box['chunk'] = self.chunks[chunk_index]
+            if self.server_time is not None:
+                box['server_time'] = repr(self.server_time)
+            serialized_box = box.serialize()
+            self.chunk_boxes[chunk_index] = serialized_box
+        return serialized_box
+
+    def get_push_boxes(self):
+        '''a changed game state, almost always one box, bigger changes are split into chunks'''
+        if self.push_boxes is None:
+            chunks = self.get_chunks()
+            self.push_boxes = []
+            for chunk_index, chunk in enumerate(chunks):
+                box = amp.AmpBox()
+                box[amp.COMMAND] = RemotePushChangedGameStateEvent.commandName
+                box['sequence'] = str(self.sequence)
+                box['changed_game_state'] = chunk
+                if self.baseline is not None:
+                    box['baseline'] = str(self.baseline)
+                if self.server_time is not None:
+                    box['server_time'] = repr(self.server_time)
+                if self.client_input is not None:
+                    box['character_id'] = str(self.client_input[0])
+                    box['input_sequence'] = str(self.client_input[1])
+                if len(chunks) > 1:
+                    box['chunk_index'] = str(chunk_index)
+                    box['chunk_count'] = str(len(chunks))
+                self.push_boxes.append(box.serialize())
+        return self.push_boxes
 
 class ServerFactory(Factory):
     # this has been overridden so we can send the event manager to
@@ -10,6 +126,23 @@ class ServerFactory(Factory):
     def __init__(self, eventManager):
         self.protocol_instance = None
         self.eventManager = eventManager
+        self.eventManager.add_listener(self, ['Complete Game State Event',
+                                              'Changed Game State Event'])
+        self.connected_protocols = []
+
+        # game states are only encoded when a client needs them, and only one time
+        self.complete_game_state = None
+        self.client_complete_game_states = {} # client number: what that client can see
+        # the clients waiting on the server view for the complete game state
+        self.waiting_complete_game_state_requests = []
+        self.changed_game_state = None
+        # int16 positions and velocities instead of float32
+        self.quantize_game_state = False
+        # changed game states pushed to a client are coded relative to what it acknowledged
+        self.delta_code_game_state = True
+        # the MapEvent every client gets when it connects, None if the
+        # server view didn't get its map from a mapartifact.MapLibrary
+        self.map_event = None
 
     def buildProtocol(self, addr):
         """Create an instance of a subclass of Protocol.
@@ -26,8 +159,132 @@ class ServerFactory(Factory):
         # the protocol instance
         p = self.protocol(self.eventManager)
         p.factory = self
+        self.connected_protocols.append(p)
         return p      
 
+    def remove_protocol(self, protocol):
+        if protocol in self.connected_protocols:
+            self.connected_protocols.remove(protocol)
+        if protocol in self.waiting_complete_game_state_requests:
+            self.waiting_complete_game_state_requests.remove(protocol)
+
+    def _make_encoded_game_states(self, game_state, sequence, client_game_states, client_baselines=None,
+                                  client_delta_references=None, server_time=None, client_inputs=None):
+        '''returns (the game state with everything, {client number: what that client can see})'''
+        encoded_records = {}
+        delta_records = {}
+        encoded_game_state = EncodedGameState(game_state, sequence,
+                                              self.quantize_game_state, encoded_records,
+                                              server_time=server_time)
+        encoded_client_game_states = {}
+        if client_game_states:
+            for client_number in client_game_states:
+                baseline = None
+                if client_baselines:
+                    baseline = client_baselines.get(client_number)
+                deltaReferences = None
+                if client_delta_references:
+                    deltaReferences = client_delta_references.get(client_number)
+                client_input = None
+                if client_inputs:
+                    client_input = client_inputs.get(client_number)
+                encoded_client_game_states[client_number] = EncodedGameState(client_game_states[client_number],
+                                                                             sequence, self.quantize_game_state,
+                                                                             encoded_records, baseline,
+                                                                             deltaReferences, server_time,
+                                                                             client_input, delta_records)
+        return encoded_game_state, encoded_client_game_states
+
+    def get_changed_game_state(self):
+        '''the encoded changed game state with every object in it'''
+        if self.changed_game_state:
+            return self.changed_game_state.sequence, self.changed_game_state.get_encoded_game_state()
+        return None, None
+
+    def request_complete_game_state(self, protocol):
+        '''
+        the server view only packages the complete game state when someone
+        asks, it is sent to the client as soon as the server view posts it
+        '''
+        if protocol not in self.waiting_complete_game_state_requests:
+            self.waiting_complete_game_state_requests.append(protocol)
+        event = events.CompleteGameStateRequestEvent(protocol.client_number)
+        self.eventManager.post(event)
+
+    def send_complete_game_state(self, protocol):
+        '''
+        streams the complete game state to a client one chunk after another.
+        A client that was cut off asks again and gets all of it, after a
+        reconnect it is someone else to the server view and sees other things
+        '''
+        complete_game_state = self.client_complete_game_states.get(protocol.client_number,
+                                                                   self.complete_game_state)
+        if protocol.transport:
+            for chunk_index in range(len(complete_game_state.get_chunks())):
+                protocol.transport.write(complete_game_state.get_chunk_box(chunk_index))
+
+    def update_complete_game_state(self, event):
+        # the server view sends the same state again when nothing changed,
+        # then we keep the one we already encoded, under the newer sequence
+        if (self.complete_game_state is None or
+            self.complete_game_state.object_states is not event.complete_game_state):
+            self.complete_game_state, self.client_complete_game_states = \
+                self._make_encoded_game_states(event.complete_game_state, event.sequence,
+                                               event.client_game_states, server_time=event.server_time)
+        elif self.complete_game_state.sequence != event.sequence:
+            self.complete_game_state = self.complete_game_state.copy_with_sequence(event.sequence)
+            for client_number in self.client_complete_game_states:
+                self.client_complete_game_states[client_number] = \
+                    self.client_complete_game_states[client_number].copy_with_sequence(event.sequence)
+
+        waiting_requests = self.waiting_complete_game_state_requests
+        self.waiting_complete_game_state_requests = []
+        for protocol in waiting_requests:
+            self.send_complete_game_state(protocol)
+
+    def push_changed_game_state(self, event):
+        '''
+        send the changed game state to every subscribed client
+        without waiting for them to ask. Clients that see the same
+        objects get the same bytes, and each object is encoded once
+        '''
+        client_delta_references = {}
+        if self.delta_code_game_state:
+            for p in self.connected_protocols:
+                client_delta_references[p.client_number] = p.deltaReferences
+        self.changed_game_state, client_changed_game_states = \
+            self._make_encoded_game_states(event.changed_game_state, event.sequence,
+                                           event.client_game_states, event.client_baselines,
+                                           client_delta_references, event.server_time,
+                                           event.client_inputs)
+        
+        for p in self.connected_protocols:
+            if p.subscribed and p.transport:
+                changed_game_state = client_changed_game_states.get(p.client_number,
+                                                                    self.changed_game_state)
+                for serialized_box in changed_game_state.get_push_boxes():
+                    p.transport.write(serialized_box)
+
+    def notify(self, event):
+        if event.name == 'Complete Game State Event':
+            self.update_complete_game_state(event)
+
+        elif event.name == 'Changed Game State Event':
+            self.push_changed_game_state(event)
+
+
+class RemoteMapEvent(amp.Command):
+    '''
+    the map the server plays on, sent to a client when it connects.
+    parameters is the repr of the generator parameters dictionary
+    '''
+    arguments = [('width', amp.Integer()),
+                 ('height', amp.Integer()),
+                 ('generator', amp.String()),
+                 ('parameters', amp.String()),
+                 ('seed', amp.Integer()),
+                 ('key', amp.String())]
+    requiresAnswer = False
 
 class RemoteTextMessageEvent(amp.Command):
     ''' AMP command '''
@@ -36,36 +293,65 @@ class RemoteTextMessageEvent(amp.Command):
                                           ('text', amp.String())]))]
     response = [('response', amp.String())]
 
-class RemoteUserKeyboardInputEvent(amp.Command):
-    #requiresAnswer = False
+# commands sent many times a second don't get an answer, that saves an answer box
+# and a Deferred per call. Sequence numbers tell us about missing or repeated ones
+class RemoteInputFrameEvent(amp.Command):
+    ''' all of a client's input for one of its ticks, held keys, shots and walls '''
     arguments = [('message', amp.AmpList([('name', amp.String()),
-                                          ('input', amp.String())]))]
-    response = [('response', amp.String())]
-
-class RemotePlaceWallRequestEvent(amp.Command):
-    arguments = [('message', amp.AmpList([('name', amp.String()),
-                                          ('grid_position', amp.ListOf(amp.Integer()))]))]
-    response = [('response', amp.String())]
-
-class RemoteShootProjectileRequestEvent(amp.Command):
-    arguments = [('message', amp.AmpList([('name', amp.String()),
-                                          ('destination position', amp.ListOf(amp.Integer()))]))]
+                                          ('sequence', amp.Integer()),
+                                          ('direction', amp.String()),
+                                          ('shots', amp.AmpList([('x', amp.Integer()),
+                                                                 ('y', amp.Integer())])),
+                                          ('walls', amp.AmpList([('x', amp.Integer()),
+                                                                 ('y', amp.Integer())]))]))]
+    requiresAnswer = False
     
+# game states are packed by statecodec into one binary string
 class RemoteCompleteGameStateRequestEvent(amp.Command):
+    ''' the server answers by streaming RemoteCompleteGameStateChunkEvents '''
     arguments = [('message', amp.String())]
-    response = [('response', amp.AmpList([('object_type', amp.String()),
-                                          ('object_id', amp.Integer()),
-                                          ('object_position', amp.ListOf(amp.Integer())),
-                                          ('object_velocity', amp.ListOf(amp.Float())),
-                                          ('object_state', amp.String())]))]
+    requiresAnswer = False
+
+class RemoteCompleteGameStateChunkEvent(amp.Command):
+    ''' one piece of the complete game state, sent from the server '''
+    arguments = [('sequence', amp.Integer()),
+                 ('chunk_index', amp.Integer()),
+                 ('chunk_count', amp.Integer()),
+                 ('chunk', amp.String()),
+                 ('server_time', amp.Float(optional=True))]
+    requiresAnswer = False
 
 class RemoteChangedGameStateRequestEvent(amp.Command):
     arguments = [('message', amp.String())]
-    response = [('response', amp.AmpList([('object_type', amp.String()),
-                                          ('object_id', amp.Integer()),
-                                          ('object_position', amp.ListOf(amp.Integer())),
-                                          ('object_velocity', amp.ListOf(amp.Float())),
-                                          ('object_state', amp.String())]))]
+    response = [('sequence', amp.Integer()),
+                ('response', amp.String())]
+
+class RemoteSubscribeGameStateEvent(amp.Command):
+    ''' the client wants every changed game state pushed to it '''
+    arguments = [('message', amp.String())]
+    requiresAnswer = False
+
+class RemoteAcknowledgeGameStateEvent(amp.Command):
+    ''' the client tells us the last changed game state it applied '''
+    arguments = [('sequence', amp.Integer())]
+    requiresAnswer = False
+
+class RemotePushChangedGameStateEvent(amp.Command):
+    '''
+    sent from the server to every subscribed client once a tick,
+    split into chunks if it does not fit in one AMP value.
+    It has everything that changed since baseline, the last
+    sequence the client acknowledged (sequence - 1 if not given)
+    '''
+    arguments = [('sequence', amp.Integer()),
+                 ('changed_game_state', amp.String()),
+                 ('baseline', amp.Integer(optional=True)),
+                 ('server_time', amp.Float(optional=True)),
+                 ('character_id', amp.Integer(optional=True)),
+                 ('input_sequence', amp.Integer(optional=True)),
+                 ('chunk_index', amp.Integer(optional=True)),
+                 ('chunk_count', amp.Integer(optional=True))]
+    requiresAnswer = False
     
 class ClientConnectionProtocol(amp.AMP):
     '''
@@ -75,10 +361,11 @@ class ClientConnectionProtocol(amp.AMP):
     '''
     def __init__(self, eventManager):
         self.eventManager = eventManager
-        self.eventManager.add_listener(self)
+        self.eventManager.add_listener(self, ['Server Quit Event'])
         self.eventEncoder = events.EventEncoder()
-        self.complete_game_state = None
-        self.changed_game_state = None
+        self.subscribed = False # push the changed game state every tick
+        self.acknowledged_sequence = None # last changed game state the client applied
+        self.deltaReferences = statecodec.DeltaReferences() # what the client has, to delta code against
         self.client_number = None # set in connectionMade()
         self.client_ip = None # set in connectionMade()
         self.client_port = None # set in connectionMade()
@@ -90,9 +377,24 @@ class ClientConnectionProtocol(amp.AMP):
         self.client_port = self.transport.client[1]
         # tell server someone has connected
         print 'New client #' + str(self.client_number) + str(self.transport.client)
+        # the map goes out before anything else, so the client's collision
+        # grid is ready before the first game state
+        mapEvent = self.factory.map_event
+        if mapEvent:
+            self.callRemote(RemoteMapEvent, width = mapEvent.map_dimensions[0],
+                            height = mapEvent.map_dimensions[1],
+                            generator = mapEvent.generator,
+                            parameters = repr(mapEvent.parameters),
+                            seed = mapEvent.seed, key = mapEvent.key)
         event = events.NewClientConnectedEvent(self.client_number, self.client_ip)
         self.eventManager.post(event)
 
+    def connectionLost(self, reason):
+        amp.AMP.connectionLost(self, reason)
+        self.subscribed = False
+        self.eventManager.remove_listener(self)
+        self.factory.remove_protocol(self)
+
     def disconnect(self):
         self.transport.loseConnection()
         
@@ -107,58 +409,49 @@ class ClientConnectionProtocol(amp.AMP):
         return {'response': ''}
     RemoteTextMessageEvent.responder(remote_text_message_event)
 
-    def remote_user_keyboard_input_event(self, message):
-        event = self.eventEncoder.decode_event(message, self.client_number)
-        self.eventManager.post(event)
-
-        return {'response': ''}
-    RemoteUserKeyboardInputEvent.responder(remote_user_keyboard_input_event)
-
-    def remote_place_wall_request_event(self, message):
+    def remote_input_frame_event(self, message):
         event = self.eventEncoder.decode_event(message, self.client_number)
         self.eventManager.post(event)
-
-        return {'response': ''}
-    RemotePlaceWallRequestEvent.responder(remote_place_wall_request_event)
-
-    def remote_shoot_projectile_request_event(self, message):
-        event = self.eventEncoder.decode_event(message, self.client_number)
-        self.eventManager.post(event)
-
-        return {'response': ''}
-    RemoteShootProjectileRequestEvent.responder(remote_shoot_projectile_request_event)
+        return {}
+    RemoteInputFrameEvent.responder(remote_input_frame_event)
     
     def remote_complete_game_state_request_event(self, message):
-        if self.complete_game_state:
-            return {'response': self.complete_game_state}
-        else:
-            raise RuntimeWarning('No game state! ' + str(self.complete_game_state))
+        # the client may have lost what we delta coded against, start again.
+        # It acknowledges the complete game state once it has it
+        self.deltaReferences = statecodec.DeltaReferences()
+        self.acknowledged_sequence = None
+        self.factory.request_complete_game_state(self)
+        return {}
     RemoteCompleteGameStateRequestEvent.responder(remote_complete_game_state_request_event)
 
     def remote_changed_game_state_request_event(self, message):
-        if self.changed_game_state:
-            return {'response': self.changed_game_state}
+        sequence, changed_game_state = self.factory.get_changed_game_state()
+        if changed_game_state:
+            return {'sequence': sequence,
+                    'response': changed_game_state}
         else:
-            raise RuntimeWarning('No game state! ' + str(self.changed_game_state))
+            raise RuntimeWarning('No game state! ' + str(changed_game_state))
     RemoteChangedGameStateRequestEvent.responder(remote_changed_game_state_request_event)
+
+    def remote_subscribe_game_state_event(self, message):
+        self.subscribed = True
+        return {}
+    RemoteSubscribeGameStateEvent.responder(remote_subscribe_game_state_event)
+
+    def remote_acknowledge_game_state_event(self, sequence):
+        if sequence > self.acknowledged_sequence:
+            self.acknowledged_sequence = sequence
+            # the server view sends us what changed since this one
+            event = events.GameStateAcknowledgeEvent(sequence, self.client_number)
+            self.eventManager.post(event)
+        return {}
+    RemoteAcknowledgeGameStateEvent.responder(remote_acknowledge_game_state_event)
     
     def remote_character_move_request_event(self, message):
         event = events.CharacterMoveRequestEvent()
     
-    def update_complete_game_state(self, event):
-        self.complete_game_state = event.complete_game_state
-
-    def update_changed_game_state(self, event):
-        self.changed_game_state = event.changed_game_state
-        
     def notify(self, event):
-        if event.name == 'Complete Game State Event':
-            self.update_complete_game_state(event)
-
-        elif event.name == 'Changed Game State Event':
-            self.update_changed_game_state(event)
-
-        elif event.name == 'Server Quit Event':
+        if event.name == 'Server Quit Event':
             self.disconnect()
             
     
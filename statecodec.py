@@ -0,0 +1,328 @@
+##### GAME STATE CODEC #####
+# packs the object states the server view creates into one binary string
+# so they can be sent as a single AMP value, and unpacks them on the client
+import struct
+
+# every object type and state gets a number so they fit in one byte
+# (object type in the high 4 bits, object state in the low 4 bits)
+OBJECT_TYPES = ['default', 'character', 'wall', 'projectile', 'enemy']
+# 'despawned' tells a client an object went out of its view
+OBJECT_STATES = ['default', 'alive', 'dead', 'pending removal',
+                 'attacking', 'moving', 'roaming', 'despawned']
+
+OBJECT_TYPE_CODES = dict((object_type, code) for code, object_type in enumerate(OBJECT_TYPES))
+OBJECT_STATE_CODES = dict((object_state, code) for code, object_state in enumerate(OBJECT_STATES))
+
+# the first byte of an encoded game state says how the records are packed
+FLOAT_FORMAT = 0
+QUANTIZED_FORMAT = 1
+DELTA_FORMAT = 2
+
+# float32 position x, y and velocity x, y
+FLOAT_RECORD = struct.Struct('<ffff')
+# int16 position x, y and velocity x, y in 1 / QUANTIZE_SCALE pixels
+QUANTIZED_RECORD = struct.Struct('<hhhh')
+QUANTIZE_SCALE = 4.0
+
+# delta records start with these flags. Positions are sent as varints in
+# 1 / QUANTIZE_SCALE pixels, relative to the position the other end had
+# at an earlier sequence if it has one. Velocities are only sent when they
+# changed since then
+POSITION_SENT = 1
+VELOCITY_SENT = 2
+RELATIVE_TO_REFERENCE = 4
+# objects with these states are gone, nothing can be coded relative to them
+GONE_OBJECT_STATES = ['dead', 'despawned']
+
+
+def _encode_varint(value):
+    '''packs a positive integer 7 bits at a time, the high bit means more bytes follow'''
+    encoded = []
+    while value > 0x7f:
+        encoded.append(chr((value & 0x7f) | 0x80))
+        value >>= 7
+    encoded.append(chr(value))
+    return ''.join(encoded)
+
+def _decode_varint(encoded, offset):
+    '''returns (value, offset of the next byte)'''
+    value = 0
+    shift = 0
+    while True:
+        byte = ord(encoded[offset])
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+def _encode_signed_varint(value):
+    '''zigzag, small negative numbers stay small: 0, -1, 1, -2... become 0, 1, 2, 3...'''
+    if value < 0:
+        return _encode_varint(-value * 2 - 1)
+    return _encode_varint(value * 2)
+
+def _decode_signed_varint(encoded, offset):
+    value, offset = _decode_varint(encoded, offset)
+    if value & 1:
+        return -(value >> 1) - 1, offset
+    return value >> 1, offset
+
+def _quantize(value):
+    quantized = int(round(value * QUANTIZE_SCALE))
+    if quantized > 32767 or quantized < -32768:
+        raise RuntimeError('Value is too big to quantize: ' + str(value))
+    return quantized
+
+def encode_object_state(object_state, quantized=False):
+    '''packs one object state dict into its binary record'''
+    try:
+        type_code = OBJECT_TYPE_CODES[object_state['object_type']]
+        state_code = OBJECT_STATE_CODES[object_state['object_state']]
+    except KeyError, key:
+        raise RuntimeError('Object cannot be encoded: ' + str(key))
+
+    position = object_state['object_position']
+    velocity = object_state['object_velocity']
+    if quantized:
+        values = QUANTIZED_RECORD.pack(_quantize(position[0]), _quantize(position[1]),
+                                       _quantize(velocity[0]), _quantize(velocity[1]))
+    else:
+        values = FLOAT_RECORD.pack(position[0], position[1], velocity[0], velocity[1])
+
+    return chr((type_code << 4) | state_code) + _encode_varint(object_state['object_id']) + values
+
+def join_object_state_records(records, quantized=False):
+    '''puts records made by encode_object_state together the same way encode_object_states does'''
+    if quantized:
+        return chr(QUANTIZED_FORMAT) + ''.join(records)
+    else:
+        return chr(FLOAT_FORMAT) + ''.join(records)
+
+def encode_object_states(object_states, quantized=False):
+    '''
+    object_states: [{'object_type': 'character', 'object_id': 12,
+                     'object_position': [300, 300], 'object_velocity': [0.0, 0.0],
+                     'object_state': 'alive'}, ...]
+    returns: a binary string
+    '''
+    records = [encode_object_state(object_state, quantized) for object_state in object_states]
+    return join_object_state_records(records, quantized)
+
+class DeltaReferences():
+    '''
+    the quantized position and velocity every object had in each delta
+    coded game state. The server keeps one for every client and the
+    client keeps one, so a record can be coded relative to one the
+    other end already has.
+
+    the baseline is the last sequence the client acknowledged, only the
+    newest reference at or before it and the ones after it are kept
+    '''
+    def __init__(self):
+        self.object_references = {} # object id: [(sequence, (position, velocity) or None if gone), ...]
+        self.baseline = None
+
+    def set_baseline(self, baseline):
+        if baseline > self.baseline:
+            self.baseline = baseline
+
+    def _get_newest_index(self, references, baseline):
+        '''index of the newest reference at or before baseline, -1 if there is none'''
+        newest_index = -1
+        for index, (sequence, reference) in enumerate(references):
+            if sequence > baseline:
+                break
+            newest_index = index
+        return newest_index
+
+    def add(self, object_id, sequence, reference):
+        references = self.object_references.get(object_id)
+        if references is None:
+            references = self.object_references[object_id] = []
+        references.append((sequence, reference))
+
+        if self.baseline is not None:
+            newest_index = self._get_newest_index(references, self.baseline)
+            if newest_index > 0:
+                del references[:newest_index]
+            if len(references) == 1 and references[0][1] is None and references[0][0] <= self.baseline:
+                # the object is gone and the other end knows it
+                del self.object_references[object_id]
+
+    def get_newest(self, object_id, baseline):
+        '''(sequence, reference) of the newest reference at or before baseline, or None'''
+        references = self.object_references.get(object_id)
+        if references:
+            newest_index = self._get_newest_index(references, baseline)
+            if newest_index >= 0:
+                return references[newest_index]
+
+    def get(self, object_id, sequence):
+        '''the reference from exactly this sequence'''
+        for reference_sequence, reference in self.object_references.get(object_id, ()):
+            if reference_sequence == sequence and reference is not None:
+                return reference
+        raise RuntimeError('No delta reference for object ' + str(object_id) +
+                           ' at sequence ' + str(sequence))
+
+def _quantize_values(values):
+    return (int(round(values[0] * QUANTIZE_SCALE)), int(round(values[1] * QUANTIZE_SCALE)))
+
+def encode_delta_object_states(object_states, sequence, baseline, deltaReferences, delta_records=None):
+    '''
+    like encode_object_states, but every position and velocity is coded
+    relative to the newest one the client had at baseline (None if we
+    don't know what it has). Adds every object to deltaReferences.
+
+    delta_records can be shared by every client getting this sequence,
+    {(object id, reference sequence or None): (record, position, velocity)}.
+    Clients coded against the same reference get the same record, so it
+    is only coded once
+    '''
+    if baseline is not None:
+        deltaReferences.set_baseline(baseline)
+    if delta_records is None:
+        delta_records = {}
+
+    records = [chr(DELTA_FORMAT)]
+    for object_state in object_states:
+        object_id = object_state['object_id']
+        if object_state['object_state'] == 'despawned':
+            records.append(_encode_delta_header(object_state) + chr(0))
+            deltaReferences.add(object_id, sequence, None)
+            continue
+
+        newest_reference = None
+        if baseline is not None:
+            newest_reference = deltaReferences.get_newest(object_id, baseline)
+        if newest_reference and newest_reference[1]:
+            record_key = (object_id, newest_reference[0])
+        else:
+            newest_reference = None
+            record_key = (object_id, None)
+
+        delta_record = delta_records.get(record_key)
+        if delta_record is None:
+            delta_record = _encode_delta_record(object_state, sequence, newest_reference)
+            delta_records[record_key] = delta_record
+        record, position, velocity = delta_record
+        records.append(record)
+
+        if object_state['object_state'] in GONE_OBJECT_STATES:
+            deltaReferences.add(object_id, sequence, None)
+        else:
+            deltaReferences.add(object_id, sequence, (position, velocity))
+    return ''.join(records)
+
+def _encode_delta_header(object_state):
+    try:
+        type_code = OBJECT_TYPE_CODES[object_state['object_type']]
+        state_code = OBJECT_STATE_CODES[object_state['object_state']]
+    except KeyError, key:
+        raise RuntimeError('Object cannot be encoded: ' + str(key))
+    return chr((type_code << 4) | state_code) + _encode_varint(object_state['object_id'])
+
+def _encode_delta_record(object_state, sequence, reference):
+    '''
+    one object coded relative to reference, (sequence, (position, velocity)),
+    or on its own if that is None. returns (record, position, velocity)
+    '''
+    position = _quantize_values(object_state['object_position'])
+    velocity = _quantize_values(object_state['object_velocity'])
+    if reference:
+        reference_sequence, (reference_position, reference_velocity) = reference
+        flags = RELATIVE_TO_REFERENCE
+        values = [_encode_varint(sequence - reference_sequence)]
+        if position != reference_position:
+            flags |= POSITION_SENT
+            values.append(_encode_signed_varint(position[0] - reference_position[0]) +
+                          _encode_signed_varint(position[1] - reference_position[1]))
+        if velocity != reference_velocity:
+            flags |= VELOCITY_SENT
+            values.append(_encode_signed_varint(velocity[0]) + _encode_signed_varint(velocity[1]))
+    else:
+        flags = POSITION_SENT | VELOCITY_SENT
+        values = [_encode_signed_varint(position[0]) + _encode_signed_varint(position[1]),
+                  _encode_signed_varint(velocity[0]) + _encode_signed_varint(velocity[1])]
+    record = _encode_delta_header(object_state) + chr(flags) + ''.join(values)
+    return record, position, velocity
+
+def _decode_delta_object_states(encoded_object_states, sequence, baseline, deltaReferences):
+    '''the other half of encode_delta_object_states'''
+    if baseline is not None:
+        deltaReferences.set_baseline(baseline)
+
+    object_states = []
+    offset = 1
+    end = len(encoded_object_states)
+    while offset < end:
+        codes = ord(encoded_object_states[offset])
+        object_id, offset = _decode_varint(encoded_object_states, offset + 1)
+        flags = ord(encoded_object_states[offset])
+        offset += 1
+        object_state = OBJECT_STATES[codes & 0x0f]
+
+        position = (0, 0)
+        velocity = (0, 0)
+        if flags & RELATIVE_TO_REFERENCE:
+            reference_age, offset = _decode_varint(encoded_object_states, offset)
+            position, velocity = deltaReferences.get(object_id, sequence - reference_age)
+        if flags & POSITION_SENT:
+            position_x, offset = _decode_signed_varint(encoded_object_states, offset)
+            position_y, offset = _decode_signed_varint(encoded_object_states, offset)
+            if flags & RELATIVE_TO_REFERENCE:
+                position = (position[0] + position_x, position[1] + position_y)
+            else:
+                position = (position_x, position_y)
+        if flags & VELOCITY_SENT:
+            velocity_x, offset = _decode_signed_varint(encoded_object_states, offset)
+            velocity_y, offset = _decode_signed_varint(encoded_object_states, offset)
+            velocity = (velocity_x, velocity_y)
+
+        if object_state in GONE_OBJECT_STATES:
+            deltaReferences.add(object_id, sequence, None)
+        else:
+            deltaReferences.add(object_id, sequence, (position, velocity))
+
+        object_states.append({'object_type': OBJECT_TYPES[codes >> 4],
+                              'object_id': object_id,
+                              'object_position': [position[0] / QUANTIZE_SCALE, position[1] / QUANTIZE_SCALE],
+                              'object_velocity': [velocity[0] / QUANTIZE_SCALE, velocity[1] / QUANTIZE_SCALE],
+                              'object_state': object_state})
+    return object_states
+
+def decode_object_states(encoded_object_states, deltaReferences=None, sequence=None, baseline=None):
+    '''
+    turns a string made by encode_object_states back into a list of object state dicts.
+    delta coded game states also need the client's DeltaReferences, their sequence and baseline
+    '''
+    record_format = ord(encoded_object_states[0])
+    if record_format == DELTA_FORMAT:
+        if deltaReferences is None:
+            raise RuntimeError('Delta coded game state without delta references')
+        return _decode_delta_object_states(encoded_object_states, sequence, baseline, deltaReferences)
+    elif record_format == FLOAT_FORMAT:
+        record = FLOAT_RECORD
+        scale = 1.0
+    elif record_format == QUANTIZED_FORMAT:
+        record = QUANTIZED_RECORD
+        scale = QUANTIZE_SCALE
+    else:
+        raise RuntimeError('Unknown game state format: ' + str(record_format))
+
+    object_states = []
+    offset = 1
+    end = len(encoded_object_states)
+    while offset < end:
+        codes = ord(encoded_object_states[offset])
+        object_id, offset = _decode_varint(encoded_object_states, offset + 1)
+        position_x, position_y, velocity_x, velocity_y = record.unpack_from(encoded_object_states, offset)
+        offset += record.size
+
+        object_states.append({'object_type': OBJECT_TYPES[codes >> 4],
+                              'object_id': object_id,
+                              'object_position': [position_x / scale, position_y / scale],
+                              'object_velocity': [velocity_x / scale, velocity_y / scale],
+                              'object_state': OBJECT_STATES[codes & 0x0f]})
+    return object_states
@@ -0,0 +1,125 @@
+##### GAME STATS #####
+# counts and times what the event manager and the server view are doing
+# so we can see where a tick goes. Everything here is a dict lookup and
+# an addition per call so it can stay on while people are playing
+import time
+
+
+class Histogram():
+    '''
+    counts values into power of two buckets,
+    bucket 0 holds 0, bucket n holds values from 2^(n-1) to 2^n - 1.
+    times are added in microseconds
+    '''
+    def __init__(self, number_of_buckets=24):
+        self.buckets = [0] * number_of_buckets
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        value = int(value)
+        bucket = min(value.bit_length(), len(self.buckets) - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def get_percentile(self, fraction):
+        '''the top of the bucket the value at this fraction of the way through falls into'''
+        if self.count == 0:
+            return 0
+        wanted = fraction * self.count
+        seen = 0
+        for bucket, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= wanted:
+                return min((1 << bucket) - 1, self.max)
+        return self.max
+
+    def get_summary(self):
+        if self.count:
+            mean = self.total / float(self.count)
+        else:
+            mean = 0.0
+        return {'count': self.count,
+                'mean': mean,
+                'p50': self.get_percentile(0.5),
+                'p99': self.get_percentile(0.99),
+                'max': self.max}
+
+
+class Stats():
+    '''
+    the event manager and the server view report into this.
+    get_stats returns everything since the last dump, dump_if_due
+    prints it every dump_interval seconds and starts counting again
+    '''
+    def __init__(self, dump_interval=10.0):
+        self.dump_interval = dump_interval
+        self.reset()
+
+    def reset(self):
+        self.start_time = time.time()
+        self.event_counts = {} # event name: how many were processed
+        self.listener_times = {} # listener class name: Histogram of notify microseconds
+        self.queue_depths = Histogram() # events processed per tick
+        self.phase_times = {} # phase name: Histogram of microseconds
+
+    def count_event(self, event_name):
+        self.event_counts[event_name] = self.event_counts.get(event_name, 0) + 1
+
+    def record_listener_time(self, listener, seconds):
+        listener_name = listener.__class__.__name__
+        histogram = self.listener_times.get(listener_name)
+        if histogram is None:
+            histogram = self.listener_times[listener_name] = Histogram()
+        histogram.add(seconds * 1000000)
+
+    def record_queue_depth(self, depth):
+        self.queue_depths.add(depth)
+
+    def record_phase_time(self, phase_name, seconds):
+        histogram = self.phase_times.get(phase_name)
+        if histogram is None:
+            histogram = self.phase_times[phase_name] = Histogram()
+        histogram.add(seconds * 1000000)
+
+    def get_stats(self):
+        '''everything counted since the last reset, as plain dicts'''
+        stats = {'seconds': time.time() - self.start_time,
+                 'event_counts': dict(self.event_counts),
+                 'queue_depth': self.queue_depths.get_summary(),
+                 'listener_microseconds': {},
+                 'phase_microseconds': {}}
+        for listener_name in self.listener_times:
+            stats['listener_microseconds'][listener_name] = self.listener_times[listener_name].get_summary()
+        for phase_name in self.phase_times:
+            stats['phase_microseconds'][phase_name] = self.phase_times[phase_name].get_summary()
+        return stats
+
+    def format_stats(self):
+        stats = self.get_stats()
+        lines = ['----- stats for the last ' + str(round(stats['seconds'], 1)) + ' seconds -----']
+
+        queue_depth = stats['queue_depth']
+        lines.append('queue depth: mean ' + str(round(queue_depth['mean'], 1)) +
+                     ' p99 ' + str(queue_depth['p99']) + ' max ' + str(queue_depth['max']))
+
+        for heading, times in [('phase', stats['phase_microseconds']),
+                               ('listener', stats['listener_microseconds'])]:
+            for name in sorted(times):
+                summary = times[name]
+                lines.append(heading + ' ' + name + ': ' + str(summary['count']) + ' calls, mean ' +
+                             str(int(summary['mean'])) + 'us p50 ' + str(summary['p50']) +
+                             'us p99 ' + str(summary['p99']) + 'us max ' + str(summary['max']) + 'us')
+
+        for event_name in sorted(stats['event_counts']):
+            lines.append('event ' + event_name + ': ' + str(stats['event_counts'][event_name]))
+        return '\n'.join(lines)
+
+    def dump_if_due(self):
+        if time.time() - self.start_time >= self.dump_interval:
+            print self.format_stats()
+            self.reset()
@@ -0,0 +1,198 @@
+##### SERVER SIMULATION TESTS #####
+import unittest
+
+import numpy
+
+import ampserver
+import events
+import mapgrid
+import stats
+
+TILE_SIZE = 32
+
+
+class FakeTime():
+    '''stands in for the time module, the clock only moves when we say so'''
+    def __init__(self):
+        self.current_time = 1000.0
+
+    def time(self):
+        return self.current_time
+
+
+class TickListener():
+    '''keeps the ticks it gets, and can make every tick take a while'''
+    def __init__(self, eventManager, fakeTime):
+        self.fakeTime = fakeTime
+        self.tick_time = 0.0
+        self.ticks = [] # (tick number, delta time)
+        eventManager.add_listener(self, ['Tick Event'])
+
+    def notify(self, event):
+        self.ticks.append((event.tick_number, event.delta_time))
+        self.fakeTime.current_time += self.tick_time
+
+
+class ProjectileSystemTestCase(unittest.TestCase):
+    def setUp(self):
+        self.collisionGrid = mapgrid.CollisionGrid([20, 20])
+        self.spatialHash = mapgrid.SpatialHash(TILE_SIZE)
+        self.projectileSystem = ampserver.ProjectileSystem(self.collisionGrid, self.spatialHash,
+                                                           [20 * TILE_SIZE, 20 * TILE_SIZE], TILE_SIZE,
+                                                           capacity=4)
+        self.projectileSystem.speed = 320
+
+    def _get_position(self, object_id):
+        return self.projectileSystem.get_object_state(object_id)['object_position']
+
+    def _get_velocity(self, object_id):
+        return self.projectileSystem.get_object_state(object_id)['object_velocity']
+
+    def test_moves_towards_the_destination(self):
+        object_id = self.projectileSystem.add_projectile([100.0, 100.0], [200.0, 100.0])
+        self.assertEqual(self._get_velocity(object_id), [320.0, 0.0])
+        self.projectileSystem.update(0.1)
+        self.assertEqual(self._get_position(object_id), [132.0, 100.0])
+        # it moved into the next cell
+        self.assertEqual(self.spatialHash.get_position(object_id), [132.0, 100.0])
+
+    def test_bounces_off_walls(self):
+        self.collisionGrid.close_tile([5, 3])
+        object_id = self.projectileSystem.add_projectile([150.0, 100.0], [400.0, 100.0])
+        self.projectileSystem.package_states('changed')
+        self.projectileSystem.update(0.05)
+        self.assertEqual(self._get_velocity(object_id), [-320.0, 0.0])
+        # the bounce goes out in the changed state
+        self.assertEqual([object_state['object_id'] for object_state
+                          in self.projectileSystem.package_states('changed')], [object_id])
+        self.assertEqual(self.projectileSystem.package_states('changed'), [])
+
+    def test_bounces_diagonally_into_a_corner(self):
+        self.collisionGrid.close_tile([5, 5])
+        self.collisionGrid.close_tile([5, 4])
+        self.collisionGrid.close_tile([4, 5])
+        object_id = self.projectileSystem.add_projectile([150.0, 150.0], [250.0, 250.0])
+        self.projectileSystem.update(0.05)
+        velocity = self._get_velocity(object_id)
+        self.assertTrue(velocity[0] < 0 and velocity[1] < 0)
+
+    def test_dies_after_too_many_bounces(self):
+        # a projectile stuck in a wall bounces every update
+        self.collisionGrid.close_tile([3, 3])
+        object_id = self.projectileSystem.add_projectile([100.0, 100.0], [100.0, 200.0])
+        for bounce in range(self.projectileSystem.max_direction_changes):
+            self.assertEqual(self.projectileSystem.get_state(object_id), 'alive')
+            self.projectileSystem.update(0.0)
+        self.assertEqual(self.projectileSystem.get_state(object_id), 'dead')
+
+    def test_leaving_the_map_kills_it(self):
+        object_id = self.projectileSystem.add_projectile([10.0, 10.0], [0.0, 10.0])
+        self.projectileSystem.update(0.1)
+        self.assertEqual(self.projectileSystem.get_state(object_id), 'dead')
+
+    def test_removed_once_clients_know_it_is_dead(self):
+        dead_id = self.projectileSystem.add_projectile([10.0, 10.0], [0.0, 10.0])
+        other_ids = [self.projectileSystem.add_projectile([300.0, 300.0], [300.0, 400.0]) for i in range(2)]
+        self.projectileSystem.update(0.1)
+        # still there until the changed state said it died
+        self.projectileSystem.update(0.0)
+        self.assertTrue(dead_id in self.projectileSystem)
+        object_states = self.projectileSystem.package_states('changed')
+        self.assertTrue({'object_type': 'projectile', 'object_id': dead_id,
+                         'object_position': self._get_position(dead_id),
+                         'object_velocity': [-320.0, 0.0],
+                         'object_state': 'dead'} in object_states)
+
+        self.projectileSystem.update(0.0)
+        self.assertFalse(dead_id in self.projectileSystem)
+        self.assertFalse(dead_id in self.spatialHash)
+        self.assertEqual(len(self.projectileSystem), 2)
+        # the rest moved up and are still found by id
+        for object_id in other_ids:
+            self.assertEqual(self.projectileSystem.get_state(object_id), 'alive')
+            self.assertEqual(self._get_position(object_id), [300.0, 300.0 + 320 * 0.1])
+
+    def test_grows(self):
+        object_ids = [self.projectileSystem.add_projectile([100.0 + i, 100.0], [100.0 + i, 200.0])
+                      for i in range(10)]
+        self.assertEqual(len(self.projectileSystem), 10)
+        self.assertTrue(self.projectileSystem.capacity >= 10)
+        numpy.testing.assert_allclose([self._get_position(object_id)[0] for object_id in object_ids],
+                                      [100.0 + i for i in range(10)])
+
+
+class ClientStateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = ampserver.ClientState(1, '127.0.0.1')
+
+    def _add_input_frames(self, sequences):
+        for sequence in sequences:
+            self.client.add_input_frame(events.InputFrameEvent(sequence, 'UP', [], []))
+        return [input_frame.sequence for input_frame in self.client.input_frames]
+
+    def test_in_order(self):
+        self.assertEqual(self._add_input_frames([1, 2, 3]), [1, 2, 3])
+        self.assertEqual(self.client.missed_input_frames, 0)
+
+    def test_old_and_repeated_frames_are_dropped(self):
+        self.assertEqual(self._add_input_frames([1, 3, 3, 2, 4]), [1, 3, 4])
+        self.assertEqual(self.client.last_input_sequence, 4)
+
+    def test_gaps_are_counted(self):
+        self.assertEqual(self._add_input_frames([2, 3, 7]), [2, 3, 7])
+        self.assertEqual(self.client.missed_input_frames, 4)
+        # a late frame doesn't fill the gap
+        self._add_input_frames([5])
+        self.assertEqual(self.client.missed_input_frames, 4)
+
+
+class ProgramClockTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fakeTime = FakeTime()
+        self.addCleanup(setattr, ampserver, 'time', ampserver.time)
+        ampserver.time = self.fakeTime
+        self.eventManager = events.EventManager()
+        self.programClock = ampserver.ProgramClock(self.eventManager)
+        # run() is called by hand, nothing is scheduled
+        self.programClock.running = False
+        self.tickListener = TickListener(self.eventManager, self.fakeTime)
+        self.step_time = self.programClock.step_time
+
+    def _run(self, steps):
+        self.fakeTime.current_time += steps * self.step_time
+        self.programClock.run()
+
+    def test_fixed_steps(self):
+        self._run(2.5)
+        self.assertEqual(self.tickListener.ticks, [(1, self.step_time), (2, self.step_time)])
+        self.assertAlmostEqual(self.programClock.accumulator, 0.5 * self.step_time)
+        # the half step left over is stepped with the next one
+        self._run(0.75)
+        self.assertEqual(len(self.tickListener.ticks), 3)
+        self.assertAlmostEqual(self.programClock.get_simulation_time(), 3 * self.step_time)
+
+    def test_catch_up_is_capped(self):
+        self._run(20.25)
+        max_catch_up_steps = self.programClock.max_catch_up_steps
+        self.assertEqual(len(self.tickListener.ticks), max_catch_up_steps)
+        self.assertAlmostEqual(self.programClock.dropped_time, (20 - max_catch_up_steps) * self.step_time)
+        self.assertAlmostEqual(self.programClock.accumulator, 0.25 * self.step_time)
+
+    def test_tick_budget(self):
+        self.eventManager.stats = stats.Stats()
+        self._run(1.5)
+        self.assertEqual(self.programClock.budget_overruns, 0)
+
+        self.tickListener.tick_time = 2 * self.programClock.tick_budget
+        self._run(1)
+        self.assertEqual(self.programClock.budget_overruns, 1)
+        self.assertEqual(len(self.programClock.recent_overruns), 1)
+        tick_number, tick_time = self.programClock.recent_overruns[0]
+        self.assertEqual(tick_number, 2)
+        self.assertAlmostEqual(tick_time, 2 * self.programClock.tick_budget)
+        self.assertAlmostEqual(self.programClock.longest_tick_time, 2 * self.programClock.tick_budget)
+        self.assertEqual(self.eventManager.stats.get_stats()['phase_microseconds']['tick']['count'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+##### CLIENT NETWORK TESTS #####
+import unittest
+
+import events
+import clientnetworkportal
+
+
+class InputFrameBatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.inputFrameBatcher = clientnetworkportal.InputFrameBatcher()
+
+    def test_nothing_to_send(self):
+        self.assertEqual(self.inputFrameBatcher.pop_input_frame(), None)
+        self.assertEqual(self.inputFrameBatcher.sequence, 0)
+
+    def test_one_frame_a_tick(self):
+        self.inputFrameBatcher.add_event(events.UserKeyboardInputEvent('LEFT'))
+        self.inputFrameBatcher.add_event(events.ShootProjectileRequestEvent([10, 20]))
+        self.inputFrameBatcher.add_event(events.UserKeyboardInputEvent('LEFTUP'))
+        self.inputFrameBatcher.add_event(events.PlaceWallRequestEvent([3, 4]))
+        self.inputFrameBatcher.add_event(events.ShootProjectileRequestEvent([30, 40]))
+        input_frame = self.inputFrameBatcher.pop_input_frame()
+        self.assertEqual(input_frame.sequence, 1)
+        # the direction held last this tick
+        self.assertEqual(input_frame.direction, 'LEFTUP')
+        self.assertEqual(input_frame.shots, [[10, 20], [30, 40]])
+        self.assertEqual(input_frame.walls, [[3, 4]])
+        # it starts again for the next tick
+        self.assertEqual(self.inputFrameBatcher.pop_input_frame(), None)
+
+    def test_sequence_only_counts_sent_frames(self):
+        for tick in range(3):
+            self.inputFrameBatcher.pop_input_frame()
+            self.inputFrameBatcher.add_event(events.PlaceWallRequestEvent([tick, 0]))
+            input_frame = self.inputFrameBatcher.pop_input_frame()
+            self.assertEqual(input_frame.sequence, tick + 1)
+            self.assertEqual(input_frame.direction, '')
+
+    def test_only_user_input(self):
+        self.assertRaises(RuntimeError, self.inputFrameBatcher.add_event, events.TickEvent(0.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
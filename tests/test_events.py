@@ -0,0 +1,90 @@
+##### EVENT MANAGER TESTS #####
+import gc
+import unittest
+
+import events
+
+
+class Listener():
+    '''keeps the names of the events it gets'''
+    def __init__(self, eventManager, event_names=None):
+        self.event_names = []
+        eventManager.add_listener(self, event_names)
+
+    def notify(self, event):
+        self.event_names.append(event.name)
+
+
+class DispatchTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.eventManager = events.EventManager()
+
+    def _post_tick(self):
+        self.eventManager.post(events.TextMessageEvent('hello', False))
+        self.eventManager.post(events.TickEvent(0.0))
+
+    def test_listeners_only_get_what_they_want(self):
+        tickListener = Listener(self.eventManager, ['Tick Event'])
+        everythingListener = Listener(self.eventManager)
+        self._post_tick()
+        self.assertEqual(tickListener.event_names, ['Tick Event'])
+        self.assertEqual(everythingListener.event_names, ['Text Message Event', 'Tick Event'])
+
+    def test_table_is_kept_between_ticks(self):
+        tickListener = Listener(self.eventManager, ['Tick Event'])
+        self._post_tick()
+        dispatch_table = self.eventManager.dispatch_table
+        self.assertEqual(len(dispatch_table[events.TickEvent.type_code]), 1)
+        self._post_tick()
+        self.assertTrue(self.eventManager.dispatch_table is dispatch_table)
+        self.assertEqual(tickListener.event_names, ['Tick Event', 'Tick Event'])
+
+    def test_rebuilt_when_a_listener_is_added(self):
+        tickListener = Listener(self.eventManager, ['Tick Event'])
+        self._post_tick()
+        otherListener = Listener(self.eventManager, ['Tick Event'])
+        self.assertEqual(self.eventManager.dispatch_table[events.TickEvent.type_code], None)
+        self._post_tick()
+        self.assertEqual(tickListener.event_names, ['Tick Event', 'Tick Event'])
+        self.assertEqual(otherListener.event_names, ['Tick Event'])
+
+    def test_rebuilt_when_a_listener_is_removed(self):
+        tickListener = Listener(self.eventManager, ['Tick Event'])
+        otherListener = Listener(self.eventManager, ['Tick Event'])
+        self._post_tick()
+        self.eventManager.remove_listener(otherListener)
+        self._post_tick()
+        self.assertEqual(tickListener.event_names, ['Tick Event', 'Tick Event'])
+        self.assertEqual(otherListener.event_names, ['Tick Event'])
+
+    def test_rebuilt_when_a_listener_is_garbage_collected(self):
+        tickListener = Listener(self.eventManager, ['Tick Event'])
+        otherListener = Listener(self.eventManager, ['Tick Event'])
+        self._post_tick()
+        del otherListener
+        gc.collect()
+        self.assertEqual(self.eventManager.dispatch_table[events.TickEvent.type_code], None)
+        self._post_tick()
+        self.assertEqual(len(self.eventManager.dispatch_table[events.TickEvent.type_code]), 1)
+        self.assertEqual(tickListener.event_names, ['Tick Event', 'Tick Event'])
+
+
+class UnknownEvent(events.Event):
+    __slots__ = ()
+    name = 'Unknown Event'
+
+
+class TypeCodeTestCase(unittest.TestCase):
+    def test_every_event_type_has_its_own_code(self):
+        type_codes = [event_type.type_code for event_type in events.EVENT_TYPES]
+        self.assertEqual(type_codes, range(len(events.EVENT_TYPES)))
+
+    def test_events_not_in_the_list_are_refused(self):
+        eventManager = events.EventManager()
+        listener = Listener(eventManager)
+        eventManager.post(UnknownEvent())
+        self.assertRaises(RuntimeError, eventManager.post, events.TickEvent(0.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
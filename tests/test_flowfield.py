@@ -0,0 +1,111 @@
+##### FLOW FIELD TESTS #####
+# the flow field is checked against a plain breadth first search
+from collections import deque
+import random
+import unittest
+
+import numpy
+
+import mapgrid
+import flowfield
+
+
+def get_distances(collision_array, target_positions):
+    '''steps from every tile to the nearest target, one tile at a time. None where there is no way'''
+    width, height = collision_array.shape
+    distances = [[None] * height for x in range(width)]
+    queue = deque()
+    for target_position in target_positions:
+        distances[target_position[0]][target_position[1]] = 0
+        queue.append(target_position)
+    while queue:
+        x, y = queue.popleft()
+        for step in flowfield.DIRECTIONS:
+            next_x = x + step[0]
+            next_y = y + step[1]
+            if (0 <= next_x < width and 0 <= next_y < height and
+                collision_array[next_x, next_y] == 0 and distances[next_x][next_y] is None):
+                distances[next_x][next_y] = distances[x][y] + 1
+                queue.append((next_x, next_y))
+    return distances
+
+
+class FlowFieldTestCase(unittest.TestCase):
+    def setUp(self):
+        self.map_dimensions = [30, 20]
+        self.randomGenerator = random.Random(11)
+        self.collisionGrid = mapgrid.CollisionGrid(self.map_dimensions)
+        for i in range(200):
+            self.collisionGrid.close_tile(self._get_random_grid_position())
+        self.flowField = flowfield.FlowField(self.collisionGrid)
+        self.targets = {}
+
+    def _get_random_grid_position(self):
+        return (self.randomGenerator.randrange(self.map_dimensions[0]),
+                self.randomGenerator.randrange(self.map_dimensions[1]))
+
+    def _move_target(self, target_id, grid_position):
+        self.targets[target_id] = grid_position
+        self.flowField.move_target(target_id, grid_position)
+
+    def _assert_matches_search(self):
+        distances = get_distances(self.collisionGrid.collision_array, self.targets.values())
+        for x in range(self.map_dimensions[0]):
+            for y in range(self.map_dimensions[1]):
+                self.assertEqual(self.flowField.get_distance([x, y]), distances[x][y])
+                direction = self.flowField.get_direction([x, y])
+                if distances[x][y]:
+                    # the step goes one tile closer
+                    self.assertEqual(distances[x + direction[0]][y + direction[1]], distances[x][y] - 1)
+                elif distances[x][y] is None and self.collisionGrid.collision_array[x, y]:
+                    # closed tiles step out onto a tile with a way to a target, if they can
+                    if direction != [0, 0]:
+                        self.assertNotEqual(distances[x + direction[0]][y + direction[1]], None)
+                else:
+                    self.assertEqual(direction, [0, 0])
+
+    def test_matches_search(self):
+        self._move_target('character', (5, 5))
+        self._move_target('wall', (20, 12))
+        self._assert_matches_search()
+
+    def test_moving_and_removing_targets(self):
+        self._move_target('character', (5, 5))
+        self._assert_matches_search()
+        self._move_target('character', (25, 3))
+        self._assert_matches_search()
+        self.flowField.remove_target('character')
+        del self.targets['character']
+        self._assert_matches_search()
+        self.assertEqual(self.flowField.get_distance([25, 3]), None)
+
+    def test_opening_and_closing_tiles(self):
+        self._move_target('character', (15, 10))
+        self._assert_matches_search()
+        for i in range(100):
+            grid_position = self._get_random_grid_position()
+            if self.collisionGrid.is_tile_open(grid_position):
+                self.collisionGrid.close_tile(grid_position)
+                self.flowField.tile_closed(grid_position)
+            else:
+                self.collisionGrid.open_tile(grid_position)
+                self.flowField.tile_opened(grid_position)
+            if i % 10 == 0:
+                self._assert_matches_search()
+        self._assert_matches_search()
+
+    def test_get_directions_many(self):
+        self._move_target('character', (5, 5))
+        grid_positions = numpy.array([[0, 0], [5, 5], [29, 19], [-1, 3], [30, 0]])
+        directions = self.flowField.get_directions_many(grid_positions)
+        for grid_position, direction in zip(grid_positions, directions):
+            self.assertEqual(list(direction), self.flowField.get_direction(grid_position))
+
+    def test_off_the_map(self):
+        self._move_target('character', (5, 5))
+        self.assertEqual(self.flowField.get_distance([-1, 0]), None)
+        self.assertEqual(self.flowField.get_direction([0, 20]), [0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,279 @@
+##### GAME STATE REPLICATION TESTS #####
+# a server and its clients connected through twisted's in-memory
+# transports. Run every test from the top of the repo with:
+#   python -m unittest discover -s tests
+import random
+import shutil
+import tempfile
+import unittest
+
+from twisted.test import iosim
+
+import events
+import ampserver
+import statecodec
+import mapartifact
+import serverfactory
+import clientnetworkportal
+
+
+class GameStateListener():
+    '''keeps the game states a client receives'''
+    def __init__(self, eventManager):
+        self.complete_game_states = [] # (sequence, server time)
+        self.complete_object_states = []
+        self.complete_game_state_progress = [] # (received chunks, chunk count)
+        self.map_events = []
+        self.changed_game_states = [] # (sequence, baseline)
+        eventManager.add_listener(self, ['Complete Game State Event',
+                                         'Complete Game State Progress Event',
+                                         'Map Event',
+                                         'Changed Game State Event'])
+
+    def notify(self, event):
+        if event.name == 'Complete Game State Event':
+            self.complete_game_states.append((event.sequence, event.server_time))
+            self.complete_object_states.append(event.complete_game_state)
+        elif event.name == 'Complete Game State Progress Event':
+            self.complete_game_state_progress.append((event.received_chunks, event.chunk_count))
+        elif event.name == 'Map Event':
+            self.map_events.append(event)
+        elif event.name == 'Changed Game State Event':
+            self.changed_game_states.append((event.sequence, event.baseline))
+
+
+class GameStateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.serverEventManager = events.EventManager()
+        self.serverView = ampserver.ServerView(self.serverEventManager, {})
+        self.serverView.replication_interval = 1
+        self.serverFactory = serverfactory.ServerFactory(self.serverEventManager)
+        self.serverFactory.protocol = serverfactory.ClientConnectionProtocol
+
+        self.clientEventManager = events.EventManager()
+        self.clientFactory = clientnetworkportal.ClientFactory(self.clientEventManager, events.EventEncoder(),
+                                                               'localhost', 5887)
+        self.gameStateListener = GameStateListener(self.clientEventManager)
+        self.pump = self._connect(self.clientFactory.buildProtocol(None), 0)
+
+    def _connect(self, clientProtocol, client_number):
+        serverProtocol = self.serverFactory.buildProtocol(None)
+        serverTransport = iosim.FakeTransport(serverProtocol, False)
+        serverTransport.sessionno = client_number
+        serverTransport.client = ('127.0.0.1', 1000 + client_number)
+        clientTransport = iosim.FakeTransport(clientProtocol, True)
+        clientTransport.realAddress = 'test'
+        self.serverTransport = serverTransport
+        self.clientTransport = clientTransport
+        return iosim.connect(serverProtocol, serverTransport, clientProtocol, clientTransport)
+
+    def _server_tick(self, ticks=1):
+        for tick in range(ticks):
+            self.serverEventManager.post(events.TickEvent(1 / 60.0))
+            self.pump.flush()
+            # the client handles what it got on its own tick
+            self.clientEventManager.post(events.TickEvent(0.0))
+            self.pump.flush()
+
+    def _client_post(self, event):
+        self.clientEventManager.post(event)
+        self.clientEventManager.post(events.TickEvent(0.0))
+        self.pump.flush()
+
+    def _request_complete_game_state(self):
+        '''asks like ClientDisplay does, returns the sequence of the complete game state we get'''
+        self._client_post(events.CompleteGameStateRequestEvent())
+        self._server_tick()
+        return self.gameStateListener.complete_game_states[-1][0]
+
+    def _get_changed_game_states_after(self, sequence):
+        return [(changed_sequence, baseline) for changed_sequence, baseline
+                in self.gameStateListener.changed_game_states if changed_sequence > sequence]
+
+    def test_resync_after_idle_period(self):
+        self._client_post(events.SubscribeGameStateRequestEvent())
+        self._request_complete_game_state()
+        self._server_tick(5)
+        self._request_complete_game_state()
+
+        # nothing changes for a while, the client keeps acknowledging
+        self._server_tick(20)
+        acknowledged_sequence = self.gameStateListener.changed_game_states[-1][0]
+        self._client_post(events.GameStateAcknowledgeEvent(acknowledged_sequence))
+        self._server_tick()
+
+        # the client lost track and asks for everything again
+        complete_sequence = self._request_complete_game_state()
+        self.assertTrue(complete_sequence > acknowledged_sequence)
+
+        # the changed states after it follow on from it, there is no gap to resync over
+        self._client_post(events.GameStateAcknowledgeEvent(complete_sequence))
+        self._server_tick(3)
+        changed_game_states = self._get_changed_game_states_after(complete_sequence)
+        self.assertEqual(len(changed_game_states), 4)
+        for sequence, baseline in changed_game_states:
+            if baseline is None:
+                baseline = sequence - 1
+            self.assertTrue(baseline <= complete_sequence)
+
+    def test_complete_state_is_kept_while_nothing_changes(self):
+        self._client_post(events.SubscribeGameStateRequestEvent())
+        self._request_complete_game_state()
+        self._server_tick(5)
+        first_sequence = self._request_complete_game_state()
+        object_states = self.serverView.full_state[0]
+
+        # changed states go out with nothing in them
+        self._server_tick(10)
+        complete_sequence = self._request_complete_game_state()
+        self.assertTrue(self.serverView.full_state[0] is object_states)
+        self.assertTrue(complete_sequence > first_sequence)
+        self.assertEqual(self.gameStateListener.complete_object_states[-1],
+                         self.gameStateListener.complete_object_states[-2])
+
+        # something changes, it is packaged again
+        self.serverView._place_wall([3, 3])
+        self._server_tick()
+        self._request_complete_game_state()
+        self.assertFalse(self.serverView.full_state[0] is object_states)
+
+    def test_changed_state_before_complete_state_is_acknowledged(self):
+        self._client_post(events.SubscribeGameStateRequestEvent())
+        self._request_complete_game_state()
+        self._server_tick(5)
+        complete_sequence = self._request_complete_game_state()
+
+        # pushed before the client got to acknowledge the complete state
+        self._server_tick(2)
+        changed_game_states = self._get_changed_game_states_after(complete_sequence)
+        self.assertEqual(len(changed_game_states), 3)
+        for sequence, baseline in changed_game_states:
+            self.assertEqual(baseline, complete_sequence)
+
+
+    def test_complete_game_state_split_across_reconnect(self):
+        serverfactory.GAME_STATE_CHUNK_SIZE, chunk_size = 64, serverfactory.GAME_STATE_CHUNK_SIZE
+        self.addCleanup(setattr, serverfactory, 'GAME_STATE_CHUNK_SIZE', chunk_size)
+        for x in range(10):
+            self.serverView._place_wall([x + 2, 5])
+        self._server_tick()
+
+        # the connection drops after the first few chunks got through
+        self._client_post(events.CompleteGameStateRequestEvent())
+        self.serverEventManager.post(events.TickEvent(1 / 60.0))
+        self.serverTransport.stream = self.serverTransport.stream[:3]
+        self.pump.flush()
+        self.clientEventManager.post(events.TickEvent(0.0))
+        self.assertEqual(len(self.gameStateListener.complete_game_states), 0)
+        received_chunks, chunk_count = self.gameStateListener.complete_game_state_progress[-1]
+        self.assertEqual(received_chunks, 3)
+        self.assertTrue(chunk_count > 3)
+        self.serverTransport.loseConnection()
+        self.clientTransport.loseConnection()
+        self.pump.flush()
+
+        # we are someone else to the server now, with a new character
+        self.pump = self._connect(self.clientFactory.buildProtocol(None), 1)
+        self._client_post(events.CompleteGameStateRequestEvent())
+        self._server_tick()
+        self.assertEqual(len(self.gameStateListener.complete_game_states), 1)
+        sent_game_state = self.serverFactory.client_complete_game_states[1].get_encoded_game_state()
+        self.assertEqual(self.gameStateListener.complete_object_states[-1],
+                         statecodec.decode_object_states(sent_game_state))
+        character_id = self.serverView.clients[1].character_id
+        self.assertTrue(character_id in [object_state['object_id'] for object_state
+                                         in self.gameStateListener.complete_object_states[-1]])
+
+    def test_surplus_input_frames_do_not_move_the_character(self):
+        self._server_tick()
+        client = self.serverView.clients.values()[0]
+        character = self.serverView.characters[client.character_id]
+        character.position = [100, 100]
+        # a client sending far more frames than we step
+        for sequence in range(1, 21):
+            client.add_input_frame(events.InputFrameEvent(sequence, 'RIGHT', [], [[sequence, 1]]))
+        self.serverView._apply_input_frames()
+        self.assertEqual(character.get_position(), [100 + character.movement_speed, 100])
+        self.assertEqual(client.last_applied_input_sequence, 20 - self.serverView.max_buffered_input_frames + 1)
+        # the walls of the skipped frames are still placed
+        self.assertEqual(sorted(wall.get_grid_position() for wall in self.serverView.walls.values()),
+                         [[x, 1] for x in range(1, 19)])
+
+    def test_interests_follow_the_character(self):
+        self.serverView.interest_area = [96, 64]
+        self._server_tick()
+        client_number, client = self.serverView.clients.items()[0]
+        character = self.serverView.characters[client.character_id]
+        for x in range(0, 25, 2):
+            for y in range(0, 20, 3):
+                self.serverView._place_wall([x, y])
+        randomGenerator = random.Random(5)
+        for step in range(200):
+            character.move(randomGenerator.choice(['RIGHT', 'RIGHTDOWN', 'DOWN', 'LEFT', 'UP']))
+            if step % 25 == 0:
+                self.serverView.projectileSystem.add_projectile(character.get_position(), [400, 300])
+            self.serverView._update_objects(1 / 60.0)
+            self.serverView._prepare_changed_state()
+            # the same as looking at every object
+            left, top, right, bottom = self.serverView._get_interest_rect(client)
+            visible_object_ids = set([object_id for object_id in self.serverView.spatialHash.query_rect(
+                left, top, right, bottom) if self.serverView._get_object_state_name(object_id) != 'pending removal'])
+            visible_object_ids.add(character.id)
+            self.assertEqual(self.serverView.client_interests[client_number], visible_object_ids)
+
+    def test_objects_leaving_the_interest_area_are_despawned(self):
+        self.serverView.interest_area = [96, 64]
+        self._server_tick()
+        client_number, client = self.serverView.clients.items()[0]
+        character = self.serverView.characters[client.character_id]
+        # next to the character but out of its way
+        self.serverView._place_wall([0, 1])
+        wall_id = self.serverView.walls.keys()[0]
+        wall_states = []
+
+        def step(direction):
+            character.move(direction)
+            self.serverView._update_objects(1 / 60.0)
+            self.serverView._prepare_changed_state()
+            # what the client got this tick, before any delta coding
+            object_states = self.serverView.snapshot_history[-1][1][client_number]
+            wall_states.extend([object_state['object_state'] for object_state in object_states
+                                if object_state['object_id'] == wall_id])
+
+        step('')
+        self.assertEqual(wall_states, ['alive'])
+
+        # walk away from the wall, it goes out of view
+        for i in range(60):
+            step('RIGHT')
+        self.assertEqual(wall_states, ['alive', 'despawned'])
+        self.assertFalse(wall_id in self.serverView.client_interests[client_number])
+
+        # and comes back when we do
+        for i in range(60):
+            step('LEFT')
+        self.assertEqual(wall_states, ['alive', 'despawned', 'alive'])
+        self.assertTrue(wall_id in self.serverView.client_interests[client_number])
+
+    def test_map_sent_when_client_connects(self):
+        map_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, map_directory)
+        mapArtifact = mapartifact.MapLibrary(map_directory).get_map_artifact([25, 20], 'rooms',
+                                                                            {'number_of_rooms': 4}, 7)
+        self.serverFactory.map_event = events.MapEvent([25, 20], 'rooms', {'number_of_rooms': 4}, 7,
+                                                       mapArtifact.key)
+        self.pump = self._connect(self.clientFactory.buildProtocol(None), 1)
+        self._client_post(events.TickEvent(0.0))
+        self.assertEqual(len(self.gameStateListener.map_events), 1)
+
+        # the client makes the same map on its own
+        mapEvent = self.gameStateListener.map_events[0]
+        shutil.rmtree(map_directory)
+        clientMapArtifact = mapartifact.MapLibrary(map_directory).get_map_artifact(
+            mapEvent.map_dimensions, mapEvent.generator, mapEvent.parameters, mapEvent.seed)
+        self.assertEqual(clientMapArtifact.key, mapEvent.key)
+        self.assertTrue((clientMapArtifact.collision_array == mapArtifact.collision_array).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+##### CLIENT INTERPOLATION TESTS #####
+import unittest
+
+import interpolation
+
+
+class ServerClockTestCase(unittest.TestCase):
+    def test_no_render_time_before_a_server_time(self):
+        serverClock = interpolation.ServerClock()
+        self.assertEqual(serverClock.get_render_time(10.0), None)
+
+    def test_render_time_is_behind_the_server(self):
+        serverClock = interpolation.ServerClock(render_delay=0.1)
+        serverClock.add_server_time(5.0, 100.0)
+        self.assertAlmostEqual(serverClock.get_render_time(100.5), 5.4)
+
+    def test_offset_is_smoothed(self):
+        serverClock = interpolation.ServerClock(render_delay=0.0)
+        serverClock.add_server_time(5.0, 100.0)
+        # this state took a little longer to get to us
+        serverClock.add_server_time(5.0, 100.2)
+        self.assertAlmostEqual(serverClock.time_offset, -95.0 - 0.2 * serverClock.smoothing)
+
+    def test_big_jumps_are_taken_at_once(self):
+        serverClock = interpolation.ServerClock(render_delay=0.0)
+        serverClock.add_server_time(5.0, 100.0)
+        serverClock.add_server_time(50.0, 101.0)
+        self.assertAlmostEqual(serverClock.get_render_time(101.0), 50.0)
+
+    def test_render_time_never_goes_backwards(self):
+        serverClock = interpolation.ServerClock(render_delay=0.0)
+        serverClock.add_server_time(5.0, 100.0)
+        render_time = serverClock.get_render_time(100.3)
+        serverClock.add_server_time(5.2, 100.3)
+        self.assertTrue(serverClock.get_render_time(100.3) >= render_time)
+
+
+class InterpolationBufferTestCase(unittest.TestCase):
+    def setUp(self):
+        self.interpolationBuffer = interpolation.InterpolationBuffer(max_extrapolation_time=0.25,
+                                                                     correction_time=0.1)
+        self.interpolationBuffer.reset(1.0, [0.0, 0.0], [100.0, 0.0])
+        self.interpolationBuffer.add_state(1.1, [10.0, 0.0], [100.0, 0.0])
+        self.interpolationBuffer.add_state(1.2, [20.0, 10.0], [100.0, 0.0])
+
+    def _assert_position(self, position, expected_position):
+        self.assertAlmostEqual(position[0], expected_position[0])
+        self.assertAlmostEqual(position[1], expected_position[1])
+
+    def test_interpolates_between_states(self):
+        self._assert_position(self.interpolationBuffer.get_position(1.05), [5.0, 0.0])
+        self._assert_position(self.interpolationBuffer.get_position(1.15), [15.0, 5.0])
+
+    def test_before_the_first_state(self):
+        self._assert_position(self.interpolationBuffer.get_position(0.5), [0.0, 0.0])
+
+    def test_extrapolates_for_a_while(self):
+        self._assert_position(self.interpolationBuffer.get_position(1.3), [30.0, 10.0])
+        # no further than max_extrapolation_time
+        self._assert_position(self.interpolationBuffer.get_position(2.0), [45.0, 10.0])
+
+    def test_no_render_time_is_the_newest_state(self):
+        self._assert_position(self.interpolationBuffer.get_position(None), [20.0, 10.0])
+
+    def test_old_states_are_ignored(self):
+        self.interpolationBuffer.add_state(1.05, [500.0, 500.0], [0.0, 0.0])
+        self._assert_position(self.interpolationBuffer.get_position(1.05), [5.0, 0.0])
+
+    def test_jumps_are_smoothed_out(self):
+        self._assert_position(self.interpolationBuffer.get_position(1.15), [15.0, 5.0])
+        # the server sends the newest state again, somewhere else
+        self.interpolationBuffer.add_state(1.2, [20.0, 40.0], [100.0, 0.0])
+        self._assert_position(self.interpolationBuffer.get_position(1.15), [15.0, 5.0])
+        # half way through the correction, half of the difference is left
+        self._assert_position(self.interpolationBuffer.get_position(1.2), [20.0, 32.5])
+        self._assert_position(self.interpolationBuffer.get_position(1.25), [25.0, 40.0])
+
+    def test_reset_forgets_everything(self):
+        self.interpolationBuffer.get_position(1.15)
+        self.interpolationBuffer.reset(3.0, [100.0, 100.0], [0.0, 0.0])
+        self._assert_position(self.interpolationBuffer.get_position(3.0), [100.0, 100.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+##### MAP ARTIFACT TESTS #####
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import mapartifact
+
+
+class MapArtifactTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def _assert_same_map(self, mapArtifact, otherMapArtifact):
+        self.assertEqual(list(mapArtifact.map_dimensions), list(otherMapArtifact.map_dimensions))
+        self.assertEqual(mapArtifact.key, otherMapArtifact.key)
+        self.assertTrue(numpy.array_equal(mapArtifact.collision_array, otherMapArtifact.collision_array))
+        self.assertTrue(numpy.array_equal(mapArtifact.terrain_array, otherMapArtifact.terrain_array))
+        self.assertTrue(numpy.array_equal(mapArtifact.gravity_array, otherMapArtifact.gravity_array))
+
+    def test_write_and_load(self):
+        for generator, parameters in [('rooms', {'number_of_rooms': 8}),
+                                      ('caves', {'number_of_generations': 2})]:
+            mapArtifact = mapartifact.generate_map_artifact([33, 21], generator, parameters, seed=4)
+            path = os.path.join(self.directory, generator + '.map')
+            mapartifact.write_map_artifact(mapArtifact, path)
+            loadedMapArtifact = mapartifact.load_map_artifact(path)
+            self._assert_same_map(mapArtifact, loadedMapArtifact)
+
+    def test_same_key_same_map(self):
+        mapArtifact = mapartifact.generate_map_artifact([30, 30], 'rooms', {'number_of_rooms': 8}, seed=9)
+        self._assert_same_map(mapArtifact, mapartifact.generate_map_artifact([30, 30], 'rooms',
+                                                                             {'number_of_rooms': 8}, seed=9))
+        otherMapArtifact = mapartifact.generate_map_artifact([30, 30], 'rooms', {'number_of_rooms': 8}, seed=10)
+        self.assertNotEqual(mapArtifact.key, otherMapArtifact.key)
+
+    def test_library(self):
+        mapLibrary = mapartifact.MapLibrary(os.path.join(self.directory, 'maps'))
+        mapArtifact = mapLibrary.get_map_artifact([25, 20], 'rooms', {'number_of_rooms': 6}, 3)
+        self.assertTrue(os.path.exists(mapLibrary.get_map_path(mapArtifact.key)))
+        self._assert_same_map(mapArtifact, mapLibrary.load_map_artifact(mapArtifact.key))
+        self._assert_same_map(mapArtifact, mapartifact.generate_map_artifact([25, 20], 'rooms',
+                                                                             {'number_of_rooms': 6}, 3))
+
+    def test_collision_grid_is_a_copy(self):
+        mapArtifact = mapartifact.MapLibrary(self.directory).get_map_artifact([25, 20], 'caves')
+        collisionGrid = mapArtifact.get_collision_grid()
+        # the loaded layers are read only
+        x, y = numpy.argwhere(mapArtifact.collision_array == 0)[0]
+        collisionGrid.close_tile([x, y])
+        self.assertFalse(collisionGrid.is_tile_open([x, y]))
+        self.assertEqual(mapArtifact.collision_array[x, y], 0)
+
+    def test_bad_files(self):
+        path = os.path.join(self.directory, 'bad.map')
+        mapartifact.write_map_artifact(mapartifact.generate_map_artifact([10, 10], 'caves'), path)
+        map_file = open(path, 'ab')
+        map_file.write('\x00')
+        map_file.close()
+        self.assertRaises(RuntimeError, mapartifact.load_map_artifact, path)
+
+        map_file = open(path, 'wb')
+        map_file.write('not a map file at all, not even a little bit')
+        map_file.close()
+        self.assertRaises(RuntimeError, mapartifact.load_map_artifact, path)
+
+    def test_unknown_generator(self):
+        self.assertRaises(RuntimeError, mapartifact.generate_map_artifact, [10, 10], 'mountains')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,269 @@
+##### MAP GRID TESTS #####
+import random
+import unittest
+
+import numpy
+
+import mapgrid
+
+
+class CollisionGridTestCase(unittest.TestCase):
+    def setUp(self):
+        self.collisionGrid = mapgrid.CollisionGrid([8, 6])
+        self.collisionGrid.close_tile([2, 3])
+        self.collisionGrid.close_rect([5, 0], [6, 1])
+
+    def test_rects(self):
+        self.assertEqual(int(self.collisionGrid.collision_array.sum()), 5)
+        self.assertFalse(self.collisionGrid.is_tile_open([6, 1]))
+        # cut down to the map
+        self.collisionGrid.close_rect([-3, -3], [0, 0])
+        self.assertEqual(int(self.collisionGrid.collision_array.sum()), 6)
+        self.collisionGrid.open_rect([0, 0], [20, 20])
+        self.assertFalse(self.collisionGrid.collision_array.any())
+
+    def test_tile_values(self):
+        grid_positions = [[2, 3], [0, 0], [-1, 0], [8, 5], [5, 1]]
+        tile_values = self.collisionGrid.get_tile_values(grid_positions)
+        self.assertEqual(tile_values.tolist(), [1, 0, mapgrid.CollisionGrid.OFF_MAP,
+                                                mapgrid.CollisionGrid.OFF_MAP, 1])
+        # off the map counts as open
+        self.assertEqual(self.collisionGrid.are_tiles_open(grid_positions).tolist(),
+                         [self.collisionGrid.is_tile_open(grid_position) for grid_position in grid_positions])
+
+    def test_surrounding_tiles(self):
+        grid_positions = [[x, y] for x in range(-1, 9) for y in range(-1, 7)]
+        surrounding_tiles = self.collisionGrid.get_surrounding_tiles_many(grid_positions)
+        for grid_position, tile_values in zip(grid_positions, surrounding_tiles):
+            # the same as looking at the tiles one at a time
+            expected_tile_values = []
+            for y_offset in [-1, 0, 1]:
+                for x_offset in [-1, 0, 1]:
+                    x = grid_position[0] + x_offset
+                    y = grid_position[1] + y_offset
+                    if 0 <= x < 8 and 0 <= y < 6:
+                        expected_tile_values.append(int(self.collisionGrid.collision_array[x, y]))
+                    else:
+                        expected_tile_values.append(None)
+            self.assertEqual(list(self.collisionGrid.get_surrounding_tiles(*grid_position)), expected_tile_values)
+            self.assertEqual([None if tile_value == mapgrid.CollisionGrid.OFF_MAP else tile_value
+                              for tile_value in tile_values.tolist()], expected_tile_values)
+
+    def test_starts_from_a_copy(self):
+        collision_array = numpy.zeros((8, 6), numpy.uint8)
+        collisionGrid = mapgrid.CollisionGrid([8, 6], collision_array)
+        collisionGrid.close_tile([1, 1])
+        self.assertEqual(collision_array[1, 1], 0)
+
+
+class SpatialHashTestCase(unittest.TestCase):
+    def setUp(self):
+        self.spatialHash = mapgrid.SpatialHash(32)
+        randomGenerator = random.Random(3)
+        self.positions = {}
+        for object_id in range(200):
+            position = [randomGenerator.uniform(-100, 800), randomGenerator.uniform(-100, 600)]
+            self.positions[object_id] = position
+            self.spatialHash.insert(object_id, position)
+
+    def _get_object_ids_in_rect(self, left, top, right, bottom):
+        '''what query_rect should find, looking at every object'''
+        return sorted([object_id for object_id, position in self.positions.items()
+                       if left <= position[0] <= right and top <= position[1] <= bottom])
+
+    def test_query_rect(self):
+        for rect in [(0, 0, 64, 64), (-100, -100, 800, 600), (100.5, 200.25, 130, 700), (5, 5, 5, 5)]:
+            self.assertEqual(sorted(self.spatialHash.query_rect(*rect)), self._get_object_ids_in_rect(*rect))
+
+    def test_query_radius(self):
+        center = [300, 250]
+        object_ids = sorted([object_id for object_id, position in self.positions.items()
+                             if (position[0] - center[0]) ** 2 + (position[1] - center[1]) ** 2 <= 90 ** 2])
+        self.assertEqual(sorted(self.spatialHash.query_radius(center, 90)), object_ids)
+
+    def test_move(self):
+        self.spatialHash.move(7, [1000, 1000])
+        self.positions[7] = [1000, 1000]
+        self.assertEqual(self.spatialHash.get_cell_object_ids([31, 31]), [7])
+        self.assertEqual(self.spatialHash.get_position(7), [1000, 1000])
+        self.assertEqual(sorted(self.spatialHash.query_rect(0, 0, 400, 400)),
+                         self._get_object_ids_in_rect(0, 0, 400, 400))
+
+    def test_remove(self):
+        self.spatialHash.remove(7)
+        del self.positions[7]
+        self.assertFalse(7 in self.spatialHash)
+        self.assertEqual(len(self.spatialHash), 199)
+        self.assertEqual(sorted(self.spatialHash.query_rect(-100, -100, 800, 600)),
+                         self._get_object_ids_in_rect(-100, -100, 800, 600))
+        # removing it again does nothing
+        self.spatialHash.remove(7)
+
+    def test_insert_twice(self):
+        self.assertRaises(RuntimeError, self.spatialHash.insert, 7, [0, 0])
+
+    def test_cells_on_segment(self):
+        self.assertEqual(self.spatialHash.get_cells_on_segment([16, 16], [16 + 32 * 3, 16]),
+                         [(0, 0), (1, 0), (2, 0), (3, 0)])
+        cells = self.spatialHash.get_cells_on_segment([10, 10], [300, 170])
+        self.assertEqual(cells[0], (0, 0))
+        self.assertEqual(cells[-1], (9, 5))
+        # every step goes to a side neighbour, no cell is skipped
+        for cell, next_cell in zip(cells, cells[1:]):
+            self.assertEqual(abs(next_cell[0] - cell[0]) + abs(next_cell[1] - cell[1]), 1)
+
+    def test_rect_difference(self):
+        self.assertEqual(mapgrid.get_rect_difference((0, 0, 10, 10), (20, 20, 30, 30)), [(0, 0, 10, 10)])
+        self.assertEqual(mapgrid.get_rect_difference((0, 0, 10, 10), (0, 0, 10, 10)), [])
+        # every point of rect outside other_rect is in one of the rects
+        rect, other_rect = (0, 0, 10, 10), (3, -2, 13, 8)
+        rects = mapgrid.get_rect_difference(rect, other_rect)
+        for x in range(0, 11):
+            for y in range(0, 11):
+                if not (3 <= x <= 13 and -2 <= y <= 8):
+                    self.assertTrue(any(left <= x <= right and top <= y <= bottom
+                                        for left, top, right, bottom in rects))
+
+    def test_changed_object_ids(self):
+        spatialHash = mapgrid.SpatialHash(32, track_changes=True)
+        spatialHash.insert(1, [0, 0])
+        spatialHash.insert(2, [0, 0])
+        self.assertEqual(spatialHash.pop_changed_object_ids(), set([1, 2]))
+        spatialHash.move(1, [5, 5])
+        spatialHash.remove(2)
+        self.assertEqual(spatialHash.pop_changed_object_ids(), set([1, 2]))
+        self.assertEqual(spatialHash.pop_changed_object_ids(), set())
+        # nothing is kept when it isn't asked for
+        self.assertEqual(self.spatialHash.pop_changed_object_ids(), set())
+
+
+class GravityGridTestCase(unittest.TestCase):
+    def setUp(self):
+        self.map_dimensions = [20, 15]
+        self.gravityGrid = mapgrid.GravityGrid(self.map_dimensions)
+        # the grid starts with a point of its own
+        self.gravityGrid.remove_gravity_point(0)
+
+    def _get_gravity_field(self, gravity_points):
+        '''what the field should be, one tile and one point at a time'''
+        gravity_field = numpy.zeros((self.map_dimensions[0], self.map_dimensions[1], 2))
+        for gravity_position, radius, force_denometer in gravity_points:
+            for x in range(gravity_position[0] - radius, gravity_position[0] + radius + 1):
+                for y in range(gravity_position[1] - radius, gravity_position[1] + radius + 1):
+                    if 0 <= x < self.map_dimensions[0] and 0 <= y < self.map_dimensions[1]:
+                        gravity_field[x, y, 0] += (gravity_position[0] - x) / float(force_denometer)
+                        gravity_field[x, y, 1] += (gravity_position[1] - y) / float(force_denometer)
+        return gravity_field
+
+    def test_starts_empty(self):
+        self.assertFalse(self.gravityGrid.gravity_field.any())
+
+    def test_add(self):
+        self.gravityGrid.add_gravity_point([4, 4], 5, 1)
+        # cut off by the edge of the map
+        self.gravityGrid.add_gravity_point([18, 1], 3, 2)
+        numpy.testing.assert_allclose(self.gravityGrid.gravity_field,
+                                      self._get_gravity_field([([4, 4], 5, 1), ([18, 1], 3, 2)]))
+
+    def test_move(self):
+        point_id = self.gravityGrid.add_gravity_point([4, 4], 5, 1)
+        self.gravityGrid.add_gravity_point([10, 10], 2, 1)
+        self.gravityGrid.move_gravity_point(point_id, [12, 7])
+        numpy.testing.assert_allclose(self.gravityGrid.gravity_field,
+                                      self._get_gravity_field([([12, 7], 5, 1), ([10, 10], 2, 1)]))
+
+    def test_move_off_the_map_and_back(self):
+        point_id = self.gravityGrid.add_gravity_point([4, 4], 2, 1)
+        self.gravityGrid.move_gravity_point(point_id, [-50, -50])
+        numpy.testing.assert_allclose(self.gravityGrid.gravity_field, 0, atol=1e-12)
+        self.gravityGrid.move_gravity_point(point_id, [6, 6])
+        numpy.testing.assert_allclose(self.gravityGrid.gravity_field, self._get_gravity_field([([6, 6], 2, 1)]))
+
+    def test_remove(self):
+        point_id = self.gravityGrid.add_gravity_point([4, 4], 5, 1)
+        self.gravityGrid.add_gravity_point([10, 10], 2, 1)
+        self.gravityGrid.remove_gravity_point(point_id)
+        numpy.testing.assert_allclose(self.gravityGrid.gravity_field,
+                                      self._get_gravity_field([([10, 10], 2, 1)]), atol=1e-12)
+        self.assertRaises(KeyError, self.gravityGrid.remove_gravity_point, point_id)
+
+    def test_get_gravity_at_tile_centers(self):
+        self.gravityGrid.add_gravity_point([4, 4], 5, 1)
+        tile_size = self.gravityGrid.tile_size
+        for grid_position in [[0, 0], [4, 4], [7, 2], [19, 14]]:
+            position = [(grid_position[0] + 0.5) * tile_size, (grid_position[1] + 0.5) * tile_size]
+            numpy.testing.assert_allclose(self.gravityGrid.get_gravity(position),
+                                          self.gravityGrid.gravity_field[grid_position[0], grid_position[1]])
+
+
+class TerrainGridTestCase(unittest.TestCase):
+    def test_rooms_placed(self):
+        terrainGrid = mapgrid.TerrainGrid([100, 100], 30, seed=1)
+        self.assertEqual(terrainGrid.rooms_placed, 30)
+
+    def test_too_many_rooms_stops(self):
+        terrainGrid = mapgrid.TerrainGrid([25, 20], 200, seed=1)
+        self.assertTrue(0 < terrainGrid.rooms_placed < 200)
+
+    def test_same_seed_same_map(self):
+        terrainGrid = mapgrid.TerrainGrid([40, 40], 10, seed=5)
+        otherTerrainGrid = mapgrid.TerrainGrid([40, 40], 10, seed=5)
+        self.assertTrue((terrainGrid.terrain_map_grid == otherTerrainGrid.terrain_map_grid).all())
+
+
+class OutsideTerrainGridTestCase(unittest.TestCase):
+    def _step(self, grid, threshold, close_neighbor_threshold, edge_policy):
+        '''one generation, one tile at a time'''
+        width, height = grid.shape
+
+        def get_tile(x, y):
+            if 0 <= x < width and 0 <= y < height:
+                return grid[x, y]
+            if edge_policy == 'wrap':
+                return grid[x % width, y % height]
+            return int(edge_policy == 'filled')
+
+        next_grid = numpy.zeros(grid.shape, numpy.uint8)
+        for x in range(width):
+            for y in range(height):
+                close_neighbors = sum([get_tile(x + x_offset, y + y_offset) for x_offset, y_offset
+                                       in [(0, 0), (0, -1), (-1, 0), (1, 0), (0, 1)]])
+                far_neighbors = sum([get_tile(x + x_offset, y + y_offset) for x_offset, y_offset
+                                     in [(-1, -1), (1, -1), (-1, 1), (1, 1)]])
+                next_grid[x, y] = (close_neighbors + far_neighbors > threshold or
+                                   close_neighbors > close_neighbor_threshold)
+        return next_grid
+
+    def test_matches_one_tile_at_a_time(self):
+        for edge_policy in mapgrid.OutsideTerrainGrid.EDGE_POLICIES:
+            outsideTerrainGrid = mapgrid.OutsideTerrainGrid([12, 9], 3, seed=2, birth_thresholds=(4,),
+                                                            survival_thresholds=(4,), edge_policy=edge_policy)
+            grid = outsideTerrainGrid.empty_outside_terrain_grid
+            for generation in range(3):
+                grid = self._step(grid, 4, 3, edge_policy)
+            self.assertEqual(outsideTerrainGrid.outside_terrain_grid.tolist(), grid.tolist())
+
+    def test_candidate_maps(self):
+        outsideTerrainGrid = mapgrid.OutsideTerrainGrid([10, 10], seed=3, birth_thresholds=(4,),
+                                                        survival_thresholds=(4,), edge_policy='wrap')
+        noise_grids = outsideTerrainGrid._generate_noise_grids(5)
+        candidate_maps = outsideTerrainGrid._generate_outside_terrain(noise_grids, 2)
+        self.assertEqual(candidate_maps.shape, (5, 10, 10))
+        # the stack steps the same as each map on its own
+        for noise_grid, candidate_map in zip(noise_grids, candidate_maps):
+            self.assertEqual(outsideTerrainGrid._generate_outside_terrain(noise_grid, 2).tolist(),
+                             candidate_map.tolist())
+        self.assertEqual(outsideTerrainGrid.generate_candidate_maps(3, 1).shape, (3, 10, 10))
+
+    def test_same_seed_same_caves(self):
+        outsideTerrainGrid = mapgrid.OutsideTerrainGrid([20, 15], 2, seed=8)
+        otherOutsideTerrainGrid = mapgrid.OutsideTerrainGrid([20, 15], 2, seed=8)
+        self.assertEqual(outsideTerrainGrid.outside_terrain_grid.tolist(),
+                         otherOutsideTerrainGrid.outside_terrain_grid.tolist())
+
+    def test_unknown_edge_policy(self):
+        self.assertRaises(RuntimeError, mapgrid.OutsideTerrainGrid, [10, 10], edge_policy='mirror')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+##### CHARACTER MOVEMENT TESTS #####
+import unittest
+
+import mapgrid
+import movement
+
+TILE_SIZE = 32
+SPEED = movement.CHARACTER_MOVEMENT_SPEED
+
+
+class MoveCharacterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.collisionGrid = mapgrid.CollisionGrid([10, 10])
+
+    def _move(self, position, direction):
+        return movement.move_character(position, direction, SPEED, TILE_SIZE, self.collisionGrid)
+
+    def test_steps(self):
+        self.assertEqual(self._move([100, 100], 'UP'), [100, 100 - SPEED])
+        self.assertEqual(self._move([100, 100], 'RIGHT'), [100 + SPEED, 100])
+        self.assertEqual(self._move([100, 100], ''), [100, 100])
+        position = self._move([100, 100], 'LEFTDOWN')
+        self.assertAlmostEqual(position[0], 100 - SPEED * .707)
+        self.assertAlmostEqual(position[1], 100 + SPEED * .707)
+
+    def test_walls_push_back(self):
+        self.collisionGrid.close_tile([4, 3])
+        # the right side of the character would go into the wall
+        position = self._move([4 * TILE_SIZE - TILE_SIZE - 1, 3 * TILE_SIZE], 'RIGHT')
+        self.assertTrue(position[0] + TILE_SIZE - 1 < 4 * TILE_SIZE + 1)
+        self.assertEqual(position[1], 3 * TILE_SIZE)
+
+    def test_never_ends_in_a_wall(self):
+        self.collisionGrid.close_tile([5, 5])
+        position = [5 * TILE_SIZE, 2 * TILE_SIZE]
+        for step in range(40):
+            position = self._move(position, 'DOWN')
+            grid_position = mapgrid.convert_position_to_grid_position(
+                [position[0] + TILE_SIZE / 2, position[1] + TILE_SIZE / 2], TILE_SIZE)
+            self.assertNotEqual(grid_position, [5, 5])
+        self.assertTrue(position[1] + TILE_SIZE - 1 <= 5 * TILE_SIZE)
+
+
+class CharacterPredictorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.collisionGrid = mapgrid.CollisionGrid([10, 10])
+        self.characterPredictor = movement.CharacterPredictor(TILE_SIZE, self.collisionGrid)
+
+    def _add_input_frame(self, sequence, direction):
+        '''one frame a step, like the client's ticks'''
+        self.characterPredictor.add_time(movement.STEP_TIME)
+        self.characterPredictor.add_input_frame(sequence, direction)
+
+    def test_nothing_before_the_server_says_where_we_are(self):
+        self.characterPredictor.add_input_frame(1, 'RIGHT')
+        self.assertEqual(self.characterPredictor.get_position(), None)
+
+    def test_frames_move_right_away(self):
+        self.characterPredictor.set_server_state([100, 100], 0)
+        self._add_input_frame(1, 'RIGHT')
+        self._add_input_frame(2, 'RIGHT')
+        self.assertEqual(self.characterPredictor.get_position(), [100 + 2 * SPEED, 100])
+
+    def test_one_step_a_step(self):
+        self.characterPredictor.set_server_state([100, 100], 0)
+        self.characterPredictor.add_time(movement.STEP_TIME)
+        for sequence in range(1, 21):
+            self.characterPredictor.add_input_frame(sequence, 'RIGHT')
+        self.assertEqual(self.characterPredictor.get_position(), [100 + SPEED, 100])
+        # the frames that didn't move aren't moved again when they are replayed
+        self.characterPredictor.set_server_state([100, 100], 0)
+        self.assertEqual(self.characterPredictor.get_position(), [100 + SPEED, 100])
+
+    def test_a_short_burst_still_moves(self):
+        self.characterPredictor.set_server_state([100, 100], 0)
+        # a long tick with a few frames after it, the server buffers those
+        self.characterPredictor.add_time(10 * movement.STEP_TIME)
+        for sequence in range(1, 6):
+            self.characterPredictor.add_input_frame(sequence, 'RIGHT')
+        self.assertEqual(self.characterPredictor.get_position(),
+                         [100 + movement.MAX_BUFFERED_INPUT_FRAMES * SPEED, 100])
+
+    def test_replays_the_frames_the_server_has_not_applied(self):
+        self.characterPredictor.set_server_state([100, 100], 0)
+        for sequence in range(1, 6):
+            self._add_input_frame(sequence, 'DOWN')
+        # the server applied two, and had us somewhere else
+        self.characterPredictor.set_server_state([50, 60], 2)
+        self.assertEqual(self.characterPredictor.get_position(), [50, 60 + 3 * SPEED])
+        self.assertEqual([sequence for sequence, direction in self.characterPredictor.pending_input_frames],
+                         [3, 4, 5])
+
+    def test_same_steps_as_the_server(self):
+        self.collisionGrid.close_tile([4, 3])
+        directions = ['RIGHT'] * 20 + ['RIGHTDOWN'] * 10 + ['', 'UP'] * 5
+        server_position = [TILE_SIZE, 3 * TILE_SIZE]
+        self.characterPredictor.set_server_state(server_position, 0)
+        for sequence, direction in enumerate(directions):
+            self._add_input_frame(sequence + 1, direction)
+            server_position = movement.move_character(server_position, direction, SPEED,
+                                                      TILE_SIZE, self.collisionGrid)
+        self.assertEqual(self.characterPredictor.get_position(), server_position)
+        self.characterPredictor.set_server_state(server_position, len(directions))
+        self.assertEqual(self.characterPredictor.get_position(), server_position)
+
+
+if __name__ == '__main__':
+    unittest.main()
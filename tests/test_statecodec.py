@@ -0,0 +1,126 @@
+##### GAME STATE CODEC TESTS #####
+import unittest
+
+import statecodec
+
+# the values around every varint byte length
+VARINT_BOUNDARIES = [0, 1, 0x7f, 0x80, 0x3fff, 0x4000, 0x1fffff, 0x200000,
+                     0xfffffff, 0x10000000, 2 ** 32 - 1, 2 ** 32]
+
+
+def make_object_state(object_id, position, velocity, object_type='character', object_state='alive'):
+    return {'object_type': object_type,
+            'object_id': object_id,
+            'object_position': list(position),
+            'object_velocity': list(velocity),
+            'object_state': object_state}
+
+
+class VarintTestCase(unittest.TestCase):
+    def test_varint_round_trip(self):
+        for value in VARINT_BOUNDARIES:
+            encoded = statecodec._encode_varint(value)
+            self.assertEqual(statecodec._decode_varint(encoded, 0), (value, len(encoded)))
+
+    def test_varint_lengths(self):
+        self.assertEqual(len(statecodec._encode_varint(0x7f)), 1)
+        self.assertEqual(len(statecodec._encode_varint(0x80)), 2)
+        self.assertEqual(len(statecodec._encode_varint(0x3fff)), 2)
+        self.assertEqual(len(statecodec._encode_varint(0x4000)), 3)
+
+    def test_signed_varint_round_trip(self):
+        for value in VARINT_BOUNDARIES:
+            for signed_value in [value, -value, -value - 1]:
+                encoded = statecodec._encode_signed_varint(signed_value)
+                self.assertEqual(statecodec._decode_signed_varint(encoded, 0), (signed_value, len(encoded)))
+
+    def test_small_negative_numbers_stay_small(self):
+        self.assertEqual(len(statecodec._encode_signed_varint(-64)), 1)
+        self.assertEqual(len(statecodec._encode_signed_varint(-65)), 2)
+
+
+class ObjectStatesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.object_states = [make_object_state(0, [0.0, 0.0], [0.0, 0.0], 'default', 'default')]
+        # 0 is the default object's
+        for object_id in VARINT_BOUNDARIES[1:]:
+            self.object_states.append(make_object_state(object_id, [100.5, 20.25], [-3.0, 0.75]))
+        self.object_states.append(make_object_state(5000, [64.0, 32.0], [0.0, 0.0], 'wall', 'despawned'))
+
+    def test_float_round_trip(self):
+        encoded = statecodec.encode_object_states(self.object_states)
+        self.assertEqual(statecodec.decode_object_states(encoded), self.object_states)
+
+    def test_quantized_round_trip(self):
+        encoded = statecodec.encode_object_states(self.object_states, quantized=True)
+        self.assertEqual(statecodec.decode_object_states(encoded), self.object_states)
+
+    def test_quantize_out_of_range(self):
+        object_state = make_object_state(1, [10000.0, 0.0], [0.0, 0.0])
+        self.assertRaises(RuntimeError, statecodec.encode_object_states, [object_state], True)
+
+    def test_unknown_object_type(self):
+        object_state = make_object_state(1, [0.0, 0.0], [0.0, 0.0], 'boulder')
+        self.assertRaises(RuntimeError, statecodec.encode_object_states, [object_state])
+
+    def test_delta_round_trip(self):
+        serverReferences = statecodec.DeltaReferences()
+        clientReferences = statecodec.DeltaReferences()
+        moved_object_states = [make_object_state(object_state['object_id'],
+                                                 [object_state['object_position'][0] + 2.5,
+                                                  object_state['object_position'][1] - 300.0],
+                                                 object_state['object_velocity'],
+                                                 object_state['object_type'], object_state['object_state'])
+                               for object_state in self.object_states]
+
+        # the first one has nothing to be relative to, the second is relative to the first
+        for sequence, baseline, object_states in [(1, None, self.object_states),
+                                                  (2, 1, moved_object_states)]:
+            encoded = statecodec.encode_delta_object_states(object_states, sequence, baseline, serverReferences)
+            decoded = statecodec.decode_object_states(encoded, clientReferences, sequence, baseline)
+            # despawned objects are only sent by id
+            expected_object_states = [make_object_state(object_state['object_id'], [0.0, 0.0], [0.0, 0.0],
+                                                        object_state['object_type'], 'despawned')
+                                      if object_state['object_state'] == 'despawned' else object_state
+                                      for object_state in object_states]
+            self.assertEqual(decoded, expected_object_states)
+
+    def test_delta_records_shared_between_clients(self):
+        # two clients with the same baseline and one that knows nothing
+        client_references = [(statecodec.DeltaReferences(), statecodec.DeltaReferences(), 1),
+                             (statecodec.DeltaReferences(), statecodec.DeltaReferences(), 1),
+                             (statecodec.DeltaReferences(), statecodec.DeltaReferences(), None)]
+        for serverReferences, clientReferences, baseline in client_references[:2]:
+            encoded = statecodec.encode_delta_object_states(self.object_states, 1, None, serverReferences)
+            statecodec.decode_object_states(encoded, clientReferences, 1, None)
+
+        delta_records = {}
+        moved_object_states = [make_object_state(object_state['object_id'],
+                                                 [object_state['object_position'][0] + 1.0,
+                                                  object_state['object_position'][1]],
+                                                 object_state['object_velocity'],
+                                                 object_state['object_type'], object_state['object_state'])
+                               for object_state in self.object_states]
+        encoded_states = []
+        for serverReferences, clientReferences, baseline in client_references:
+            encoded = statecodec.encode_delta_object_states(moved_object_states, 2, baseline,
+                                                            serverReferences, delta_records)
+            encoded_states.append(encoded)
+            decoded = statecodec.decode_object_states(encoded, clientReferences, 2, baseline)
+            self.assertEqual([object_state['object_id'] for object_state in decoded],
+                             [object_state['object_id'] for object_state in moved_object_states])
+        self.assertEqual(encoded_states[0], encoded_states[1])
+        self.assertNotEqual(encoded_states[0], encoded_states[2])
+        # one record relative to sequence 1 and one on its own for every object still there
+        alive_count = len([object_state for object_state in moved_object_states
+                           if object_state['object_state'] != 'despawned'])
+        self.assertEqual(len(delta_records), 2 * alive_count)
+
+    def test_delta_needs_references(self):
+        encoded = statecodec.encode_delta_object_states(self.object_states, 1, None,
+                                                        statecodec.DeltaReferences())
+        self.assertRaises(RuntimeError, statecodec.decode_object_states, encoded)
+
+
+if __name__ == '__main__':
+    unittest.main()
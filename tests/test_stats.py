@@ -0,0 +1,89 @@
+##### GAME STATS TESTS #####
+import sys
+import unittest
+from StringIO import StringIO
+
+import events
+import stats
+
+
+class HistogramTestCase(unittest.TestCase):
+    def test_buckets(self):
+        histogram = stats.Histogram(number_of_buckets=8)
+        for value in [0, 1, 2, 3, 4, 7, 8, 1000]:
+            histogram.add(value)
+        # 0 | 1 | 2-3 | 4-7 | 8-15 | ... and everything too big in the last one
+        self.assertEqual(histogram.buckets, [1, 1, 2, 2, 1, 0, 0, 1])
+        self.assertEqual(histogram.count, 8)
+        self.assertEqual(histogram.total, 1025)
+        self.assertEqual(histogram.max, 1000)
+
+    def test_percentiles(self):
+        histogram = stats.Histogram()
+        self.assertEqual(histogram.get_percentile(0.5), 0)
+        for value in range(1, 101):
+            histogram.add(value)
+        # the top of the bucket the value falls into, never more than the max
+        self.assertEqual(histogram.get_percentile(0.5), 63)
+        self.assertEqual(histogram.get_percentile(0.99), 100)
+        summary = histogram.get_summary()
+        self.assertEqual(summary['count'], 100)
+        self.assertAlmostEqual(summary['mean'], 50.5)
+        self.assertEqual(summary['max'], 100)
+
+
+class Listener():
+    def __init__(self, eventManager):
+        eventManager.add_listener(self, ['Tick Event', 'Text Message Event'])
+
+    def notify(self, event):
+        pass
+
+
+class StatsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stats = stats.Stats(dump_interval=10.0)
+        self.eventManager = events.EventManager(self.stats)
+        self.listener = Listener(self.eventManager)
+
+    def test_counts_events(self):
+        self.eventManager.post(events.TextMessageEvent('hello', False))
+        self.eventManager.post(events.TextMessageEvent('hello again', False))
+        self.eventManager.post(events.TickEvent(0.0))
+        game_stats = self.stats.get_stats()
+        self.assertEqual(game_stats['event_counts'], {'Text Message Event': 2, 'Tick Event': 1})
+        self.assertEqual(game_stats['queue_depth']['count'], 1)
+        self.assertEqual(game_stats['queue_depth']['max'], 3)
+        self.assertEqual(game_stats['listener_microseconds']['Listener']['count'], 3)
+
+    def test_phase_times(self):
+        self.stats.record_phase_time('update', 0.002)
+        self.stats.record_phase_time('update', 0.004)
+        summary = self.stats.get_stats()['phase_microseconds']['update']
+        self.assertEqual(summary['count'], 2)
+        self.assertAlmostEqual(summary['mean'], 3000, delta=1)
+
+    def test_dump(self):
+        self.eventManager.post(events.TickEvent(0.0))
+        self.stats.record_phase_time('update', 0.002)
+        text = self.stats.format_stats()
+        self.assertTrue('phase update: 1 calls' in text)
+        self.assertTrue('listener Listener: 1 calls' in text)
+        self.assertTrue('event Tick Event: 1' in text)
+
+        # not due yet, nothing is printed or reset
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.stats.dump_if_due()
+            self.assertEqual(sys.stdout.getvalue(), '')
+            self.stats.start_time -= 10.0
+            self.stats.dump_if_due()
+            self.assertTrue('event Tick Event: 1' in sys.stdout.getvalue())
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(self.stats.get_stats()['event_counts'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
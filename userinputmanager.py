@@ -7,7 +7,7 @@ class UserInputManager():
     ''' gets user input from the mouse and keyboard'''
     def __init__(self, eventManager):
         self.eventManager = eventManager
-        self.eventManager.add_listener(self)
+        self.eventManager.add_listener(self, ['Tick Event'])
         self.shooting = True
 
     def notify(self, event):